@@ -1,33 +1,359 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify, abort, send_file, Response, make_response, current_app
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
-import razorpay
+import hashlib
+import threading
+import time
+import types
+import hmac
+import math
+import jinja2
+import db_pool
+import migrate_db
+import catalog
+import catalog_cache
+import payment_orders
+import checkout_engine
+import sales
+import cart
+import product_import
+import exports
+import users
+import credentials
+import images
+import assets
+import metrics
+import outbox
+import notifications
+import data_versions
+import fragments
+import events
+import mimetypes
 
-app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'chawal_ghar_secret_key_2025')
+# Settings read from the environment, in the blocks below next to the code
+# they are for; create_app(config) applies config's keys over them.
+DEFAULT_CONFIG = {'SECRET_KEY': os.environ.get('SECRET_KEY', 'chawal_ghar_secret_key_2025')}
+
+# Views and hooks are collected as this module defines them and registered
+# on each application by create_app().
+_views = []
+_hooks = []
+
+def route(rule, **options):
+    def register(view):
+        _views.append((rule, options, view))
+        return view
+    return register
+
+def hook(name):
+    """Registers the function with app.<name>(): before_request,
+    after_request, teardown_appcontext or add_template_global."""
+    def register(func):
+        _hooks.append((name, func))
+        return func
+    return register
+
+def _in_app(func):
+    """func, run in an app context of the current application, for the
+    threads of background services (which have none of their own)."""
+    flask_app = current_app._get_current_object()
+    def call(*args, **kwargs):
+        with flask_app.app_context():
+            return func(*args, **kwargs)
+    return call
+
+# Compiled templates are kept on disk (by default in a per-user temp
+# directory), so a restarted process loads them instead of compiling all
+# of them again; TEMPLATE_CACHE=0 turns this off.
+DEFAULT_CONFIG['TEMPLATE_CACHE'] = os.environ.get('TEMPLATE_CACHE', '1') == '1'
+DEFAULT_CONFIG['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR')
 DATABASE = 'database.db'
 
+# Database connection settings. A pool size of 0 opens a fresh connection per
+# request; SQLITE_PRAGMAS = None means db_pool.DEFAULT_PRAGMAS (WAL etc).
+DEFAULT_CONFIG['DATABASE'] = os.environ.get('DATABASE', DATABASE)
+DEFAULT_CONFIG['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+DEFAULT_CONFIG['DATABASE_POOL_TIMEOUT'] = float(os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+DEFAULT_CONFIG['SQLITE_PRAGMAS'] = None
+DEFAULT_CONFIG['MIGRATE_ON_STARTUP'] = os.environ.get('MIGRATE_ON_STARTUP', '1') == '1'
+
+# In-process cache of catalog pages (see catalog_cache.py). With
+# CATALOG_CACHE_SHARED=1 processes invalidate each other's pages through the
+# cache_versions table; serve.py turns it on whenever it forks workers.
+DEFAULT_CONFIG['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 512))
+DEFAULT_CONFIG['CATALOG_CACHE_TTL'] = float(os.environ.get('CATALOG_CACHE_TTL', 30))
+DEFAULT_CONFIG['CATALOG_CACHE_SHARED'] = os.environ.get('CATALOG_CACHE_SHARED', '0') == '1'
+_pool_lock = threading.Lock()
+
+# Dashboards and the cart carry an ETag built from the data_versions counters
+# of the tables they show (see data_versions.py) and answer If-None-Match with
+# 304 before running their queries; CONDITIONAL_GET=0 turns this off. Product
+# cards and order rows are rendered once per version of their row and kept in
+# an LRU of FRAGMENT_CACHE_SIZE entries (see fragments.py); 0 turns it off.
+DEFAULT_CONFIG['CONDITIONAL_GET'] = os.environ.get('CONDITIONAL_GET', '1') == '1'
+DEFAULT_CONFIG['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096))
+
+# Request, SQL and payment gateway metrics, served at /metrics to admins or
+# to scrapers sending "Authorization: Bearer $METRICS_TOKEN" (see metrics.py).
+# Requests slower than SLOW_REQUEST_MS are logged with their slowest
+# statements; 0 turns the log off. The numbers are those of the process that
+# answers, one of the workers under serve.py.
+DEFAULT_CONFIG['METRICS'] = os.environ.get('METRICS', '1') == '1'
+DEFAULT_CONFIG['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+DEFAULT_CONFIG['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 0))
+
+# Resized WebP/AVIF variants of static/images (see images.py). Off, or without
+# Pillow installed, templates link the original PNGs.
+DEFAULT_CONFIG['RESPONSIVE_IMAGES'] = os.environ.get('RESPONSIVE_IMAGES', '1') == '1'
+DEFAULT_CONFIG['IMAGE_MAX_AGE'] = int(os.environ.get('IMAGE_MAX_AGE', 7 * 24 * 3600))
+
+# Static files are linked through asset_url() as /assets/<name>.<hash>.<ext>
+# and cached by browsers for ASSET_MAX_AGE without revalidating (see assets.py).
+DEFAULT_CONFIG['FINGERPRINT_ASSETS'] = os.environ.get('FINGERPRINT_ASSETS', '1') == '1'
+DEFAULT_CONFIG['ASSET_MAX_AGE'] = int(os.environ.get('ASSET_MAX_AGE', 365 * 24 * 3600))
+
+# Password hashing runs on a bounded pool (see credentials.py); logins and
+# registrations beyond CREDENTIAL_MAX_PENDING get a 503 instead of queueing.
+# CREDENTIAL_WORKERS=0 hashes on the request thread.
+DEFAULT_CONFIG['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', credentials.DEFAULT_METHOD)
+DEFAULT_CONFIG['CREDENTIAL_WORKERS'] = int(os.environ.get('CREDENTIAL_WORKERS', 2))
+DEFAULT_CONFIG['CREDENTIAL_MAX_PENDING'] = int(os.environ.get('CREDENTIAL_MAX_PENDING', 16))
+DEFAULT_CONFIG['CREDENTIAL_TIMEOUT'] = float(os.environ.get('CREDENTIAL_TIMEOUT', 5))
+
+def get_credentials():
+    service = current_app.extensions.get('credentials')
+    if service is None:
+        with _pool_lock:
+            service = current_app.extensions.get('credentials')
+            if service is None:
+                service = current_app.extensions['credentials'] = credentials.CredentialService(
+                    method=current_app.config['PASSWORD_HASH_METHOD'],
+                    workers=current_app.config['CREDENTIAL_WORKERS'],
+                    max_pending=current_app.config['CREDENTIAL_MAX_PENDING'],
+                    timeout=current_app.config['CREDENTIAL_TIMEOUT'])
+    return service
+
+def get_asset_manifest():
+    manifest = current_app.extensions.get('asset_manifest')
+    if manifest is None:
+        manifest = assets.Manifest(auto_reload=current_app.debug)
+        if not current_app.debug:
+            # Hashes written by `python assets.py`, if it was run.
+            manifest.load()
+        manifest = current_app.extensions.setdefault('asset_manifest', manifest)
+    return manifest
+
+@hook('add_template_global')
+def asset_url(filename):
+    if not current_app.config['FINGERPRINT_ASSETS']:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=get_asset_manifest().hashed_name(filename))
+
+def _image_url_for(endpoint, **values):
+    if endpoint == 'static':
+        return asset_url(values['filename'])
+    if current_app.config['FINGERPRINT_ASSETS']:
+        values['v'] = get_asset_manifest().fingerprint('images/' + values['filename'])
+    return url_for(endpoint, **values)
+
+@hook('add_template_global')
+def responsive_image(filename, alt, **kwargs):
+    return images.responsive_image(_image_url_for, filename, alt, variants=current_app.config['RESPONSIVE_IMAGES'], **kwargs)
+
+def get_pool():
+    pool = current_app.extensions.get('db_pool')
+    if pool is not None:
+        return pool
+    with _pool_lock:
+        pool = current_app.extensions.get('db_pool')
+        if pool is not None:
+            return pool
+        factory = metrics.InstrumentedConnection if current_app.config['METRICS'] else sqlite3.Connection
+        if current_app.config['DATABASE_POOL_SIZE'] > 0:
+            pool = db_pool.ConnectionPool(current_app.config['DATABASE'],
+                                          max_size=current_app.config['DATABASE_POOL_SIZE'],
+                                          timeout=current_app.config['DATABASE_POOL_TIMEOUT'],
+                                          pragmas=current_app.config['SQLITE_PRAGMAS'],
+                                          factory=factory)
+        else:
+            pool = db_pool.NullPool(current_app.config['DATABASE'], pragmas=current_app.config['SQLITE_PRAGMAS'], factory=factory)
+        if current_app.config['MIGRATE_ON_STARTUP']:
+            conn = pool.acquire()
+            try:
+                migrate_db.migrate(conn)
+            finally:
+                pool.release(conn)
+        current_app.extensions['db_pool'] = pool
+        return pool
+
+def get_catalog_cache():
+    cache = current_app.extensions.get('catalog_cache')
+    if cache is None:
+        with _pool_lock:
+            cache = current_app.extensions.get('catalog_cache')
+            if cache is None:
+                cache = current_app.extensions['catalog_cache'] = catalog_cache.CatalogCache(
+                    max_entries=current_app.config['CATALOG_CACHE_SIZE'],
+                    ttl=current_app.config['CATALOG_CACHE_TTL'],
+                    shared=current_app.config['CATALOG_CACHE_SHARED'])
+    return cache
+
+def cached_product_page(db, filters, cursor, limit):
+    """(products, next_cursor, versions), versions being the data_versions of
+    the tables the page was loaded from, read just before loading it."""
+    def load():
+        versions = data_versions.read(db, CATALOG_TABLES)
+        products, next_cursor = catalog.product_page(db, filters, cursor, limit)
+        return [dict(p) for p in products], next_cursor, versions
+    cache = get_catalog_cache()
+    return cache.get_or_load(db, cache.key(filters, cursor, limit), load)
+
+CATALOG_TABLES = [('products', ''), ('farmers', '')]
+
+def get_fragment_cache():
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('fragment_cache', fragments.FragmentCache(
+            current_app.jinja_env, max_entries=current_app.config['FRAGMENT_CACHE_SIZE']))
+    return cache
+
+@hook('add_template_global')
+def fragment(name, **values):
+    return get_fragment_cache().render(name, **values)
+
+@hook('add_template_global')
+def rice_image(p_type):
+    return catalog.RICE_IMAGES.get(p_type.lower(), 'basmati.png')
+
+def get_template_version():
+    """Hash of every template's source. It is part of each page ETag, so
+    browsers do not keep pages rendered by templates since changed."""
+    version = current_app.extensions.get('template_version')
+    if version is None:
+        digest = hashlib.blake2b(digest_size=8)
+        for name in sorted(current_app.jinja_env.list_templates()):
+            digest.update(name.encode())
+            digest.update(current_app.jinja_env.loader.get_source(current_app.jinja_env, name)[0].encode())
+        version = current_app.extensions.setdefault('template_version', digest.hexdigest())
+    return version
+
+def page_etag(db, keys, *parts):
+    """ETag for this request's page, built from the (table, scope) keys of
+    data_versions it shows, the user and URL and parts. None when the page
+    must not be reused: CONDITIONAL_GET is off or a flashed message is
+    waiting to be shown on it."""
+    if not current_app.config['CONDITIONAL_GET'] or session.get('_flashes'):
+        return None
+    return data_versions.etag(db, keys, get_template_version(), request.full_path, session.get('user_id'),
+                              session.get('role'), session.get('fullname'), *parts)
+
+def not_modified(etag):
+    """A 304 response if the browser already has the page tagged etag, else None."""
+    if etag is None or etag not in request.if_none_match:
+        return None
+    return with_etag(Response(status=304), etag)
+
+def with_etag(response, etag):
+    response = make_response(response)
+    if etag is not None:
+        response.set_etag(etag)
+        # Per-user pages, checked with the server on every view.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+def get_metrics():
+    registry = current_app.extensions.get('metrics')
+    if registry is None:
+        slow = current_app.config['SLOW_REQUEST_MS']
+        registry = current_app.extensions.setdefault('metrics', metrics.Metrics(
+            slow_request=slow / 1000 if slow > 0 else None, logger=current_app.logger))
+    return registry
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = get_pool().acquire()
+        if current_app.config['METRICS']:
+            db.stats = g.get('_sql_stats')
     return db
 
-@app.teardown_appcontext
+@hook('teardown_appcontext')
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    release_db()
+
+def release_db():
+    """Return this request's connection to the pool early, before slow
+    non-database work; a later get_db() takes a fresh one."""
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        if current_app.config['METRICS']:
+            db.stats = None
+        get_pool().release(db)
+
+@hook('before_request')
+def start_request_metrics():
+    if current_app.config['METRICS']:
+        g._request_started = time.perf_counter()
+        g._sql_stats = metrics.RequestStats()
+
+@hook('after_request')
+def record_request_metrics(response):
+    started = g.get('_request_started')
+    if started is None:
+        return response
+    # Unmatched URLs share one label. Generated bodies (exports) are recorded
+    # when the server closes the response, so they are timed to the last chunk.
+    endpoint = request.url_rule.endpoint if request.url_rule else '<unmatched>'
+    method, path, stats = request.method, request.path, g._sql_stats
+    registry = get_metrics()
+
+    def record():
+        registry.observe_request(endpoint, method, response.status_code,
+                                 time.perf_counter() - started, stats, path)
+    if isinstance(response.response, types.GeneratorType):
+        response.call_on_close(record)
+    else:
+        record()
+    return response
 
 # --- Routes ---
 
-@app.route('/')
+@route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@route('/images/<int:width>/<fmt>/<path:filename>')
+def image_variant(width, fmt, filename):
+    path = images.variant_path(filename, width, fmt)
+    if path is None:
+        abort(404)
+    fingerprint = get_asset_manifest().fingerprint('images/' + filename)
+    immutable = request.args.get('v') == fingerprint
+    response = send_file(path, mimetype=images.MIME_TYPES[fmt], etag=f'{fingerprint}-{width}-{fmt}',
+                         max_age=current_app.config['ASSET_MAX_AGE'] if immutable else current_app.config['IMAGE_MAX_AGE'])
+    response.cache_control.immutable = immutable
+    return response
+
+@route('/assets/<path:filename>')
+def asset(filename):
+    manifest = get_asset_manifest()
+    name, current = manifest.resolve(filename)
+    if name is None:
+        abort(404)
+    path, encoding = manifest.compressed(name, request.headers.get('Accept-Encoding'))
+    etag = manifest.digest(name)[:32] + (f'-{encoding}' if encoding else '')
+    # An outdated hash still gets the current file, but only until it is revalidated.
+    response = send_file(path or manifest.path(name), mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                         download_name=os.path.basename(name), etag=etag, max_age=current_app.config['ASSET_MAX_AGE'] if current else 0)
+    response.cache_control.immutable = current
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if name.lower().endswith(assets.COMPRESSIBLE):
+        response.vary.add('Accept-Encoding')
+    return response
+
+@route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         role = request.form['role']
@@ -44,7 +370,11 @@ def register():
             flash('All required fields must be filled.', 'error')
             return redirect(url_for('register'))
 
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = get_credentials().hash(password)
+        except credentials.Overloaded as e:
+            flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+            return render_template('register.html'), 503, {'Retry-After': str(e.retry_after)}
         db = get_db()
         
         try:
@@ -67,7 +397,7 @@ def register():
 
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         role = request.form['role']
@@ -89,8 +419,23 @@ def login():
             user = db.execute('SELECT * FROM admins WHERE a_loginname = ?', (loginname,)).fetchone()
             id_field = 'a_id'
             pass_field = 'a_password'
-            
-        if user and check_password_hash(user[pass_field], password):
+
+        # Unknown users are still checked (against a dummy hash) so every
+        # failed login costs the same. Don't hold a pooled connection while
+        # the hash is computed.
+        release_db()
+        try:
+            ok, new_hash = get_credentials().verify(user[pass_field] if user else None, password)
+        except credentials.Overloaded as e:
+            flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503, {'Retry-After': str(e.retry_after)}
+        if ok and new_hash:
+            # Stored with older KDF parameters: upgrade it now that we have the password.
+            db = get_db()
+            db.execute(f'UPDATE {role}s SET {pass_field} = ? WHERE {id_field} = ?', (new_hash, user[id_field]))
+            db.commit()
+
+        if ok:
             session.clear()
             session['user_id'] = user[id_field]
             session['role'] = role
@@ -107,7 +452,7 @@ def login():
 
     return render_template('login.html')
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'success')
@@ -115,25 +460,31 @@ def logout():
 
 # --- Farmer Product Routes ---
 
-@app.route('/farmer/dashboard')
+@route('/farmer/dashboard')
 def dashboard_farmer():
     if session.get('role') != 'farmer':
         return redirect(url_for('login'))
     
     db = get_db()
+    f_id = data_versions.farmer(session['user_id'])
+    # The sales chart ends today (UTC, as SQLite's date('now')).
+    etag = page_etag(db, [('products', f_id), ('orders', f_id), ('farmer_notifications', f_id), ('customers', '')],
+                     time.strftime('%Y-%m-%d', time.gmtime()))
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
     products = db.execute('SELECT * FROM products WHERE f_id = ?', (session['user_id'],)).fetchall()
-    # Also show orders for this farmer's products
-    orders = db.execute('''
-        SELECT orders.*, products.p_name, customers.c_firstname, customers.c_lastname
-        FROM orders 
-        JOIN products ON orders.p_id = products.p_id 
-        JOIN customers ON orders.c_id = customers.c_id
-        WHERE products.f_id = ?
-    ''', (session['user_id'],)).fetchall()
-    
-    return render_template('dashboard_farmer.html', products=products, orders=orders)
+    # Totals come from the trigger-maintained summaries (see sales.py); only
+    # one page of recent orders is read from orders itself.
+    orders, orders_next_cursor = sales.order_page(db, session['user_id'], request.args.get('orders_cursor'))
+    return with_etag(render_template('dashboard_farmer.html', products=products, orders=orders,
+                                     orders_next_cursor=orders_next_cursor,
+                                     totals=sales.farmer_totals(db, session['user_id']),
+                                     product_sales=sales.product_totals(db, session['user_id']),
+                                     daily=sales.daily_sales(db, session['user_id']),
+                                     notifications=notifications.recent(db, session['user_id'])), etag)
 
-@app.route('/farmer/add_product', methods=['GET', 'POST'])
+@route('/farmer/add_product', methods=['GET', 'POST'])
 def add_product():
     if session.get('role') != 'farmer':
         return redirect(url_for('login'))
@@ -153,35 +504,126 @@ def add_product():
         db.execute('INSERT INTO products (f_id, p_name, p_type, p_quantity, p_priceperunit, p_batch, p_status) VALUES (?, ?, ?, ?, ?, ?, ?)',
                    (session['user_id'], p_name, p_type, p_quantity, p_priceperunit, p_batch, p_status))
         db.commit()
+        get_catalog_cache().invalidate(db, p_type=p_type, f_id=session['user_id'])
         flash('Product added successfully!', 'success')
         return redirect(url_for('dashboard_farmer'))
         
     return render_template('add_product.html', rice_type=rice_type)
 
-@app.route('/farmer/delete_product/<int:p_id>')
+@route('/farmer/import_products', methods=['GET', 'POST'])
+def import_products():
+    if session.get('role') != 'farmer':
+        return redirect(url_for('login'))
+    if request.method == 'GET':
+        return render_template('import_products.html', result=None)
+
+    # A raw text/csv body (for scripts) is answered with JSON; a file from the
+    # upload form with the results page. Either way the CSV is read as a stream.
+    raw = request.mimetype == 'text/csv'
+    upload = None if raw else request.files.get('file')
+    if not raw and (upload is None or not upload.filename):
+        flash('Choose a CSV file to import.', 'error')
+        return redirect(url_for('import_products'))
+
+    db = get_db()
+    try:
+        result = product_import.import_csv(db, session['user_id'], request.stream if raw else upload.stream)
+    except ValueError as e:
+        if raw:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('import_products'))
+    if result['types']:
+        get_catalog_cache().invalidate_products(db, [(t, session['user_id']) for t in result['types']])
+
+    if raw:
+        return jsonify({'inserted': result['inserted'], 'rejected': result['rejected'],
+                        'errors': [{'line': line, 'error': error} for line, error in result['errors']]})
+    return render_template('import_products.html', result=result)
+
+@route('/farmer/delete_product/<int:p_id>')
 def delete_product(p_id):
     if session.get('role') != 'farmer':
         return redirect(url_for('login'))
         
     db = get_db()
-    db.execute('DELETE FROM products WHERE p_id = ? AND f_id = ?', (p_id, session['user_id']))
-    db.commit()
-    flash('Product deleted.', 'success')
+    try:
+        db.execute('DELETE FROM cart WHERE p_id IN (SELECT p_id FROM products WHERE p_id = ? AND f_id = ?)', (p_id, session['user_id']))
+        deleted = db.execute('DELETE FROM products WHERE p_id = ? AND f_id = ?', (p_id, session['user_id'])).rowcount
+        if deleted and current_app.config['EVENTS']:
+            events.publish_stock(db, {'p_id': p_id, 'f_id': session['user_id'], 'p_quantity': 0, 'p_status': 'Deleted'})
+        db.commit()
+        flash('Product deleted.', 'success')
+    except sqlite3.IntegrityError:
+        # Orders still reference this product, so keep the row for their
+        # history and take it off sale instead.
+        db.rollback()
+        db.execute('DELETE FROM cart WHERE p_id IN (SELECT p_id FROM products WHERE p_id = ? AND f_id = ?)', (p_id, session['user_id']))
+        db.execute("UPDATE products SET p_quantity = 0, p_status = 'Withdrawn' WHERE p_id = ? AND f_id = ?", (p_id, session['user_id']))
+        if current_app.config['EVENTS']:
+            events.publish_stock(db, {'p_id': p_id, 'f_id': session['user_id'], 'p_quantity': 0, 'p_status': 'Withdrawn'})
+        db.commit()
+        flash('Product has existing orders, so it was withdrawn from sale instead.', 'success')
+    get_catalog_cache().invalidate(db, f_id=session['user_id'])
+    if current_app.config['EVENTS']:
+        get_event_hub().wake()
     return redirect(url_for('dashboard_farmer'))
 
 # --- Customer Routes ---
 
-@app.route('/customer/dashboard')
+@route('/customer/dashboard')
 def dashboard_customer():
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
         
     db = get_db()
-    products = db.execute('SELECT products.*, farmers.f_firstname, farmers.f_lastname FROM products JOIN farmers ON products.f_id = farmers.f_id WHERE p_status = "Available"').fetchall()
-    my_orders = db.execute('SELECT orders.*, products.p_name FROM orders JOIN products ON orders.p_id = products.p_id WHERE orders.c_id = ?', (session['user_id'],)).fetchall()
-    return render_template('dashboard_customer.html', products=products, my_orders=my_orders)
+    filters = catalog.parse_filters(request.args)
+    products, next_cursor, catalog_versions = cached_product_page(db, filters, request.args.get('cursor'),
+                                                                  catalog.page_size(request.args))
+    # A cached catalog page is tagged with the versions it was loaded at.
+    etag = page_etag(db, [('orders', data_versions.customer(session['user_id']))], catalog_versions)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    my_orders, orders_next_cursor = catalog.order_page(db, session['user_id'], request.args.get('orders_cursor'))
+    # Query strings for the paging links of each list, keeping the other
+    # list's page
+    products_query = {k: v for k, v in request.args.items() if k != 'cursor'}
+    orders_query = {k: v for k, v in request.args.items() if k != 'orders_cursor'}
+    return with_etag(render_template('dashboard_customer.html', products=products, my_orders=my_orders, filters=filters,
+                                     next_cursor=next_cursor, orders_next_cursor=orders_next_cursor,
+                                     products_query=products_query, orders_query=orders_query,
+                                     rice_types=catalog.RICE_TYPES), etag)
+
+@route('/customer/catalog')
+def customer_catalog():
+    if session.get('role') != 'customer':
+        return jsonify({'error': 'Login required.'}), 401
 
-@app.route('/customer/buy/<int:p_id>', methods=['GET', 'POST'])
+    filters = catalog.parse_filters(request.args)
+    products, next_cursor, _ = cached_product_page(get_db(), filters, request.args.get('cursor'), catalog.page_size(request.args))
+    return jsonify({'products': products, 'next_cursor': next_cursor, 'filters': filters})
+
+@route('/customer/search')
+def customer_search():
+    if session.get('role') != 'customer':
+        return redirect(url_for('login'))
+
+    q = request.args.get('q', '').strip()
+    products, corrected = catalog.search_products(get_db(), q, catalog.page_size(request.args))
+    if request.args.get('format') == 'json':
+        return jsonify({'q': q, 'corrected': corrected, 'products': [dict(p) for p in products]})
+    return render_template('search_results.html', q=q, corrected=corrected, products=products)
+
+@route('/customer/orders')
+def customer_orders():
+    if session.get('role') != 'customer':
+        return jsonify({'error': 'Login required.'}), 401
+
+    orders, next_cursor = catalog.order_page(get_db(), session['user_id'], request.args.get('cursor'), catalog.page_size(request.args))
+    return jsonify({'orders': [dict(o) for o in orders], 'next_cursor': next_cursor})
+
+@route('/customer/buy/<int:p_id>', methods=['GET', 'POST'])
 def buy_product(p_id):
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
@@ -195,63 +637,197 @@ def buy_product(p_id):
 
     if request.method == 'POST':
         # This handles the payment success callback
-        quantity = float(request.form['quantity'])
+        quantity = buy_quantity(request.form.get('quantity'))
         destination = request.form['destination']
-        
-        if quantity > product['p_quantity']:
-            flash(f'Only {product["p_quantity"]} kg available.', 'error')
+        order_key = request.form.get('order_key', '')
+
+        if quantity is None:
+            flash('Invalid quantity.', 'error')
             return redirect(url_for('buy_product', p_id=p_id))
-        
-        total_amount = quantity * product['p_priceperunit']
-        
-        # 1. Create Order
-        cursor = db.execute('INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount) VALUES (?, ?, ?, ?, ?)',
-                   (session['user_id'], p_id, 'Confirmed', destination, total_amount))
-        o_id = cursor.lastrowid
-        
-        # 2. Create Payment
-        db.execute('INSERT INTO payments (o_id, c_id, p_amount, p_method, p_status) VALUES (?, ?, ?, ?, ?)',
-                   (o_id, session['user_id'], total_amount, 'Online (Razorpay)', 'Completed'))
-        
-        # 3. Update Inventory
-        new_quantity = product['p_quantity'] - quantity
-        if new_quantity <= 0:
-            db.execute('UPDATE products SET p_quantity = 0, p_status = "Sold Out" WHERE p_id = ?', (p_id,))
-        else:
-            db.execute('UPDATE products SET p_quantity = ? WHERE p_id = ?', (new_quantity, p_id))
-            
-        db.commit()
+
+        # Order, payment and stock decrement in one transaction (see checkout_engine.py)
+        c_id = session['user_id']
+        try:
+            checkout_engine.buy_now(db, c_id, p_id, quantity, destination,
+                             payment_id=request.form.get('razorpay_payment_id'),
+                             before_commit=queue_payment_jobs(db, order_key, lambda items, amount:
+                                 payment_orders.product_order_key(c_id, p_id, quantity, amount)))
+        except checkout_engine.InsufficientStock as e:
+            flash(f'Only {e.available} kg available.', 'error')
+            return redirect(url_for('buy_product', p_id=p_id))
+        except payment_orders.PaymentMismatch:
+            flash('Your payment does not match this order. It was not placed; please try again.', 'error')
+            return redirect(url_for('buy_product', p_id=p_id, quantity=f'{quantity:g}'))
+        wake_after_checkout()
+        get_catalog_cache().invalidate(db, p_type=product['p_type'], f_id=product['f_id'])
+
         flash('Payment successful! Order placed.', 'success')
         return redirect(url_for('dashboard_customer'))
     
     customer = db.execute('SELECT * FROM customers WHERE c_id = ?', (session['user_id'],)).fetchone()
 
-    # GET request - Create Razorpay order for payment
-    initial_amount = product['p_priceperunit']
-    data = { "amount": int(initial_amount * 100), "currency": "INR", "receipt": f"buy_rcpt_{p_id}" }
-    payment = client.order.create(data=data)
+    # GET request - queue (or reuse) the Razorpay order; the page polls for its id
+    quantity = buy_quantity(request.args.get('quantity', 1)) or 1
+    payment = buy_now_payment(db, product, quantity)
 
-    return render_template('buy_product.html', product=product, payment=payment, key_id=KEY_ID, customer=customer)
+    return render_template('buy_product.html', product=product, quantity=quantity, payment=payment,
+                           key_id=current_app.config['RAZORPAY_KEY_ID'], customer=customer)
+
+@route('/customer/buy/<int:p_id>/payment')
+def buy_product_payment(p_id):
+    """The gateway order for buying ?quantity= kg, for the Buy Now page to
+    switch to when the buyer changes the quantity."""
+    if session.get('role') != 'customer':
+        return jsonify({'error': 'Login required.'}), 401
+
+    db = get_db()
+    product = db.execute('SELECT * FROM products WHERE p_id = ?', (p_id,)).fetchone()
+    quantity = buy_quantity(request.args.get('quantity'))
+    if not product:
+        return jsonify({'error': 'Product not found.'}), 404
+    if quantity is None:
+        return jsonify({'error': 'Invalid quantity.'}), 400
+    return jsonify(buy_now_payment(db, product, quantity))
+
+def buy_quantity(value):
+    """A Buy Now quantity in kg as posted, or None if it is not a positive number."""
+    try:
+        quantity = float(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if math.isfinite(quantity) and quantity > 0 else None
+
+def buy_now_payment(db, product, quantity):
+    """The gateway order for the customer buying quantity kg of product."""
+    c_id = session['user_id']
+    amount = payment_orders.order_amount([{'p_id': product['p_id'], 'quantity': quantity,
+                                           'p_priceperunit': product['p_priceperunit']}])
+    key = payment_orders.product_order_key(c_id, product['p_id'], quantity, amount)
+    return get_payment_orders().order_for(db, c_id, key, amount, receipt=f"buy_rcpt_{c_id}_{product['p_id']}")
 
 # --- Admin Routes ---
 
-@app.route('/admin/dashboard')
+@route('/admin/dashboard')
 def dashboard_admin():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
     
+    try:
+        filters = exports.parse_filters('orders', request.args)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('dashboard_admin'))
     db = get_db()
-    orders = db.execute('''
-        SELECT orders.*, products.p_name, customers.c_firstname, customers.c_lastname, farmers.f_firstname, farmers.f_lastname
-        FROM orders 
-        JOIN products ON orders.p_id = products.p_id 
-        JOIN customers ON orders.c_id = customers.c_id
-        JOIN farmers ON products.f_id = farmers.f_id
-    ''').fetchall()
-    
-    return render_template('dashboard_admin.html', orders=orders)
+    etag = page_etag(db, [('orders', ''), ('products', ''), ('customers', ''), ('farmers', '')])
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    orders, next_cursor = exports.page(db, 'orders', filters, request.args.get('cursor'))
+    return with_etag(render_template('dashboard_admin.html', orders=orders, filters=filters, next_cursor=next_cursor,
+                                     export_names=list(exports.EXPORTS)), etag)
+
+@route('/admin/export/<name>.<fmt>')
+def admin_export(name, fmt):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+    if name not in exports.EXPORTS or fmt not in exports.FORMATS:
+        abort(404)
+    try:
+        filters = exports.parse_filters(name, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # The body is generated after the request has been torn down, so the
+    # connection is taken out of g (teardown would return it to the pool while
+    # the export still reads from it) and released when the response is closed.
+    # It runs outside the app context, so the pool is looked up now.
+    db = get_db()
+    g.pop('_database')
+    pool, metered = get_pool(), current_app.config['METRICS']
+
+    def release():
+        if metered:
+            db.stats = None
+        pool.release(db)
+    response = Response(exports.generate(db, name, fmt, filters), mimetype=exports.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+    response.call_on_close(release)
+    return response
+
+@route('/admin/cache')
+def admin_cache_stats():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    return jsonify({'catalog': get_catalog_cache().stats(), 'fragments': get_fragment_cache().stats()})
+
+@route('/metrics')
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    if session.get('role') != 'admin' and not (token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        abort(403)
+
+    # Services that have not started yet are left out rather than started here.
+    extra = {'process_id': ('gauge', 'Id of the process whose numbers these are.', os.getpid())}
+    pool = current_app.extensions.get('db_pool')
+    if isinstance(pool, db_pool.ConnectionPool):
+        extra['db_pool_connections'] = ('gauge', 'Open pooled SQLite connections.', pool.opened)
+    cache = current_app.extensions.get('catalog_cache')
+    if cache is not None:
+        cache_stats = cache.stats()
+        extra['catalog_cache_entries'] = ('gauge', 'Cached catalog pages.', cache_stats['entries'])
+        extra['catalog_cache_hits_total'] = ('counter', 'Catalog pages served from the cache.', cache_stats['hits'])
+        extra['catalog_cache_misses_total'] = ('counter', 'Catalog pages loaded from the database.', cache_stats['misses'])
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        cache_stats = cache.stats()
+        extra['fragment_cache_hits_total'] = ('counter', 'Template fragments served from the cache.', cache_stats['hits'])
+        extra['fragment_cache_misses_total'] = ('counter', 'Template fragments rendered.', cache_stats['misses'])
+    service = current_app.extensions.get('credentials')
+    if service is not None:
+        extra['credential_pending'] = ('gauge', 'Password hashes queued or running.', service.stats()['pending'])
+    worker = current_app.extensions.get('outbox')
+    if worker is not None:
+        jobs = outbox.counts(get_db())
+        extra['outbox_jobs_queued'] = ('gauge', 'Outbox jobs waiting to run.', jobs['queued'])
+        extra['outbox_jobs_dead'] = ('gauge', 'Outbox jobs that ran out of attempts.', jobs['dead'])
+        extra['outbox_oldest_due_seconds'] = ('gauge', 'How long the oldest due outbox job has waited.', jobs['oldest_due_seconds'])
+        extra['outbox_jobs_done_total'] = ('counter', 'Outbox jobs finished by this process.', worker.stats()['done'])
+    hub = current_app.extensions.get('event_hub')
+    if hub is not None:
+        hub_stats = hub.stats()
+        extra['event_streams'] = ('gauge', 'Open live update streams in this process.', hub_stats['streams'])
+        extra['event_messages_total'] = ('counter', 'Live update messages sent to streams.', hub_stats['delivered'])
+    return Response(get_metrics().render(extra), mimetype='text/plain; version=0.0.4')
+
+@route('/admin/credentials')
+def admin_credential_stats():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    return jsonify(get_credentials().stats())
+
+@route('/admin/outbox')
+def admin_outbox():
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    db = get_db()
+    return jsonify({'jobs': outbox.counts(db), 'workers': get_outbox().stats(),
+                    'dead': [dict(job) for job in outbox.dead_jobs(db)]})
+
+@route('/admin/outbox/<int:job_id>/retry', methods=['POST'])
+def admin_outbox_retry(job_id):
+    if session.get('role') != 'admin':
+        return redirect(url_for('login'))
+
+    if not outbox.retry(get_db(), job_id):
+        return jsonify({'error': 'No such dead job.'}), 404
+    get_outbox().wake()
+    return jsonify({'job_id': job_id, 'status': 'queued'})
 
-@app.route('/admin/profile', methods=['GET', 'POST'])
+@route('/admin/profile', methods=['GET', 'POST'])
 def admin_profile():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
@@ -276,16 +852,18 @@ def admin_profile():
     admin = db.execute('SELECT * FROM admins WHERE a_id = ?', (session['user_id'],)).fetchone()
     return render_template('admin_profile.html', admin=admin)
 
-@app.route('/admin/customers')
+@route('/admin/customers')
 def admin_customers():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
     
     db = get_db()
-    customers = db.execute('SELECT * FROM customers').fetchall()
-    return render_template('admin_customers.html', customers=customers)
+    filters = users.parse_filters(request.args)
+    customers, next_cursor = users.page(db, 'customers', filters, request.args.get('cursor'))
+    return render_template('admin_customers.html', customers=customers, filters=filters, next_cursor=next_cursor,
+                           stats=users.customer_stats(db, [c['c_id'] for c in customers]), sorts=users.SORTS)
 
-@app.route('/admin/customer/edit/<int:c_id>', methods=['GET', 'POST'])
+@route('/admin/customer/edit/<int:c_id>', methods=['GET', 'POST'])
 def admin_edit_customer(c_id):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
@@ -313,27 +891,34 @@ def admin_edit_customer(c_id):
 
     return render_template('admin_edit_customer.html', customer=customer)
 
-@app.route('/admin/customer/delete/<int:c_id>')
+@route('/admin/customer/delete/<int:c_id>')
 def admin_delete_customer(c_id):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
     
     db = get_db()
-    db.execute('DELETE FROM customers WHERE c_id = ?', (c_id,))
-    db.commit()
-    flash('Customer deleted successfully.', 'success')
+    try:
+        db.execute('DELETE FROM cart WHERE c_id = ?', (c_id,))
+        db.execute('DELETE FROM customers WHERE c_id = ?', (c_id,))
+        db.commit()
+        flash('Customer deleted successfully.', 'success')
+    except sqlite3.IntegrityError:
+        db.rollback()
+        flash('Customer has order history and cannot be deleted.', 'error')
     return redirect(url_for('admin_customers'))
 
-@app.route('/admin/farmers')
+@route('/admin/farmers')
 def admin_farmers():
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
     
     db = get_db()
-    farmers = db.execute('SELECT * FROM farmers').fetchall()
-    return render_template('admin_farmers.html', farmers=farmers)
+    filters = users.parse_filters(request.args)
+    farmers, next_cursor = users.page(db, 'farmers', filters, request.args.get('cursor'))
+    return render_template('admin_farmers.html', farmers=farmers, filters=filters, next_cursor=next_cursor,
+                           stats=users.farmer_stats(db, [f['f_id'] for f in farmers]), sorts=users.SORTS)
 
-@app.route('/admin/farmer/edit/<int:f_id>', methods=['GET', 'POST'])
+@route('/admin/farmer/edit/<int:f_id>', methods=['GET', 'POST'])
 def admin_edit_farmer(f_id):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
@@ -351,6 +936,8 @@ def admin_edit_farmer(f_id):
         db.execute('UPDATE farmers SET f_firstname = ?, f_lastname = ?, f_email = ?, f_contact = ?, f_address = ?, f_gender = ? WHERE f_id = ?',
                    (firstname, lastname, email, contact, address, gender, f_id))
         db.commit()
+        # Cached catalog pages show the farmer's name on each product card.
+        get_catalog_cache().invalidate(db, f_id=f_id)
         flash('Farmer updated successfully.', 'success')
         return redirect(url_for('admin_farmers'))
         
@@ -361,7 +948,7 @@ def admin_edit_farmer(f_id):
 
     return render_template('admin_edit_farmer.html', farmer=farmer)
 
-@app.route('/admin/farmer/delete/<int:f_id>')
+@route('/admin/farmer/delete/<int:f_id>')
 def admin_delete_farmer(f_id):
     if session.get('role') != 'admin':
         return redirect(url_for('login'))
@@ -373,20 +960,191 @@ def admin_delete_farmer(f_id):
     # Logic: Delete products first to be safe or rely on DB. Let's strictly delete farmer for now as per minimal requirement, 
     # but a better approach would be to handle associated data.
     # Deleting farmer's products first:
-    db.execute('DELETE FROM products WHERE f_id = ?', (f_id,))
-    db.execute('DELETE FROM farmers WHERE f_id = ?', (f_id,))
-    db.commit()
-    flash('Farmer and their products deleted successfully.', 'success')
+    try:
+        db.execute('DELETE FROM cart WHERE p_id IN (SELECT p_id FROM products WHERE f_id = ?)', (f_id,))
+        db.execute('DELETE FROM products WHERE f_id = ?', (f_id,))
+        db.execute('DELETE FROM farmers WHERE f_id = ?', (f_id,))
+        db.commit()
+        get_catalog_cache().invalidate(db, f_id=f_id)
+        flash('Farmer and their products deleted successfully.', 'success')
+    except sqlite3.IntegrityError:
+        # foreign_keys is on (see db_pool.DEFAULT_PRAGMAS): orders still
+        # reference this farmer's products.
+        db.rollback()
+        flash('Farmer has order history and cannot be deleted.', 'error')
     return redirect(url_for('admin_farmers'))
 
 # --- Cart & Payment Routes ---
 
 # Razorpay Configuration
-KEY_ID = 'rzp_test_RxwJftVK3EV6AU'
-KEY_SECRET = 'vpadQBd7bt5KKxSB0p4jTOMD'
-client = razorpay.Client(auth=(KEY_ID, KEY_SECRET))
+DEFAULT_CONFIG['RAZORPAY_KEY_ID'] = os.environ.get('RAZORPAY_KEY_ID', 'rzp_test_RxwJftVK3EV6AU')
+DEFAULT_CONFIG['RAZORPAY_KEY_SECRET'] = os.environ.get('RAZORPAY_KEY_SECRET', 'vpadQBd7bt5KKxSB0p4jTOMD')
+
+# Gateway orders are created in the background by payment_orders.PaymentOrderService.
+# PAYMENT_GATEWAY=fake swaps Razorpay for a local FakeGateway (no network).
+DEFAULT_CONFIG['PAYMENT_GATEWAY'] = os.environ.get('PAYMENT_GATEWAY', 'razorpay')
+DEFAULT_CONFIG['PAYMENT_FAKE_LATENCY'] = float(os.environ.get('PAYMENT_FAKE_LATENCY', 0.2))
+DEFAULT_CONFIG['PAYMENT_FAKE_FAILURE_RATE'] = float(os.environ.get('PAYMENT_FAKE_FAILURE_RATE', 0))
+DEFAULT_CONFIG['PAYMENT_WORKERS'] = int(os.environ.get('PAYMENT_WORKERS', 4))
+DEFAULT_CONFIG['PAYMENT_MAX_PENDING'] = int(os.environ.get('PAYMENT_MAX_PENDING', 64))
+DEFAULT_CONFIG['PAYMENT_TIMEOUT'] = float(os.environ.get('PAYMENT_TIMEOUT', 10))
+DEFAULT_CONFIG['PAYMENT_RETRIES'] = int(os.environ.get('PAYMENT_RETRIES', 3))
+
+def get_payment_client():
+    if current_app.config['PAYMENT_GATEWAY'] == 'fake':
+        gateway = current_app.extensions.get('fake_gateway')
+        if gateway is None:
+            gateway = current_app.extensions['fake_gateway'] = payment_orders.FakeGateway(
+                latency=current_app.config['PAYMENT_FAKE_LATENCY'], failure_rate=current_app.config['PAYMENT_FAKE_FAILURE_RATE'])
+    else:
+        gateway = current_app.extensions.get('razorpay_client')
+        if gateway is None:
+            # Imported here: razorpay pulls in requests, about 50 ms of startup.
+            import razorpay
+            gateway = current_app.extensions.setdefault('razorpay_client', razorpay.Client(
+                auth=(current_app.config['RAZORPAY_KEY_ID'], current_app.config['RAZORPAY_KEY_SECRET'])))
+    return metrics.TimedGateway(gateway, get_metrics()) if current_app.config['METRICS'] else gateway
+
+def get_payment_orders():
+    service = current_app.extensions.get('payment_orders')
+    if service is None:
+        with _pool_lock:
+            service = current_app.extensions.get('payment_orders')
+            if service is None:
+                service = current_app.extensions['payment_orders'] = payment_orders.PaymentOrderService(
+                    _in_app(get_pool), _in_app(get_payment_client),
+                    workers=current_app.config['PAYMENT_WORKERS'],
+                    max_pending=current_app.config['PAYMENT_MAX_PENDING'],
+                    timeout=current_app.config['PAYMENT_TIMEOUT'],
+                    retries=current_app.config['PAYMENT_RETRIES'])
+    return service
+
+# Post-payment work (signature verification, farmer notifications) is queued
+# in the checkout transaction and run by outbox.OutboxWorker threads.
+# OUTBOX_WORKERS=0 leaves it to a separate `python outbox.py` process.
+DEFAULT_CONFIG['OUTBOX_WORKERS'] = int(os.environ.get('OUTBOX_WORKERS', 2))
+DEFAULT_CONFIG['OUTBOX_MAX_ATTEMPTS'] = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+DEFAULT_CONFIG['OUTBOX_BACKOFF'] = float(os.environ.get('OUTBOX_BACKOFF', 2))
+DEFAULT_CONFIG['OUTBOX_LEASE'] = float(os.environ.get('OUTBOX_LEASE', 60))
+DEFAULT_CONFIG['OUTBOX_POLL_INTERVAL'] = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+
+def _verify_payment(db, payload):
+    fake = current_app.config['PAYMENT_GATEWAY'] == 'fake'
+    payment_orders.verify_payment(db, payload, payment_orders.FakeGateway.SECRET if fake else current_app.config['RAZORPAY_KEY_SECRET'])
+
+def get_outbox():
+    worker = current_app.extensions.get('outbox')
+    if worker is None:
+        with _pool_lock:
+            worker = current_app.extensions.get('outbox')
+            if worker is None:
+                worker = outbox.OutboxWorker(
+                    _in_app(get_pool), {'verify_payment': _in_app(_verify_payment),
+                                        'notify_farmers': notifications.notify_farmers},
+                    workers=current_app.config['OUTBOX_WORKERS'],
+                    poll_interval=current_app.config['OUTBOX_POLL_INTERVAL'],
+                    lease=current_app.config['OUTBOX_LEASE'],
+                    max_attempts=current_app.config['OUTBOX_MAX_ATTEMPTS'],
+                    backoff=current_app.config['OUTBOX_BACKOFF'])
+                worker.start()
+                current_app.extensions['outbox'] = worker
+    return worker
 
-@app.route('/customer/add_to_cart/<int:p_id>', methods=['POST'])
+@hook('before_request')
+def start_outbox():
+    # Started with the first request rather than the first checkout, so jobs
+    # left over from before a restart are picked up.
+    if current_app.config['OUTBOX_WORKERS'] > 0:
+        get_outbox()
+
+# Live updates (see events.py): checkouts publish their orders and the new
+# stock in their transaction, and a hub thread in every worker pushes them to
+# the pages holding a stream open at /events. EVENTS=0 turns both off.
+DEFAULT_CONFIG['EVENTS'] = os.environ.get('EVENTS', '1') == '1'
+DEFAULT_CONFIG['EVENTS_POLL_INTERVAL'] = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+DEFAULT_CONFIG['EVENTS_HEARTBEAT'] = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+DEFAULT_CONFIG['EVENTS_RETAIN'] = float(os.environ.get('EVENTS_RETAIN', 300))
+
+def get_event_hub():
+    hub = current_app.extensions.get('event_hub')
+    if hub is None:
+        with _pool_lock:
+            hub = current_app.extensions.get('event_hub')
+            if hub is None:
+                hub = events.EventHub(_in_app(get_pool), poll_interval=current_app.config['EVENTS_POLL_INTERVAL'],
+                                      heartbeat=current_app.config['EVENTS_HEARTBEAT'],
+                                      retain=current_app.config['EVENTS_RETAIN'])
+                hub.start()
+                current_app.extensions['event_hub'] = hub
+    return hub
+
+@hook('before_request')
+def start_event_hub():
+    # Every worker runs one, as it is also what deletes old events.
+    if current_app.config['EVENTS']:
+        get_event_hub()
+
+def render_order_row(page, order):
+    return current_app.jinja_env.get_template(f'_{page}_order_row.html').render(order=order)
+
+def queue_payment_jobs(db, order_key, key_for):
+    """before_commit hook for checkout_engine: retire the gateway order,
+    queue the post-payment jobs and publish the live updates for the new
+    orders in the checkout transaction. key_for(items, amount) is the order
+    key the placed items should have been paid under."""
+    c_id, form = session['user_id'], request.form
+
+    def queue(o_ids):
+        # The key and amount are worked out again from the orders just placed,
+        # so a payment made for another cart, quantity or price (or an order
+        # already used) raises PaymentMismatch and rolls the checkout back.
+        # The signature is then checked against the gateway order created for
+        # that key; the posted razorpay_order_id is ignored.
+        items = db.execute(f'''
+            SELECT orders.p_id, orders.o_quantity AS quantity, products.p_priceperunit
+            FROM orders JOIN products ON orders.p_id = products.p_id
+            WHERE orders.o_id IN ({', '.join('?' * len(o_ids))})
+        ''', o_ids).fetchall()
+        amount = payment_orders.order_amount(items)
+        if not hmac.compare_digest(key_for(items, amount), order_key):
+            raise payment_orders.PaymentMismatch(order_key)
+        gateway_order_id = get_payment_orders().mark_paid(db, c_id, order_key, amount)
+        outbox.enqueue(db, 'verify_payment', {'o_ids': o_ids, 'payment_id': form.get('razorpay_payment_id'),
+                                              'order_id': gateway_order_id, 'amount': amount,
+                                              'signature': form.get('razorpay_signature')})
+        outbox.enqueue(db, 'notify_farmers', {'o_ids': o_ids})
+        if current_app.config['EVENTS']:
+            events.publish_checkout(db, o_ids, render_order_row)
+    return queue
+
+def wake_after_checkout():
+    get_outbox().wake()
+    if current_app.config['EVENTS']:
+        get_event_hub().wake()
+
+@route(events.PATH)
+def event_stream():
+    if not current_app.config['EVENTS']:
+        abort(404)
+    role, user_id = session.get('role'), session.get('user_id')
+    channels = {'customer': ['products', data_versions.customer(user_id)],
+                'farmer': [data_versions.farmer(user_id)],
+                'admin': ['admin']}.get(role)
+    if channels is None:
+        return jsonify({'error': 'Login required.'}), 401
+
+    hub = get_event_hub()
+    last_event_id = request.headers.get('Last-Event-ID')
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    attach = request.environ.get('chawal.attach_stream')
+    if attach is not None:
+        # serve.py sends the headers, then gives the connection to the hub
+        # instead of keeping this request thread on it.
+        attach(lambda sock: hub.attach(sock, channels, last_event_id))
+        return Response(mimetype='text/event-stream', headers=headers)
+    return Response(hub.stream(channels, last_event_id), mimetype='text/event-stream', headers=headers)
+
+@route('/customer/add_to_cart/<int:p_id>', methods=['POST'])
 def add_to_cart(p_id):
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
@@ -395,53 +1153,61 @@ def add_to_cart(p_id):
     try:
         quantity = int(request.form['quantity'])
     except ValueError:
+        quantity = 0
+    if quantity <= 0:
         flash('Invalid quantity.', 'error')
         return redirect(url_for('dashboard_customer'))
 
-    product = db.execute('SELECT * FROM products WHERE p_id = ?', (p_id,)).fetchone()
-    if not product:
-        flash('Product not found.', 'error')
-        return redirect(url_for('dashboard_customer'))
-        
-    if quantity > product['p_quantity']:
-        flash(f'Only {product["p_quantity"]} kg available.', 'error')
-        return redirect(url_for('dashboard_customer'))
-        
-    # Check if item already in cart
-    existing_item = db.execute('SELECT * FROM cart WHERE c_id = ? AND p_id = ?', (session['user_id'], p_id)).fetchone()
-    
-    if existing_item:
-        new_quantity = existing_item['quantity'] + quantity
-        if new_quantity > product['p_quantity']:
-             flash(f'Total quantity in cart exceeds availability ({product["p_quantity"]} kg).', 'error')
-        else:
-            db.execute('UPDATE cart SET quantity = ? WHERE cart_id = ?', (new_quantity, existing_item['cart_id']))
-            flash('Cart updated.', 'success')
+    try:
+        cart.apply(db, session['user_id'], [('add', p_id, quantity)])
+    except cart.CartError as e:
+        flash(str(e), 'error')
     else:
-        db.execute('INSERT INTO cart (c_id, p_id, quantity) VALUES (?, ?, ?)', (session['user_id'], p_id, quantity))
         flash('Added to cart.', 'success')
-        
-    db.commit()
     return redirect(url_for('dashboard_customer'))
 
-@app.route('/customer/cart')
+def cart_tables():
+    # Names, prices and stock come from products.
+    return [('cart', data_versions.customer(session['user_id'])), ('products', '')]
+
+@route('/customer/cart')
 def view_cart():
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
         
     db = get_db()
-    cart_items = db.execute('''
-        SELECT cart.*, products.p_name, products.p_priceperunit, products.p_quantity as max_quantity 
-        FROM cart 
-        JOIN products ON cart.p_id = products.p_id 
-        WHERE cart.c_id = ?
-    ''', (session['user_id'],)).fetchall()
-    
-    total_amount = sum([item['quantity'] * item['p_priceperunit'] for item in cart_items])
-    
-    return render_template('cart.html', cart_items=cart_items, total_amount=total_amount)
+    etag = page_etag(db, cart_tables())
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    contents = cart.load(db, session['user_id'])
+    return with_etag(render_template('cart.html', cart_items=contents['items'], total_amount=contents['total']), etag)
+
+@route('/customer/cart/items', methods=['GET', 'POST'])
+def cart_items_api():
+    if session.get('role') != 'customer':
+        return jsonify({'error': 'Login required.'}), 401
 
-@app.route('/customer/cart/remove/<int:cart_id>')
+    db = get_db()
+    if request.method == 'GET':
+        etag = page_etag(db, cart_tables())
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        return with_etag(jsonify(cart.load(db, session['user_id'])), etag)
+
+    # A batch of add / set / remove operations, applied all-or-nothing; the
+    # response is the recomputed cart so the page can redraw it in place.
+    try:
+        operations = cart.parse_operations(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(cart.apply(db, session['user_id'], operations))
+    except cart.CartError as e:
+        return jsonify({'error': str(e), 'problems': e.problems, **cart.load(db, session['user_id'])}), 409
+
+@route('/customer/cart/remove/<int:cart_id>')
 def remove_from_cart(cart_id):
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
@@ -452,7 +1218,7 @@ def remove_from_cart(cart_id):
     flash('Item removed from cart.', 'success')
     return redirect(url_for('view_cart'))
 
-@app.route('/customer/checkout', methods=['GET', 'POST'])
+@route('/customer/checkout', methods=['GET', 'POST'])
 def checkout():
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
@@ -471,55 +1237,97 @@ def checkout():
         
     total_amount = sum([item['quantity'] * item['p_priceperunit'] for item in cart_items])
     
-    # Razorpay Order Creation
-    data = { "amount": int(total_amount * 100), "currency": "INR", "receipt": "order_rcptid_11" }
-    payment = client.order.create(data=data)
+    # Razorpay order creation happens in the background; the page polls for its id
+    amount = payment_orders.order_amount(cart_items)
+    key = payment_orders.cart_order_key(session['user_id'], cart_items, amount)
+    payment = get_payment_orders().order_for(db, session['user_id'], key, amount, receipt=f"cart_{session['user_id']}_{key[5:21]}")
 
     customer = db.execute('SELECT * FROM customers WHERE c_id = ?', (session['user_id'],)).fetchone()
     
-    return render_template('checkout.html', cart_items=cart_items, total_amount=total_amount, payment=payment, key_id=KEY_ID, customer=customer)
+    return render_template('checkout.html', cart_items=cart_items, total_amount=total_amount, payment=payment, key_id=current_app.config['RAZORPAY_KEY_ID'], customer=customer)
+
+@route('/customer/payment/order/<order_key>')
+def payment_order_status(order_key):
+    if session.get('role') != 'customer':
+        return jsonify({'error': 'Login required.'}), 401
+
+    payment = get_payment_orders().status(get_db(), session['user_id'], order_key, retry=request.args.get('retry') == '1')
+    if payment is None:
+        return jsonify({'error': 'Unknown payment order.'}), 404
+    return jsonify(payment)
 
-@app.route('/customer/payment/success', methods=['POST'])
+@route('/customer/payment/success', methods=['POST'])
 def payment_success():
     if session.get('role') != 'customer':
         return redirect(url_for('login'))
     
     db = get_db()
-    cart_items = db.execute('''
-        SELECT cart.*, products.p_name, products.p_priceperunit, products.p_quantity as stock_quantity, products.f_id
-        FROM cart 
-        JOIN products ON cart.p_id = products.p_id 
+    destination = request.form.get('destination', 'Default Address')
+    order_key = request.form.get('order_key', '')
+    changed = db.execute('''
+        SELECT DISTINCT products.p_type, products.f_id
+        FROM cart JOIN products ON cart.p_id = products.p_id
         WHERE cart.c_id = ?
     ''', (session['user_id'],)).fetchall()
-    
-    destination = request.form.get('destination', 'Default Address')
-    
-    for item in cart_items:
-        total_price = item['quantity'] * item['p_priceperunit']
-        
-        # 1. Create Order
-        cursor = db.execute('INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount) VALUES (?, ?, ?, ?, ?)',
-                   (session['user_id'], item['p_id'], 'Confirmed', destination, total_price))
-        o_id = cursor.lastrowid
-        
-        # 2. Create Payment Record
-        db.execute('INSERT INTO payments (o_id, c_id, p_amount, p_method, p_status) VALUES (?, ?, ?, ?, ?)',
-                   (o_id, session['user_id'], total_price, 'Online (Razorpay)', 'Completed'))
-        
-        # 3. Update Inventory
-        new_quantity = item['stock_quantity'] - item['quantity']
-        if new_quantity <= 0:
-            db.execute('UPDATE products SET p_quantity = 0, p_status = "Sold Out" WHERE p_id = ?', (item['p_id'],))
-        else:
-            db.execute('UPDATE products SET p_quantity = ? WHERE p_id = ?', (new_quantity, item['p_id']))
-            
-    # Clear Cart
-    db.execute('DELETE FROM cart WHERE c_id = ?', (session['user_id'],))
-    db.commit()
+
+    # The whole cart becomes orders, payments and stock decrements in one
+    # transaction; a repeated callback for the same payment id is a no-op.
+    c_id = session['user_id']
+    try:
+        checkout_engine.checkout_cart(db, c_id, destination,
+                               payment_id=request.form.get('razorpay_payment_id'),
+                               before_commit=queue_payment_jobs(db, order_key, lambda items, amount:
+                                   payment_orders.cart_order_key(c_id, items, amount)))
+    except checkout_engine.InsufficientStock as e:
+        flash(f'{e} Your order was not placed; please update your cart.', 'error')
+        return redirect(url_for('view_cart'))
+    except payment_orders.PaymentMismatch:
+        flash('Your payment does not match your cart. Your order was not placed; please check out again.', 'error')
+        return redirect(url_for('view_cart'))
+    wake_after_checkout()
+    get_catalog_cache().invalidate_products(db, [(p['p_type'], p['f_id']) for p in changed])
     
     flash('Payment successful! Orders placed.', 'success')
     return redirect(url_for('dashboard_customer'))
 
+def create_app(config=None):
+    """A new application: the settings read from the environment with
+    config's keys applied over them, and every view and hook of this module.
+    Each application builds its own pool, caches and worker pools from its
+    settings on first use."""
+    flask_app = Flask(__name__)
+    flask_app.config.update(DEFAULT_CONFIG)
+    flask_app.config.update(config or {})
+    if flask_app.config['TEMPLATE_CACHE']:
+        flask_app.jinja_options = {**flask_app.jinja_options, 'bytecode_cache': jinja2.FileSystemBytecodeCache(
+            flask_app.config['TEMPLATE_CACHE_DIR'])}
+    for name, func in _hooks:
+        getattr(flask_app, name)(func)
+    for rule, options, view in _views:
+        flask_app.add_url_rule(rule, view_func=view, **options)
+    return flask_app
+
+def warm_up(flask_app=None):
+    """Do the work of the first requests up front: migrate the database,
+    compile and hash every template, build the URL matcher and hash and
+    precompress the static files. serve.py calls this before forking so that workers
+    inherit the result; no database connection is left open."""
+    flask_app = flask_app or app
+    with flask_app.app_context():
+        get_pool().close_all()
+        for name in flask_app.jinja_env.list_templates():
+            flask_app.jinja_env.get_template(name)
+        flask_app.url_map.update()
+        get_template_version()
+        if flask_app.config['FINGERPRINT_ASSETS']:
+            get_asset_manifest().build()
+        if flask_app.config['RESPONSIVE_IMAGES']:
+            images.formats()
+
+# The application configured from the environment, for `flask --app app`,
+# WSGI servers and scripts that import it.
+app = create_app()
+
 if __name__ == '__main__':
     if not os.path.exists(DATABASE):
         import database
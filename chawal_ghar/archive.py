@@ -0,0 +1,152 @@
+"""Hot/cold split of the order history.
+
+archive_orders() moves orders older than ARCHIVE_AFTER_DAYS, with their
+payments, from orders and payments into orders_archive and payments_archive
+(migrations/0013_order_archive.sql), BATCH_SIZE orders per transaction so a
+checkout never waits long for the write lock. The sales summaries keep
+counting archived orders.
+
+History pages read through newest_first(), which runs the page query on the
+hot table and goes to the archive only when that does not fill the page
+with rows newer than everything archived, or for date ranges that start
+before the newest archived row. The first pages of every dashboard are
+answered from the hot tables alone.
+
+    python archive.py [database.db] [--days 365] [--batch 2000]
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+import migrate_db
+
+DATABASE = 'database.db'
+ARCHIVE_AFTER_DAYS = 365
+BATCH_SIZE = 2000
+
+# Hot table -> (archive table, date column).
+TABLES = {
+    'orders': ('orders_archive', 'o_date'),
+    'payments': ('payments_archive', 'p_date'),
+}
+
+
+def archive_orders(conn, days=ARCHIVE_AFTER_DAYS, batch=BATCH_SIZE):
+    """Move orders placed more than `days` days ago and their payments to the
+    archive. Returns the number of orders moved."""
+    before = conn.execute("SELECT datetime('now', ?)", (f'-{days} days',)).fetchone()[0]
+    moved = 0
+    while True:
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            last = conn.execute('SELECT MAX(o_id) FROM (SELECT o_id FROM orders WHERE o_date < ? ORDER BY o_id LIMIT ?)',
+                                (before, batch)).fetchone()[0]
+            if last is None:
+                conn.rollback()
+                break
+            # Copied before the delete, so orders_sales_delete sees the
+            # archived row and leaves the summaries alone.
+            batch_orders = 'SELECT o_id FROM orders WHERE o_id <= :last AND o_date < :before'
+            params = {'last': last, 'before': before}
+            count = conn.execute(f'''
+                INSERT INTO orders_archive (o_id, c_id, p_id, o_date, o_status, o_destination, o_amount, o_quantity)
+                SELECT o_id, c_id, p_id, o_date, o_status, o_destination, o_amount, o_quantity
+                FROM orders WHERE o_id IN ({batch_orders})
+            ''', params).rowcount
+            conn.execute(f'''
+                INSERT INTO payments_archive (pay_id, o_id, c_id, p_amount, p_date, p_method, p_status, gateway_payment_id)
+                SELECT pay_id, o_id, c_id, p_amount, p_date, p_method, p_status, gateway_payment_id
+                FROM payments WHERE o_id IN ({batch_orders})
+            ''', params)
+            for table, (archive, date_column) in TABLES.items():
+                conn.execute(f'''
+                    INSERT INTO archive_bounds (table_name, newest)
+                    SELECT :archive, MAX({date_column}) FROM {table} WHERE o_id IN ({batch_orders}) AND {date_column} IS NOT NULL
+                    HAVING COUNT(*) > 0
+                    ON CONFLICT (table_name) DO UPDATE SET newest = MAX(newest, excluded.newest)
+                ''', {**params, 'archive': archive})
+            conn.execute(f'DELETE FROM payments WHERE o_id IN ({batch_orders})', params)
+            conn.execute('DELETE FROM orders WHERE o_id <= :last AND o_date < :before', params)
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        moved += count
+    if moved:
+        # Without fresh statistics for both sides the planner reads the
+        # archive through c_id or p_id and sorts all of it. A sampled
+        # ANALYZE takes a few milliseconds.
+        conn.execute('PRAGMA analysis_limit = 1000')
+        for table, (archive, _) in TABLES.items():
+            conn.execute(f'ANALYZE {table}')
+            conn.execute(f'ANALYZE {archive}')
+        conn.execute('PRAGMA analysis_limit = 0')
+        if conn.in_transaction:
+            conn.commit()
+    return moved
+
+
+def archive_needed(db, table, since=None):
+    """Whether reads of table can find anything in its archive: false while
+    the archive is empty or when `since` (a date) is after its newest row."""
+    row = db.execute('SELECT newest FROM archive_bounds WHERE table_name = ?', (TABLES[table][0],)).fetchone()
+    return row is not None and (since is None or row[0] >= since)
+
+
+def newest_first(db, table, sql, params, limit, since=None):
+    """Up to limit rows of sql across table and its archive, newest first.
+
+    sql selects from `{table}` (aliased to the hot table's name if its
+    columns are qualified), has its key (o_id or pay_id) as first column and
+    ends in ORDER BY <key> DESC LIMIT ?. since is the start of the date
+    range being read, if any.
+    """
+    archive = TABLES[table][0]
+    rows = db.execute(sql.format(table=table), list(params) + [limit]).fetchall()
+    if len(rows) == limit:
+        newest_archived = db.execute(f'SELECT MAX(rowid) FROM {archive}').fetchone()[0]
+        if newest_archived is None or rows[-1][0] > newest_archived:
+            return rows
+    if not archive_needed(db, table, since):
+        return rows
+    archived = db.execute(sql.format(table=archive), list(params) + [limit]).fetchall()
+    if not rows:
+        return archived
+    return sorted(rows + archived, key=lambda row: row[0], reverse=True)[:limit]
+
+
+def sizes(db):
+    """{table: rows} for the hot and archive tables."""
+    return {name: db.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+            for table, (archive, _) in TABLES.items() for name in (table, archive)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', nargs='?', default=DATABASE)
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='archive orders older than this')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='orders moved per transaction')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA foreign_keys = ON')
+    try:
+        migrate_db.migrate(conn)
+        start = time.perf_counter()
+        moved = archive_orders(conn, args.days, args.batch)
+        print(f'Archived {moved} orders older than {args.days} days in {time.perf_counter() - start:.1f} s.')
+        print(', '.join(f'{table}: {rows}' for table, rows in sizes(conn).items()))
+    except sqlite3.Error as e:
+        sys.exit(f'Archiving failed: {e}')
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Content-hashed URLs and precompressed copies of the files under static/.
+
+asset_url('css/style.css') gives /assets/css/style.<hash>.css; since the URL
+changes whenever the file does, it can be cached for a year. Text assets are
+also served gzip- or brotli-compressed from copies written once to
+static/cache/assets (brotli needs the optional brotli package).
+
+    python assets.py    # hash and precompress everything, write manifest.json
+
+The app loads manifest.json at startup when it is there, so a deploy that
+ran assets.py only stat()s each static file instead of hashing it again;
+files that changed since are rehashed as usual.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+CACHE_DIR = os.path.join(STATIC_DIR, 'cache', 'assets')
+MANIFEST_PATH = os.path.join(CACHE_DIR, 'manifest.json')
+
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+# Best first; the extension of the precompressed copy for each encoding.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+_HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]+)$' % HASH_LENGTH)
+
+
+def encodings():
+    return [(name, ext) for name, ext in ENCODINGS if name != 'br' or brotli is not None]
+
+
+class Manifest:
+    """Maps static file names to their content hash.
+
+    Hashes are computed on first use and remembered; with auto_reload the
+    file is stat()ed on every lookup and rehashed when it changes (for
+    development), otherwise files are assumed not to change while the
+    process runs.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, auto_reload=False):
+        self.static_dir = static_dir
+        self.auto_reload = auto_reload
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def path(self, filename):
+        """Absolute path of filename under static/, or None if it is not a file there."""
+        path = os.path.normpath(os.path.join(self.static_dir, filename))
+        if not path.startswith(self.static_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def digest(self, filename):
+        """Full sha256 hex digest of the file's contents, or None if it does not exist."""
+        entry = self._hashes.get(filename)
+        if entry is not None and not self.auto_reload:
+            return entry[1]
+        path = self.path(filename)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+            return entry[1]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha.update(chunk)
+        with self._lock:
+            self._hashes[filename] = ((stat.st_mtime_ns, stat.st_size), sha.hexdigest())
+        return sha.hexdigest()
+
+    def fingerprint(self, filename):
+        digest = self.digest(filename)
+        return digest[:HASH_LENGTH] if digest else None
+
+    def hashed_name(self, filename):
+        """css/style.css -> css/style.<hash>.css; filename unchanged if it does not exist."""
+        fingerprint = self.fingerprint(filename)
+        if fingerprint is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f'{stem}.{fingerprint}{ext}'
+
+    def resolve(self, hashed):
+        """(filename, current) for a hashed name; current is False when the
+        hash is not the file's present content (an old page asking for a
+        previous version). (None, False) if there is no such file."""
+        match = _HASHED_NAME.match(hashed)
+        if match is None:
+            return None, False
+        filename = match['stem'] + match['ext']
+        fingerprint = self.fingerprint(filename)
+        if fingerprint is None:
+            return None, False
+        return filename, fingerprint == match['hash']
+
+    def compressed(self, filename, accept_encoding):
+        """(path, encoding) of the best precompressed copy of filename the
+        client accepts, writing it on first use. (None, None) when the file is
+        not worth compressing or the client accepts none of them."""
+        if not filename.lower().endswith(COMPRESSIBLE):
+            return None, None
+        accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').split(',')}
+        for encoding, ext in encodings():
+            if encoding in accepted:
+                return self._precompress(filename, encoding, ext), encoding
+        return None, None
+
+    def load(self, path=MANIFEST_PATH):
+        """Take the hashes recorded by save() for files whose size and mtime
+        still match; returns how many were taken (0 without a manifest)."""
+        try:
+            with open(path) as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        loaded = {}
+        for filename, entry in recorded.items():
+            file_path = self.path(filename)
+            if file_path is None or not isinstance(entry, dict):
+                continue
+            stat = os.stat(file_path)
+            if [stat.st_mtime_ns, stat.st_size] == [entry.get('mtime_ns'), entry.get('size')]:
+                loaded[filename] = ((stat.st_mtime_ns, stat.st_size), entry['sha256'])
+        with self._lock:
+            self._hashes.update(loaded)
+        return len(loaded)
+
+    def save(self, path=MANIFEST_PATH):
+        """Write every hash computed so far, with its hashed name, for load()."""
+        with self._lock:
+            hashes = dict(self._hashes)
+        manifest = {}
+        for filename, ((mtime_ns, size), digest) in sorted(hashes.items()):
+            stem, ext = os.path.splitext(filename)
+            manifest[filename] = {'hashed': f'{stem}.{digest[:HASH_LENGTH]}{ext}', 'sha256': digest,
+                                  'mtime_ns': mtime_ns, 'size': size}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+        return manifest
+
+    def build(self):
+        """Hash and precompress every static file (outside static/cache);
+        returns the manifest {filename: hashed name}."""
+        manifest = {}
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.dirname(CACHE_DIR)]
+            for name in sorted(files):
+                filename = os.path.relpath(os.path.join(root, name), self.static_dir).replace(os.sep, '/')
+                manifest[filename] = self.hashed_name(filename)
+                if filename.lower().endswith(COMPRESSIBLE):
+                    for encoding, ext in encodings():
+                        self._precompress(filename, encoding, ext)
+        return manifest
+
+    def _precompress(self, filename, encoding, ext):
+        target = os.path.join(CACHE_DIR, f'{self.hashed_name(filename)}{ext}')
+        if os.path.exists(target):
+            return target
+        with open(self.path(filename), 'rb') as f:
+            data = f.read()
+        data = brotli.compress(data, quality=11) if encoding == 'br' else gzip.compress(data, 9, mtime=0)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # A temporary file of our own, so threads compressing the same asset
+        # never write or rename each other's copy.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return target
+
+
+if __name__ == '__main__':
+    manifest = Manifest()
+    manifest.build()
+    manifest = manifest.save()
+    print(f'Hashed {len(manifest)} static files; manifest written to {MANIFEST_PATH}.'
+          + ('' if brotli else ' (brotli not installed: gzip only)'), file=sys.stderr)
@@ -0,0 +1,1049 @@
+"""Requests/sec for the customer dashboard and checkout routes, comparing a
+fresh sqlite3.connect per request (the old behaviour) with the tuned pool.
+
+    python benchmark.py [--threads 8] [--requests 2000]
+
+With --checkout-stress, instead runs --requests parallel single-item checkouts
+against one product with less stock than buyers and reports checkouts/sec
+(tests/test_checkout.py checks that nothing is oversold).
+
+With --page-weight, instead reports the bytes a browser downloads for the
+dashboards (HTML plus the images it would pick at --viewport px wide) with
+the original PNGs and with the resized variants.
+
+With --sales-check, instead places --requests random orders from --threads
+threads, changes and deletes some of them and times the farmer dashboard
+queries against reading every order (tests/test_sales.py checks the
+summaries against a full recompute).
+
+With --export-memory, instead measures peak RSS of an orders CSV export at
+growing row counts, streamed and loaded with fetchall().
+
+With --login-storm, instead measures customer dashboard latency while
+--threads clients post failing logins, with password hashing inline and on
+the bounded credential pool.
+
+With --product-import, instead imports generated product CSVs of growing row
+counts (1% of rows invalid) through the import endpoint, reporting time and
+peak RSS, and compares the rate with one add_product form post per row.
+
+With --cart-edit, instead times changing every line of a 20-item cart, one
+form post and cart page reload per line and as one batch to the cart API.
+
+With --metrics-overhead, instead times a few pages from one thread in
+alternating rounds with request and SQL metrics off and on.
+
+With --serving, instead starts the Flask debug server (as run_app_test.py
+does) and serve.py, and reports the time from launch to the first served
+request and req/s over HTTP from --threads clients.
+
+With --outbox, instead reports payment callback latency and outbox jobs/s
+drained by 1, 2 and 4 worker threads (tests/test_outbox.py checks that
+jobs of a killed worker run once).
+
+With --archive [ORDERS], instead seeds five years of history (a million
+orders by default) and reports dashboard latency before and after archiving
+orders older than a year.
+
+With --conditional, instead seeds a medium-sized dataset and reports CPU
+time per request for repeat views of the dashboards and cart: fully
+rendered, rendered from cached fragments, and answered 304 to
+If-None-Match.
+
+With --live-updates [STREAMS], instead opens STREAMS event streams (5000 by
+default) to serve.py and reports server memory per stream and how long a
+checkout takes to reach all of them.
+
+With --repeat-visit, instead loads a few customer pages twice through a
+simulated browser cache and reports requests and bytes for each visit, with
+plain /static URLs and with fingerprinted /assets URLs.
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import re
+import resource
+import selectors
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import date, timedelta
+from html.parser import HTMLParser
+
+from werkzeug.security import generate_password_hash
+
+import app as chawal_app
+import catalog
+import checkout_engine
+import db_pool
+import events
+import exports
+import archive
+import images
+import loadtest
+import migrate_db
+import outbox
+import payment_orders
+import sales
+import seed
+
+MODES = {
+    'connect-per-request': {'DATABASE_POOL_SIZE': 0, 'SQLITE_PRAGMAS': {}},
+    'pooled-wal': {'DATABASE_POOL_SIZE': 8, 'SQLITE_PRAGMAS': None},
+}
+
+
+def make_database(path, products=200):
+    conn = sqlite3.connect(path)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as f:
+        conn.executescript(f.read())
+    password = generate_password_hash('bench')
+    conn.execute("INSERT INTO farmers (f_firstname, f_lastname, f_loginname, f_password) VALUES ('Bench', 'Farmer', 'farmer', ?)", (password,))
+    conn.execute("INSERT INTO customers (c_firstname, c_lastname, c_loginname, c_password) VALUES ('Bench', 'Customer', 'customer', ?)", (password,))
+    conn.executemany('INSERT INTO products (f_id, p_name, p_type, p_quantity, p_status, p_priceperunit, p_batch) VALUES (1, ?, ?, 1000, "Available", 80.0, "B1")',
+                     [(f'Rice {i}', catalog.RICE_TYPES[i % len(catalog.RICE_TYPES)]) for i in range(products)])
+    conn.executemany('INSERT INTO cart (c_id, p_id, quantity) VALUES (1, ?, 2)', [(i,) for i in range(1, 6)])
+    conn.commit()
+    conn.close()
+
+
+def run(mode, threads, total):
+    flask_app = chawal_app.app
+    old = chawal_app.app.extensions.pop('db_pool', None)
+    if old is not None:
+        old.close_all()
+    flask_app.config.update(MODES[mode])
+    flask_app.config.update(PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0)
+
+    results = {}
+    for route in ('/customer/dashboard', '/customer/checkout'):
+        per_thread = total // threads
+        errors = []
+
+        def worker():
+            client = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['role'] = 'customer'
+                sess['fullname'] = 'Bench Customer'
+            for _ in range(per_thread):
+                response = client.get(route)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        results[route] = (per_thread * threads / elapsed, len(errors))
+    return results
+
+
+def stress_checkout(path, threads, buyers, stock=None):
+    stock = buyers // 2 if stock is None else stock
+    conn = db_pool.connect(path)
+    migrate_db.migrate(conn)
+    conn.execute("UPDATE products SET p_quantity = ?, p_status = 'Available' WHERE p_id = 1", (stock,))
+    conn.executemany("INSERT INTO customers (c_firstname, c_lastname, c_loginname, c_password) VALUES ('Buyer', ?, ?, 'x')",
+                     [(str(i), f'buyer{i}') for i in range(buyers)])
+    first_c_id = conn.execute('SELECT MIN(c_id) FROM customers WHERE c_firstname = ?', ('Buyer',)).fetchone()[0]
+    conn.commit()
+
+    pool = db_pool.ConnectionPool(path, max_size=threads)
+    counts = {'placed': 0, 'rejected': 0}
+    lock = threading.Lock()
+    next_buyer = iter(range(buyers))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_buyer, None)
+            if i is None:
+                return
+            db = pool.acquire()
+            try:
+                checkout_engine.buy_now(db, first_c_id + i, 1, 1, 'Stress Test', payment_id=f'pay_stress_{i}')
+                result = 'placed'
+            except checkout_engine.InsufficientStock:
+                result = 'rejected'
+            finally:
+                pool.release(db)
+            with lock:
+                counts[result] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    conn.close()
+    pool.close_all()
+    print(f'{buyers} buyers, {threads} threads, stock {stock} kg: placed={counts["placed"]} rejected={counts["rejected"]}')
+    print(f'{buyers / elapsed:.1f} checkouts/s')
+
+
+class ResourcePicker(HTMLParser):
+    """Collects the local stylesheets and the image URL a browser would fetch
+    for each <img>/<picture>: the first <source> type it supports (listed best
+    first), then the smallest srcset candidate covering the slot width from
+    sizes."""
+
+    def __init__(self, viewport):
+        super().__init__()
+        self.viewport = viewport
+        self.urls = []
+        self._source = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'link' and attrs.get('rel') == 'stylesheet' and attrs['href'].startswith('/'):
+            self.urls.append(attrs['href'])
+        elif tag == 'picture':
+            self._source = None
+        elif tag == 'source' and self._source is None:
+            self._source = attrs
+        elif tag == 'img':
+            chosen = self._source or attrs
+            self.urls.append(self._pick(chosen.get('srcset'), chosen.get('sizes')) if chosen.get('srcset') else attrs['src'])
+            self._source = None
+
+    def _pick(self, srcset, sizes):
+        slot = self.viewport
+        for size in (sizes or '100vw').split(','):
+            match = re.match(r'\s*(?:\(max-width:\s*(\d+)px\)\s*)?(\d+)(px|vw)\s*$', size)
+            if match and (match[1] is None or self.viewport <= int(match[1])):
+                slot = int(match[2]) * (self.viewport / 100 if match[3] == 'vw' else 1)
+                break
+        candidates = sorted((int(w[:-1]), url) for url, w in (c.split() for c in srcset.split(',')))
+        return next((url for w, url in candidates if w >= slot), candidates[-1][1])
+
+
+def page_weight(viewport):
+    """HTML + image bytes of each dashboard, with and without variants."""
+    flask_app = chawal_app.app
+    flask_app.config.update(PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0)
+    pages = [('/customer/dashboard?limit=50', 'customer'), ('/farmer/dashboard', 'farmer')]
+    for responsive in (False, True):
+        flask_app.config['RESPONSIVE_IMAGES'] = responsive
+        # Cached product cards link whichever images they were rendered with.
+        flask_app.extensions.pop('fragment_cache', None)
+        for route, role in pages:
+            client = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['role'] = role
+                sess['fullname'] = f'Bench {role.title()}'
+            html = client.get(route).get_data(as_text=True)
+            picker = ResourcePicker(viewport)
+            picker.feed(html)
+            urls = [url for url in dict.fromkeys(picker.urls) if not url.startswith(('/static/css', '/assets/css'))]
+            image_bytes = sum(len(client.get(url).data) for url in urls)
+            label = 'responsive' if responsive else 'original'
+            print(f'{label:10} {route:30} html={len(html.encode()) / 1024:7.1f} KB  '
+                  f'{len(urls):2} images={image_bytes / 1024:8.1f} KB  '
+                  f'total={(len(html.encode()) + image_bytes) / 1024:8.1f} KB')
+
+
+def repeat_visit(viewport):
+    """Requests and bytes (bodies as sent, gzip where accepted) for a first and
+    a repeat visit, honouring Cache-Control and ETags like a browser."""
+    flask_app = chawal_app.app
+    flask_app.config.update(PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0, RESPONSIVE_IMAGES=True)
+    pages = ['/customer/dashboard', '/customer/buy/1', '/customer/dashboard?type=Basmati']
+    for fingerprint in (False, True):
+        flask_app.config['FINGERPRINT_ASSETS'] = fingerprint
+        flask_app.extensions.pop('fragment_cache', None)
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['role'] = 'customer'
+            sess['fullname'] = 'Bench Customer'
+        cache = {}
+
+        def fetch(url, stats):
+            cached = cache.get(url)
+            if cached is not None and cached['fresh']:
+                return
+            headers = {'Accept-Encoding': 'gzip, br'}
+            if cached is not None and cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            response = client.get(url, headers=headers)
+            stats['requests'] += 1
+            stats['bytes'] += len(response.data)
+            stats['not_modified'] += response.status_code == 304
+            cc = response.cache_control
+            cache[url] = {'fresh': bool(cc.max_age) and not cc.no_cache,
+                          'etag': response.headers.get('ETag') or (cached or {}).get('etag')}
+
+        for visit in ('first', 'repeat'):
+            stats = {'requests': 0, 'bytes': 0, 'not_modified': 0}
+            for page in pages:
+                html = client.get(page).get_data(as_text=True)
+                picker = ResourcePicker(viewport)
+                picker.feed(html)
+                for url in dict.fromkeys(picker.urls):
+                    fetch(url, stats)
+            label = '/assets (hashed)' if fingerprint else '/static'
+            print(f'{label:17} {visit:6} visit: {len(pages)} pages + {stats["requests"]:3} asset requests '
+                  f'({stats["not_modified"]} revalidated, 304), {stats["bytes"] / 1024:7.1f} KB of assets')
+
+
+def sales_check(path, threads, total):
+    """Random checkouts, status changes and deletions, then the farmer
+dashboard's summary queries timed against a scan of every order."""
+    conn = db_pool.connect(path)
+    migrate_db.migrate(conn)
+    conn.execute('UPDATE products SET p_quantity = 1000000')
+    conn.executemany("INSERT INTO farmers (f_firstname, f_lastname, f_loginname, f_password) VALUES ('Farmer', ?, ?, 'x')",
+                     [(str(i), f'farmer{i}') for i in range(9)])
+    conn.execute('UPDATE products SET f_id = 1 + p_id % 10')
+    conn.commit()
+    products = [row[0] for row in conn.execute('SELECT p_id FROM products')]
+
+    pool = db_pool.ConnectionPool(path, max_size=threads)
+    per_thread = total // threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        db = pool.acquire()
+        try:
+            for _ in range(per_thread):
+                checkout_engine.buy_now(db, 1, rng.choice(products), rng.randint(1, 20), 'Sales Check')
+                if rng.random() < 0.2:
+                    db.execute('UPDATE orders SET o_status = ? WHERE o_id = (SELECT MAX(o_id) FROM orders)',
+                               (rng.choice(['Shipped', 'Delivered', 'Cancelled']),))
+                    db.commit()
+        finally:
+            pool.release(db)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    pool.close_all()
+    # Back-dated and removed orders move between and out of daily buckets.
+    conn.execute("UPDATE orders SET o_date = datetime(o_date, '-' || (o_id % 30) || ' days') WHERE o_id % 3 = 0")
+    conn.execute('DELETE FROM payments WHERE o_id % 17 = 0')
+    conn.execute('DELETE FROM orders WHERE o_id % 17 = 0')
+    conn.commit()
+
+    count = conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    start = time.perf_counter()
+    conn.execute('''
+        SELECT orders.*, products.p_name, customers.c_firstname, customers.c_lastname
+        FROM orders JOIN products ON orders.p_id = products.p_id JOIN customers ON orders.c_id = customers.c_id
+        WHERE products.f_id = 1
+    ''').fetchall()
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    sales.farmer_totals(conn, 1), sales.product_totals(conn, 1), sales.daily_sales(conn, 1), sales.order_page(conn, 1)
+    summary = time.perf_counter() - start
+    print(f"{count} orders: every order of one farmer {scan * 1000:.1f} ms, "
+          f"summaries + one page of recent orders {summary * 1000:.1f} ms")
+    conn.close()
+
+
+LOGIN_STORM_MODES = {
+    'no storm': None,
+    'storm, inline hashing': {'CREDENTIAL_WORKERS': 0, 'CREDENTIAL_MAX_PENDING': 10 ** 6},
+    'storm, bounded pool': {'CREDENTIAL_WORKERS': 1, 'CREDENTIAL_MAX_PENDING': 8},
+}
+
+
+def login_storm(threads, duration=5.0, readers=2):
+    """Catalog latency while `threads` clients post logins (wrong passwords
+    and unknown users) as fast as they can, with hashing inline and on the
+    bounded credential pool."""
+    flask_app = chawal_app.app
+    flask_app.config.update(PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0)
+    for label, config in LOGIN_STORM_MODES.items():
+        old = flask_app.extensions.pop('credentials', None)
+        if old is not None:
+            old.shutdown()
+        flask_app.config.update(config or {})
+        stop = threading.Event()
+        latencies, logins = [], {'ok': 0, 'shed': 0}
+        lock = threading.Lock()
+
+        def reader():
+            client = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['role'] = 'customer'
+                sess['fullname'] = 'Bench Customer'
+            while not stop.is_set():
+                start = time.perf_counter()
+                client.get('/customer/dashboard')
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+
+        def stormer(i):
+            client = flask_app.test_client()
+            while not stop.is_set():
+                response = client.post('/login', data={'role': 'customer', 'password': 'wrong',
+                                                       'loginname': 'customer' if i % 2 else f'nobody{i}'})
+                with lock:
+                    logins['shed' if response.status_code == 503 else 'ok'] += 1
+                if response.status_code == 503:
+                    time.sleep(0.05)
+
+        workers = [threading.Thread(target=reader) for _ in range(readers)]
+        if config is not None:
+            workers += [threading.Thread(target=stormer, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        time.sleep(duration)
+        stop.set()
+        for t in workers:
+            t.join()
+        latencies.sort()
+        p50, p95 = (latencies[int(len(latencies) * p)] * 1000 for p in (0.5, 0.95))
+        print(f'{label:22} catalog p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  ({len(latencies) / duration:6.1f} req/s)  '
+              f'logins {logins["ok"] / duration:5.1f}/s  shed (503) {logins["shed"] / duration:6.1f}/s')
+
+
+def cart_edit(rounds=50, lines=20):
+    """Time to change the quantity of every line of a `lines`-item cart: one
+    add_to_cart post plus a cart page reload per line, then one JSON batch."""
+    client = chawal_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['role'] = 'customer'
+        sess['fullname'] = 'Bench Customer'
+    client.post('/customer/cart/items', json={'operations': [{'op': 'set', 'p_id': p_id, 'quantity': 1}
+                                                             for p_id in range(1, lines + 1)]})
+
+    def per_line():
+        for p_id in range(1, lines + 1):
+            client.post(f'/customer/add_to_cart/{p_id}', data={'quantity': '1'})
+            client.get('/customer/cart')
+        return lines * 2
+
+    def batch():
+        response = client.post('/customer/cart/items', json={'operations': [
+            {'op': 'add', 'p_id': p_id, 'quantity': 1} for p_id in range(1, lines + 1)]})
+        assert response.status_code == 200, response.json
+        return 1
+
+    for label, edit in (('post per line', per_line), ('one batch', batch)):
+        start = time.perf_counter()
+        requests = sum(edit() for _ in range(rounds))
+        elapsed = time.perf_counter() - start
+        print(f'{label:14} {elapsed / rounds * 1000:7.1f} ms per cart edit  {requests // rounds:3} requests')
+
+
+def metrics_overhead(rounds=21, per_round=100):
+    """Fastest round's ms per request for a few pages with METRICS off and on.
+    Rounds alternate so drift in machine load hits both settings alike."""
+    flask_app = chawal_app.app
+    routes = {'customer': ('/customer/dashboard', '/customer/cart', '/customer/orders'),
+              'admin': ('/admin/dashboard', '/admin/customers')}
+    clients = {}
+    for role in routes:
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['role'] = role
+            sess['fullname'] = 'Bench'
+        clients[role] = client
+
+    timings = {(path, on): [] for paths in routes.values() for path in paths for on in (False, True)}
+    for _ in range(rounds):
+        for on in (False, True):
+            old = flask_app.extensions.pop('db_pool', None)
+            if old is not None:
+                old.close_all()
+            flask_app.config['METRICS'] = on
+            for role, paths in routes.items():
+                for path in paths:
+                    clients[role].get(path)
+                    start = time.perf_counter()
+                    for _ in range(per_round):
+                        response = clients[role].get(path)
+                        assert response.status_code == 200, (path, response.status_code)
+                    timings[path, on].append((time.perf_counter() - start) / per_round * 1000)
+
+    for paths in routes.values():
+        for path in paths:
+            off, on = (min(timings[path, m]) for m in (False, True))
+            print(f'{path:22} off {off:6.3f} ms  on {on:6.3f} ms  {(on - off) / off * 100:+5.1f}%')
+
+
+def _start_server(command, env, port):
+    """Launch a server process and return (process, ms until it served its
+    first request)."""
+    start = time.perf_counter()
+    process = subprocess.Popen([part.format(port=port) for part in command], env=env, start_new_session=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/login', timeout=5) as response:
+                if response.status == 200:
+                    return process, (time.perf_counter() - start) * 1000
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f'{command[1]} exited with status {process.returncode}')
+            time.sleep(0.005)
+
+
+def serving(path, threads, total):
+    """Startup and throughput of the debug server (with templates compiled on
+    first use, as before) and of serve.py."""
+    workers = max(os.cpu_count() or 1, 2)
+    env = dict(os.environ, DATABASE=path, PAYMENT_GATEWAY='fake')
+    servers = {
+        'debug server': ([sys.executable, '-m', 'flask', '--app', 'app', 'run', '--debug', '--port', '{port}'],
+                         dict(env, TEMPLATE_CACHE='0')),
+        'serve.py, 1 worker': ([sys.executable, 'serve.py', '--port', '{port}', '--workers', '1'], env),
+        f'serve.py, {workers} workers': ([sys.executable, 'serve.py', '--port', '{port}', '--workers', str(workers)], env),
+    }
+    pages = ('/customer/dashboard', '/customer/cart', '/customer/orders', '/customer/checkout')
+    for port, (label, (command, server_env)) in enumerate(servers.items(), 5301):
+        process, cold_start = _start_server(command, server_env, port)
+        try:
+            # The first view of each page, which the debug server has to
+            # compile templates for.
+            client = loadtest.HTTPClient(f'http://127.0.0.1:{port}')
+            client.request('POST', '/login', data={'role': 'customer', 'loginname': 'customer', 'password': 'bench'})
+            start = time.perf_counter()
+            for page in pages:
+                assert client.request('GET', page) == 200, page
+            first_views = (time.perf_counter() - start) * 1000
+
+            rates = {}
+            for route in ('/login', '/customer/dashboard'):
+                def worker():
+                    client = loadtest.HTTPClient(f'http://127.0.0.1:{port}')
+                    client.request('POST', '/login', data={'role': 'customer', 'loginname': 'customer', 'password': 'bench'})
+                    for _ in range(total // threads):
+                        assert client.request('GET', route) == 200
+                clients = [threading.Thread(target=worker) for _ in range(threads)]
+                start = time.perf_counter()
+                for t in clients:
+                    t.start()
+                for t in clients:
+                    t.join()
+                rates[route] = total // threads * threads / (time.perf_counter() - start)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=60)
+        print(f'{label:20} first request {cold_start:5.0f} ms  first view of {len(pages)} pages {first_views:5.0f} ms  ' +
+              '  '.join(f'{route} {rate:6.1f} req/s' for route, rate in rates.items()))
+
+
+def _queue_notifications(path, count):
+    """count orders, each with a notify_farmers job. Returns their o_ids."""
+    conn = db_pool.connect(path)
+    migrate_db.migrate(conn)
+    last = conn.execute('SELECT COALESCE(MAX(o_id), 0) FROM orders').fetchone()[0]
+    conn.executemany("INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount, o_quantity) VALUES (1, ?, 'Confirmed', 'Bench', 160, 2)",
+                     [(i % 200 + 1,) for i in range(count)])
+    o_ids = [row[0] for row in conn.execute('SELECT o_id FROM orders WHERE o_id > ?', (last,))]
+    for o_id in o_ids:
+        outbox.enqueue(conn, 'notify_farmers', {'o_ids': [o_id]})
+    conn.commit()
+    conn.close()
+    return o_ids
+
+
+def _cart_order_key(client):
+    """Create the gateway order for user 1's cart and return its key, which
+    the payment callback must post."""
+    assert client.get('/customer/checkout').status_code == 200
+    items = client.get('/customer/cart/items').get_json()['items']
+    return payment_orders.cart_order_key(1, items, payment_orders.order_amount(items))
+
+
+def outbox_throughput(path, jobs):
+    flask_app = chawal_app.app
+    flask_app.config.update(DATABASE=path, PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0, OUTBOX_WORKERS=2)
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['role'] = 'customer'
+    timings = []
+    for _ in range(200):
+        assert client.post('/customer/add_to_cart/1', data={'quantity': '1'}).status_code == 302
+        order_key = _cart_order_key(client)
+        start = time.perf_counter()
+        assert client.post('/customer/payment/success', data={'destination': 'Bench', 'razorpay_payment_id': '',
+                                                              'order_key': order_key}).status_code == 302
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f'payment callback: median {timings[len(timings) // 2]:.2f} ms  p95 {timings[int(len(timings) * 0.95)]:.2f} ms')
+    flask_app.extensions.pop('outbox').shutdown()
+
+    flask_app.config['OUTBOX_WORKERS'] = 0
+    with flask_app.app_context():
+        handlers = chawal_app.get_outbox().handlers
+        pool = chawal_app.get_pool()
+    for threads in (1, 2, 4):
+        _queue_notifications(path, jobs)
+        worker = outbox.OutboxWorker(lambda: pool, handlers, workers=threads, poll_interval=0.01)
+        start = time.perf_counter()
+        worker.start()
+        conn = pool.acquire()
+        while conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        pool.release(conn)
+        worker.shutdown()
+        print(f'{threads} thread(s): {jobs} jobs in {elapsed:.2f} s, {jobs / elapsed:.0f} jobs/s')
+    flask_app.extensions.pop('outbox').shutdown()
+    flask_app.extensions.pop('db_pool').close_all()
+
+
+def _median_ms(client, path, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (path, response.status_code)
+    return sorted(timings)[rounds // 2]
+
+
+def archive_latency(path, orders, days=5 * 365, rounds=30):
+    """Median ms for the dashboards over `days` of history with every order
+    in the hot tables, then after archiving orders older than a year."""
+    start = time.perf_counter()
+    seed.seed(path, **dict(seed.SCALES['medium'], orders=orders), days=days)
+    print(f'seeded {orders} orders over {days} days in {time.perf_counter() - start:.0f} s')
+    flask_app = chawal_app.app
+    flask_app.config['DATABASE'] = path
+    old_month = date.today() - timedelta(days=3 * 365)
+    pages = {
+        'admin dashboard': ('admin', 1, '/admin/dashboard'),
+        'admin, last 30 days': ('admin', 1, f'/admin/dashboard?from={date.today() - timedelta(days=30)}'),
+        'admin, 3 years ago': ('admin', 1, f'/admin/dashboard?from={old_month}&to={old_month + timedelta(days=30)}'),
+        'admin customers': ('admin', 1, '/admin/customers'),
+        'farmer dashboard': ('farmer', 7, '/farmer/dashboard'),
+        'customer dashboard': ('customer', 7, '/customer/dashboard'),
+        'customer orders': ('customer', 7, '/customer/orders'),
+    }
+    clients = {}
+    for role, user_id, _ in pages.values():
+        if (role, user_id) not in clients:
+            client = clients[role, user_id] = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['role'] = role
+                sess['fullname'] = 'Bench'
+
+    before = {label: _median_ms(clients[role, user_id], page, rounds) for label, (role, user_id, page) in pages.items()}
+    conn = db_pool.connect(path)
+    start = time.perf_counter()
+    moved = archive.archive_orders(conn, days=365)
+    print(f'archived {moved} orders in {time.perf_counter() - start:.1f} s; ' +
+          ', '.join(f'{table} {rows}' for table, rows in archive.sizes(conn).items()))
+    conn.close()
+    flask_app.extensions.pop('db_pool').close_all()
+    after = {label: _median_ms(clients[role, user_id], page, rounds) for label, (role, user_id, page) in pages.items()}
+    for label in pages:
+        print(f'{label:20} all hot {before[label]:8.2f} ms  archived {after[label]:8.2f} ms')
+    flask_app.extensions.pop('db_pool').close_all()
+
+
+def conditional_views(path, rounds=300):
+    """Median CPU ms per repeat view of each page: rendered with conditional
+    GET and fragments off, rendered with the fragment cache warm, and
+    revalidated (304). Settings alternate between rounds of 10 views."""
+    start = time.perf_counter()
+    seed.seed(path, **seed.SCALES['medium'])
+    print(f'seeded in {time.perf_counter() - start:.0f} s')
+    flask_app = chawal_app.app
+    flask_app.config.update(DATABASE=path, PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0)
+    pages = {
+        'customer dashboard': ('customer', 7, '/customer/dashboard'),
+        'customer, 100 products': ('customer', 7, '/customer/dashboard?limit=100'),
+        'cart': ('customer', 7, '/customer/cart'),
+        'farmer dashboard': ('farmer', 7, '/farmer/dashboard'),
+        'admin dashboard': ('admin', 1, '/admin/dashboard'),
+    }
+    settings = {'rendered': (False, 0), 'fragments': (False, 4096), '304': (True, 4096)}
+    clients = {}
+    for role, user_id, _ in pages.values():
+        if (role, user_id) not in clients:
+            client = clients[role, user_id] = flask_app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['role'] = role
+                sess['fullname'] = 'Bench'
+
+    timings = {(label, name): [] for label in pages for name in settings}
+    for _ in range(rounds // 10):
+        for name, (conditional, fragments) in settings.items():
+            flask_app.config.update(CONDITIONAL_GET=conditional, FRAGMENT_CACHE_SIZE=fragments)
+            flask_app.extensions.pop('fragment_cache', None)
+            for label, (role, user_id, page) in pages.items():
+                client = clients[role, user_id]
+                first = client.get(page)
+                assert first.status_code == 200, (page, first.status_code)
+                headers = {'If-None-Match': first.headers['ETag']} if conditional else {}
+                expected = 304 if conditional else 200
+                for _ in range(10):
+                    cpu = time.thread_time()
+                    response = client.get(page, headers=headers)
+                    timings[label, name].append((time.thread_time() - cpu) * 1000)
+                    assert response.status_code == expected, (page, response.status_code)
+    flask_app.extensions.pop('db_pool').close_all()
+    for label in pages:
+        medians = {name: sorted(timings[label, name])[len(timings[label, name]) // 2] for name in settings}
+        print(f'{label:24} ' + '  '.join(f'{name} {ms:6.2f} ms' for name, ms in medians.items()))
+
+
+def _rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+
+
+def _read_events(streams, kind, deadline):
+    """Read streams until each has sent an event of kind; the perf_counter
+    time each one arrived at."""
+    arrived = {}
+    selector = selectors.DefaultSelector()
+    for sock in streams:
+        selector.register(sock, selectors.EVENT_READ)
+    marker = f'event: {kind}\n'.encode()
+    while len(arrived) < len(streams) and time.perf_counter() < deadline:
+        for key, _ in selector.select(0.1):
+            data = key.fileobj.recv(65536)
+            if not data:
+                raise RuntimeError('the server closed an event stream')
+            if marker in data and key.fileobj not in arrived:
+                arrived[key.fileobj] = time.perf_counter()
+    selector.close()
+    return arrived
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.99)]
+
+
+def live_updates(path, streams, rounds=20):
+    """Server memory per open event stream, whether request threads stay
+    free while they are open, and how long a checkout takes to reach every
+    stream: placed through the server (which wakes its event hub) and
+    written by another process (picked up at the next poll)."""
+    env = dict(os.environ, DATABASE=path, PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY='0')
+    process, _ = _start_server([sys.executable, 'serve.py', '--port', '{port}', '--workers', '1'], env, 5311)
+    flask_app = chawal_app.app
+    cookie = flask_app.session_interface.get_signing_serializer(flask_app).dumps(
+        {'user_id': 1, 'role': 'customer', 'fullname': 'Bench'})
+    request = (f'GET {events.PATH} HTTP/1.1\r\nHost: bench\r\n'
+               f'Cookie: {flask_app.config["SESSION_COOKIE_NAME"]}={cookie}\r\n\r\n').encode()
+    opened = []
+    try:
+        client = loadtest.HTTPClient('http://127.0.0.1:5311')
+        client.request('POST', '/login', data={'role': 'customer', 'loginname': 'customer', 'password': 'bench'})
+        client.request('GET', '/customer/dashboard')
+        before = _rss_kb(process.pid)
+        start = time.perf_counter()
+        for _ in range(streams):
+            sock = socket.create_connection(('127.0.0.1', 5311))
+            sock.sendall(request)
+            opened.append(sock)
+        # Every stream starts with the response headers and a retry: line.
+        selector = selectors.DefaultSelector()
+        for sock in opened:
+            selector.register(sock, selectors.EVENT_READ, [b''])
+        waiting = len(opened)
+        while waiting:
+            for key, _ in selector.select(60):
+                key.data[0] += key.fileobj.recv(4096)
+                if b'retry: ' in key.data[0]:
+                    assert key.data[0].startswith(b'HTTP/1.1 200'), key.data[0][:100]
+                    selector.unregister(key.fileobj)
+                    waiting -= 1
+        selector.close()
+        open_seconds = time.perf_counter() - start
+        time.sleep(1)
+        per_stream = (_rss_kb(process.pid) - before) / streams
+        login_page = [0.0] * 20
+        for i in range(len(login_page)):
+            page_start = time.perf_counter()
+            assert client.request('GET', '/login') == 200
+            login_page[i] = (time.perf_counter() - page_start) * 1000
+        print(f'{streams} streams opened in {open_seconds:.1f} s, {per_stream:.1f} KB server RSS each; '
+              f'/login while open: median {sorted(login_page)[10]:.1f} ms')
+
+        conn = db_pool.connect(path)
+        for label in ('checkout over HTTP', 'write from another process'):
+            latencies = []
+            for i in range(rounds):
+                # Land anywhere within the hub's poll interval.
+                time.sleep(random.uniform(0, 0.5))
+                if label == 'checkout over HTTP':
+                    order_key = client.fetch_json('GET', '/customer/buy/1/payment?quantity=1', None)['key']
+                sent = time.perf_counter()
+                if label == 'checkout over HTTP':
+                    assert client.request('POST', '/customer/buy/1', data={
+                        'quantity': '1', 'destination': 'Bench', 'razorpay_payment_id': '',
+                        'order_key': order_key}) == 302
+                else:
+                    events.publish(conn, 'products', 'stock', {'p_id': 1, 'p_quantity': i, 'p_status': 'Available'})
+                    conn.commit()
+                arrived = _read_events(opened, 'stock', time.perf_counter() + 30)
+                assert len(arrived) == streams, f'{len(arrived)} of {streams} streams got the event'
+                latencies.extend((at - sent) * 1000 for at in arrived.values())
+            p50, p99 = _percentiles(latencies)
+            print(f'{label:28} to all {streams} streams: p50 {p50:7.1f} ms  p99 {p99:7.1f} ms')
+        conn.close()
+    finally:
+        for sock in opened:
+            sock.close()
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=60)
+
+
+def export_peak_rss(path, mode):
+    """Run one orders export in this process and print its peak RSS in KB.
+    mode is 'stream' (the export endpoint) or 'fetchall' (load every row,
+    then write the CSV).
+
+    mmap is turned off: mapped database pages are file-backed, capped at
+    mmap_size and shared with the OS page cache, and would otherwise show up
+    in RSS as the file is read. SQLite's own page cache still grows until it
+    reaches cache_size (16 MB by default)."""
+    pragmas = dict(db_pool.DEFAULT_PRAGMAS, mmap_size=0)
+    flask_app = chawal_app.app
+    flask_app.config.update(DATABASE=path, PAYMENT_GATEWAY='fake', SQLITE_PRAGMAS=pragmas)
+    if mode == 'stream':
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['role'] = 'admin'
+        response = client.get('/admin/export/orders.csv', buffered=False)
+        size = sum(len(block) for block in response.response)
+        response.close()
+    else:
+        conn = db_pool.connect(path, pragmas)
+        rows = conn.execute(exports.EXPORTS['orders']['select'].format(table='orders')).fetchall()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        size = len(buffer.getvalue())
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, size)
+
+
+def export_memory(sizes):
+    """Peak RSS of an orders CSV export at each row count, streamed and
+    fetchall(), each measured in a fresh interpreter."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'export.db')
+        make_database(path)
+        conn = db_pool.connect(path)
+        migrate_db.migrate(conn)
+        have = 0
+        for rows in sizes:
+            conn.execute('''
+                WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount, o_quantity)
+                SELECT 1, 1 + i % 200, 'Confirmed', 'Export benchmark, ' || i, 80.0 * (1 + i % 20), 1 + i % 20 FROM n
+            ''', (have + 1, rows))
+            conn.commit()
+            have = rows
+            peaks = {}
+            for mode in ('stream', 'fetchall'):
+                out = subprocess.run([sys.executable, '-c', f'import benchmark; benchmark.export_peak_rss({path!r}, {mode!r})'],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+                peak_kb, size = map(int, out.stdout.split())
+                peaks[mode] = peak_kb
+            print(f'{rows:>9} orders  {size / 2 ** 20:8.1f} MB CSV   peak RSS streamed {peaks["stream"] / 1024:7.1f} MB   '
+                  f'fetchall {peaks["fetchall"] / 1024:7.1f} MB')
+        conn.close()
+
+
+def write_product_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'type', 'quantity', 'price', 'batch'])
+        for i in range(rows):
+            writer.writerow([f'Imported rice {i}', catalog.RICE_TYPES[i % len(catalog.RICE_TYPES)],
+                             'lots' if i % 100 == 99 else 100 + i % 900, f'{40 + i % 60}.50', f'IMP-{i // 1000}'])
+
+
+def import_peak_rss(path, csv_path):
+    """POST one CSV to the import endpoint as a streamed text/csv body and
+    print peak RSS in KB, seconds taken, rows inserted and rows rejected.
+    mmap is off as in export_peak_rss."""
+    flask_app = chawal_app.app
+    flask_app.config.update(DATABASE=path, PAYMENT_GATEWAY='fake',
+                            SQLITE_PRAGMAS=dict(db_pool.DEFAULT_PRAGMAS, mmap_size=0))
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['role'] = 'farmer'
+    with open(csv_path, 'rb') as f:
+        start = time.perf_counter()
+        response = client.post('/farmer/import_products', input_stream=f, content_type='text/csv',
+                               content_length=os.path.getsize(csv_path))
+        elapsed = time.perf_counter() - start
+    result = response.get_json()
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed, result['inserted'], result['rejected'])
+
+
+def product_import(sizes, form_posts=2000):
+    """Bulk import time and peak RSS at each row count, each in a fresh
+    interpreter, then the add_product form rate for comparison."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            path, csv_path = os.path.join(tmp, f'import{rows}.db'), os.path.join(tmp, f'import{rows}.csv')
+            make_database(path)
+            conn = db_pool.connect(path)
+            migrate_db.migrate(conn)
+            conn.close()
+            write_product_csv(csv_path, rows)
+            out = subprocess.run([sys.executable, '-c', f'import benchmark; benchmark.import_peak_rss({path!r}, {csv_path!r})'],
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+            peak_kb, elapsed, inserted, rejected = out.stdout.split()
+            elapsed = float(elapsed)
+            print(f'{rows:>9} rows  {os.path.getsize(csv_path) / 2 ** 20:6.1f} MB CSV  {elapsed:6.2f} s  '
+                  f'{int(inserted) / elapsed:8.0f} rows/s  inserted {inserted}  rejected {rejected}  '
+                  f'peak RSS {int(peak_kb) / 1024:6.1f} MB')
+
+        path = os.path.join(tmp, 'form.db')
+        make_database(path)
+        flask_app = chawal_app.app
+        flask_app.config['DATABASE'] = path
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['role'] = 'farmer'
+        start = time.perf_counter()
+        for i in range(form_posts):
+            client.post('/farmer/add_product', data={'p_name': f'Form rice {i}', 'p_type': 'Basmati', 'p_quantity': '100',
+                                                     'p_priceperunit': '80', 'p_batch': 'F1'})
+        elapsed = time.perf_counter() - start
+        print(f'{"add_product":>9} form, one post per row: {form_posts / elapsed:8.0f} rows/s')
+        flask_app.extensions.pop('db_pool').close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--checkout-stress', action='store_true')
+    parser.add_argument('--page-weight', action='store_true')
+    parser.add_argument('--repeat-visit', action='store_true')
+    parser.add_argument('--conditional', action='store_true')
+    parser.add_argument('--sales-check', action='store_true')
+    parser.add_argument('--login-storm', action='store_true')
+    parser.add_argument('--cart-edit', action='store_true')
+    parser.add_argument('--metrics-overhead', action='store_true')
+    parser.add_argument('--serving', action='store_true')
+    parser.add_argument('--outbox', action='store_true')
+    parser.add_argument('--live-updates', type=int, nargs='?', const=5000, metavar='STREAMS')
+    parser.add_argument('--archive', type=int, nargs='?', const=1000000, metavar='ORDERS')
+    parser.add_argument('--product-import', type=int, nargs='*', metavar='ROWS')
+    parser.add_argument('--export-memory', type=int, nargs='*', metavar='ROWS')
+    parser.add_argument('--viewport', type=int, default=1280)
+    args = parser.parse_args()
+    # Only --outbox wants the app's outbox threads, and none the event hub
+    # (--live-updates runs it in serve.py); the other modes swap databases
+    # under them.
+    chawal_app.app.config['OUTBOX_WORKERS'] = 0
+    chawal_app.app.config['EVENTS'] = False
+
+    if args.export_memory is not None:
+        export_memory(sorted(args.export_memory or [10000, 100000, 1000000]))
+        return
+    if args.product_import is not None:
+        product_import(sorted(args.product_import or [1000, 100000, 500000]))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.checkout_stress:
+            path = os.path.join(tmp, 'stress.db')
+            make_database(path)
+            stress_checkout(path, args.threads, args.requests)
+            return
+        if args.page_weight:
+            if not images.enabled():
+                raise SystemExit('Pillow is not installed; only the original images would be served.')
+            path = os.path.join(tmp, 'pages.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            page_weight(args.viewport)
+            chawal_app.app.extensions.pop('db_pool').close_all()
+            return
+        if args.sales_check:
+            path = os.path.join(tmp, 'sales.db')
+            make_database(path)
+            sales_check(path, args.threads, args.requests)
+            return
+        if args.login_storm:
+            path = os.path.join(tmp, 'logins.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            login_storm(args.threads)
+            chawal_app.app.extensions.pop('db_pool').close_all()
+            return
+        if args.cart_edit:
+            path = os.path.join(tmp, 'cart.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            cart_edit()
+            chawal_app.app.extensions.pop('db_pool').close_all()
+            return
+        if args.serving:
+            path = os.path.join(tmp, 'serving.db')
+            make_database(path)
+            serving(path, args.threads, args.requests)
+            return
+        if args.archive:
+            archive_latency(os.path.join(tmp, 'history.db'), args.archive)
+            return
+        if args.conditional:
+            conditional_views(os.path.join(tmp, 'views.db'))
+            return
+        if args.live_updates:
+            path = os.path.join(tmp, 'live.db')
+            make_database(path)
+            live_updates(path, args.live_updates)
+            return
+        if args.outbox:
+            path = os.path.join(tmp, 'outbox.db')
+            make_database(path)
+            outbox_throughput(path, args.requests * 5)
+            return
+        if args.metrics_overhead:
+            path = os.path.join(tmp, 'metrics.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            metrics_overhead()
+            chawal_app.app.extensions.pop('db_pool').close_all()
+            return
+        if args.repeat_visit:
+            path = os.path.join(tmp, 'visits.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            repeat_visit(args.viewport)
+            chawal_app.app.extensions.pop('db_pool').close_all()
+            return
+        for mode in MODES:
+            path = os.path.join(tmp, f'{mode}.db')
+            make_database(path)
+            chawal_app.app.config['DATABASE'] = path
+            for route, (rps, errors) in run(mode, args.threads, args.requests).items():
+                print(f'{mode:22} {route:22} {rps:8.1f} req/s  errors={errors}')
+        chawal_app.app.extensions.pop('db_pool').close_all()
+
+
+if __name__ == '__main__':
+    main()
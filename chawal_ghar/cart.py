@@ -0,0 +1,116 @@
+"""Batched cart changes for the JSON cart API.
+
+apply() takes a list of operations ({'op': 'add' | 'set' | 'remove', 'p_id',
+'quantity'}), checks the resulting quantities against stock with one query
+and writes them with a single UPSERT/DELETE pair inside one BEGIN IMMEDIATE
+transaction. Either every operation is applied or none is.
+"""
+MAX_OPERATIONS = 100
+OPERATIONS = ('add', 'set', 'remove')
+
+
+class CartError(Exception):
+    """The batch would leave the cart invalid. problems lists one dict per
+    offending product: {'p_id', 'error', 'available'}."""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(p['error'] for p in problems))
+        self.problems = problems
+
+
+def parse_operations(payload):
+    """Validated [(op, p_id, quantity)] from a request body. Raises ValueError
+    if it is malformed."""
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('Expected {"operations": [...]} with at least one operation.')
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f'At most {MAX_OPERATIONS} operations per request.')
+    parsed = []
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise ValueError(f'Operation {i}: op must be one of {", ".join(OPERATIONS)}.')
+        p_id = operation.get('p_id')
+        quantity = operation.get('quantity', 0 if operation['op'] == 'remove' else None)
+        if not isinstance(p_id, int) or isinstance(p_id, bool):
+            raise ValueError(f'Operation {i}: p_id must be an integer.')
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0 \
+                or (operation['op'] == 'add' and quantity == 0):
+            raise ValueError(f'Operation {i}: quantity must be a positive integer.')
+        parsed.append((operation['op'], p_id, quantity))
+    return parsed
+
+
+def load(db, c_id):
+    """The customer's cart as {'items': [...], 'total', 'count'}."""
+    rows = db.execute('''
+        SELECT cart.cart_id, cart.p_id, cart.quantity, products.p_name, products.p_priceperunit,
+               products.p_quantity AS max_quantity
+        FROM cart
+        JOIN products ON cart.p_id = products.p_id
+        WHERE cart.c_id = ?
+        ORDER BY cart.cart_id
+    ''', (c_id,)).fetchall()
+    items = [dict(row, line_total=round(row['quantity'] * row['p_priceperunit'], 2)) for row in rows]
+    return {'items': items, 'total': round(sum(item['line_total'] for item in items), 2),
+            'count': len(items)}
+
+
+def apply(db, c_id, operations):
+    """Apply parsed operations in order and return the new cart (see load()).
+    Raises CartError, leaving the cart unchanged, if any product is unknown
+    or unavailable or would end up with more than its stock."""
+    p_ids = list(dict.fromkeys(p_id for _, p_id, _ in operations))
+    placeholders = ', '.join('?' * len(p_ids))
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        # Stock, status and what is already in the cart, for every product in
+        # the batch at once.
+        current = {row['p_id']: row for row in db.execute(f'''
+            SELECT products.p_id, products.p_name, products.p_quantity, products.p_status,
+                   COALESCE(cart.quantity, 0) AS in_cart
+            FROM products
+            LEFT JOIN cart ON cart.p_id = products.p_id AND cart.c_id = ?
+            WHERE products.p_id IN ({placeholders})
+        ''', [c_id] + p_ids)}
+
+        wanted = {p_id: row['in_cart'] for p_id, row in current.items()}
+        problems = []
+        for op, p_id, quantity in operations:
+            if p_id not in current:
+                problems.append({'p_id': p_id, 'error': f'Product {p_id} not found.', 'available': 0})
+                continue
+            if op == 'add':
+                wanted[p_id] += quantity
+            elif op == 'set':
+                wanted[p_id] = quantity
+            else:
+                wanted[p_id] = 0
+
+        for p_id, quantity in wanted.items():
+            row = current[p_id]
+            if quantity == row['in_cart'] or quantity == 0:
+                continue
+            available = row['p_quantity'] if row['p_status'] == 'Available' else 0
+            if quantity > available:
+                problems.append({'p_id': p_id, 'available': available,
+                                 'error': f'Only {available} kg of {row["p_name"]} available.'})
+        if problems:
+            db.rollback()
+            raise CartError(problems)
+
+        db.executemany('''
+            INSERT INTO cart (c_id, p_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT (c_id, p_id) DO UPDATE SET quantity = excluded.quantity
+        ''', [(c_id, p_id, quantity) for p_id, quantity in wanted.items()
+              if quantity and quantity != current[p_id]['in_cart']])
+        db.executemany('DELETE FROM cart WHERE c_id = ? AND p_id = ?',
+                       [(c_id, p_id) for p_id, quantity in wanted.items() if quantity == 0 and current[p_id]['in_cart']])
+        db.commit()
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    return load(db, c_id)
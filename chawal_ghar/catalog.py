@@ -0,0 +1,224 @@
+import base64
+import difflib
+import json
+import re
+
+import archive
+
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+MAX_SEARCH_TERMS = 8
+# Above this many matches bm25 scores are nearly flat and computing them for
+# every hit dominates query time, so broad searches return the newest matches.
+RANKED_SEARCH_LIMIT = 2000
+
+RICE_TYPES = ['Basmati', 'Kolam', 'Sona Masoori', 'Jasmine', 'Brown', 'Red', 'Black', 'Ponni']
+# Product card image for each type; other types get the Basmati one.
+RICE_IMAGES = {rice.lower(): rice.lower().replace(' ', '_') + '.png' for rice in RICE_TYPES}
+
+# sort name -> (column, direction). Every sort is tie-broken on p_id so the
+# (value, p_id) pair of the last row on a page is a stable keyset cursor; the
+# composite indexes in migrations/0004_catalog_indexes.sql and
+# 0016_catalog_farmer_indexes.sql match these orders.
+SORTS = {
+    'newest': ('p_id', 'DESC'),
+    'price': ('p_priceperunit', 'ASC'),
+    'price_desc': ('p_priceperunit', 'DESC'),
+    'quantity': ('p_quantity', 'DESC'),
+}
+
+PRODUCT_COLUMNS = '''products.p_id, products.f_id, products.p_name, products.p_type, products.p_quantity,
+    products.p_status, products.p_priceperunit, products.p_batch, farmers.f_firstname, farmers.f_lastname'''
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, types=(int, float)):
+    """Return the list of keyset values in a cursor, or None if it is missing,
+    malformed or holds values not of the given types."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or not all(isinstance(v, types) for v in values):
+        return None
+    return values
+
+
+def _number(value, cast):
+    try:
+        return cast(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def parse_filters(args):
+    """Catalog filters from a request's query string; unknown or invalid values are dropped."""
+    sort = args.get('sort', 'newest')
+    return {
+        'type': args.get('type') if args.get('type') in RICE_TYPES else None,
+        'min_price': _number(args.get('min_price'), float),
+        'max_price': _number(args.get('max_price'), float),
+        'farmer': _number(args.get('farmer'), int),
+        'sort': sort if sort in SORTS else 'newest',
+    }
+
+
+def page_size(args):
+    size = _number(args.get('limit'), int) or PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def product_query(filters, cursor=None, limit=PAGE_SIZE):
+    """The SQL and parameters of product_page()'s query; migrate_db.py --check
+    checks its plan for every combination of filters and sort."""
+    column, direction = SORTS[filters['sort']]
+    # A page is read in sort order from the index on the status, the farmer
+    # or else the type, and the sort column (migrations 0004 and 0016). The
+    # filters that index does not cover are checked on each row it yields;
+    # the unary + keeps SQLite from choosing an index for them instead and
+    # then sorting every match.
+    by_farmer = filters.get('farmer') is not None
+    type_index = '+' if by_farmer else ''
+    price_index = '' if column == 'p_priceperunit' else '+'
+    where = ["products.p_status = 'Available'"]
+    params = []
+    if filters.get('type'):
+        where.append(f'{type_index}products.p_type = ?')
+        params.append(filters['type'])
+    if filters.get('min_price') is not None:
+        where.append(f'{price_index}products.p_priceperunit >= ?')
+        params.append(filters['min_price'])
+    if filters.get('max_price') is not None:
+        where.append(f'{price_index}products.p_priceperunit <= ?')
+        params.append(filters['max_price'])
+    if by_farmer:
+        where.append('products.f_id = ?')
+        params.append(filters['farmer'])
+
+    after = decode_cursor(cursor)
+    op = '<' if direction == 'DESC' else '>'
+    if column == 'p_id' and after and len(after) == 1:
+        where.append(f'products.p_id {op} ?')
+        params.extend(after)
+    elif column != 'p_id' and after and len(after) == 2:
+        where.append(f'(products.{column}, products.p_id) {op} (?, ?)')
+        params.extend(after)
+
+    sql = f'''
+        SELECT {PRODUCT_COLUMNS}
+        FROM products JOIN farmers ON products.f_id = farmers.f_id
+        WHERE {' AND '.join(where)}
+        ORDER BY products.{column} {direction}, products.p_id {direction}
+        LIMIT ?
+    '''
+    return sql, params + [limit + 1]
+
+
+def product_page(db, filters, cursor=None, limit=PAGE_SIZE):
+    """One page of Available products plus the cursor for the next page (None on the last page)."""
+    column, _ = SORTS[filters['sort']]
+    rows = db.execute(*product_query(filters, cursor, limit)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([last['p_id']] if column == 'p_id' else [last[column], last['p_id']])
+    return rows, next_cursor
+
+
+def order_page(db, c_id, cursor=None, limit=PAGE_SIZE):
+    """One page of a customer's orders, newest first, plus the next-page cursor."""
+    where = 'orders.c_id = ?'
+    params = [c_id]
+    after = decode_cursor(cursor)
+    if after and len(after) == 1:
+        where += ' AND orders.o_id < ?'
+        params.extend(after)
+    rows = archive.newest_first(db, 'orders', f'''
+        SELECT orders.*, products.p_name
+        FROM {{table}} AS orders JOIN products ON orders.p_id = products.p_id
+        WHERE {where}
+        ORDER BY orders.o_id DESC
+        LIMIT ?
+    ''', params, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['o_id']])
+    return rows, next_cursor
+
+
+def search_terms(q):
+    return re.findall(r'\w+', (q or '').lower())[:MAX_SEARCH_TERMS]
+
+
+def _match_expression(alternatives):
+    # Every word must match, as a prefix ("basm" -> basmati), and each word
+    # may be any one of its alternatives.
+    groups = []
+    for words in alternatives:
+        options = [f'"{w}"*' for w in words]
+        groups.append(options[0] if len(options) == 1 else '(' + ' OR '.join(options) + ')')
+    return ' '.join(groups)
+
+
+def _corrections(db, term, limit=3):
+    """Indexed terms close to a misspelt one, or [term] if it already prefixes
+    an indexed term. Candidates come from a narrow vocabulary range (same first
+    two letters, then same first letter) since fts5vocab counts every term it
+    visits."""
+    if db.execute('SELECT 1 FROM product_search_vocab WHERE term >= ? AND term < ? LIMIT 1',
+                  (term, term + '\uffff')).fetchone():
+        return [term]
+    for prefix in dict.fromkeys([term[:2], term[:1]]):
+        candidates = [row[0] for row in db.execute(
+            'SELECT term FROM product_search_vocab WHERE term >= ? AND term < ?', (prefix, prefix + '\uffff'))]
+        matches = difflib.get_close_matches(term, candidates, n=limit, cutoff=0.7)
+        if matches:
+            return matches
+    return []
+
+
+def _ranked_search(db, alternatives, limit):
+    match = _match_expression(alternatives)
+    hits = db.execute('SELECT rowid FROM product_search WHERE product_search MATCH ? LIMIT ?',
+                      (match, RANKED_SEARCH_LIMIT + 1)).fetchall()
+    order = 'rank' if len(hits) <= RANKED_SEARCH_LIMIT else 'rowid DESC'
+    # product_search only holds Available listings (see migrations/0005_product_search.sql),
+    # and its rank is bm25 weighted towards the product name.
+    return db.execute(f'''
+        WITH hits AS (
+            SELECT rowid, rank FROM product_search WHERE product_search MATCH ?
+            ORDER BY {order} LIMIT ?
+        )
+        SELECT {PRODUCT_COLUMNS}
+        FROM hits
+        JOIN products ON products.p_id = hits.rowid
+        JOIN farmers ON products.f_id = farmers.f_id
+        ORDER BY {'hits.rank' if order == 'rank' else 'products.p_id DESC'}
+    ''', (match, limit)).fetchall()
+
+
+def search_products(db, q, limit=PAGE_SIZE):
+    """Ranked Available products matching q, and the corrected query when the
+    results only came from typo correction (else None)."""
+    terms = search_terms(q)
+    if not terms:
+        return [], None
+    rows = _ranked_search(db, [[t] for t in terms], limit)
+    if rows:
+        return rows, None
+
+    alternatives = [_corrections(db, t) for t in terms]
+    if not all(alternatives) or alternatives == [[t] for t in terms]:
+        return [], None
+    rows = _ranked_search(db, alternatives, limit)
+    corrected = ' '.join(words[0] for words in alternatives) if rows else None
+    return rows, corrected
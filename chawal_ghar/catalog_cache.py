@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CatalogCache:
+    """Bounded LRU cache of catalog pages with a TTL.
+
+    Entries are keyed by (filters, cursor, limit). Write paths call
+    invalidate() after committing, naming the rice type and farmer they
+    touched, and only pages whose filters could contain such a product are
+    dropped.
+
+    With shared=True, invalidations are also published through the
+    cache_versions table: every worker compares that counter on each lookup
+    and drops its whole cache when another process has written.
+    """
+
+    def __init__(self, max_entries=512, ttl=30.0, shared=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._seen_version = None
+        # Bumped on every invalidation so a page loaded concurrently with a
+        # write is not cached after that write has dropped it.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(filters, cursor, limit):
+        return (tuple(sorted(filters.items())), cursor or None, limit)
+
+    def get_or_load(self, db, key, loader):
+        if self.shared:
+            self._sync_version(db)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, db=None, p_type=None, f_id=None):
+        """Drop pages that may show a product of p_type sold by f_id (None
+        matches anything). Call after the write has been committed."""
+        self.invalidate_products(db, [(p_type, f_id)])
+
+    def invalidate_products(self, db, products):
+        """invalidate() for several (p_type, f_id) pairs, publishing once."""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if any(self._affected(dict(key[0]), p_type, f_id) for p_type, f_id in products)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self._generation += 1
+        if self.shared and db is not None:
+            self._publish(db)
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'shared': self.shared, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'invalidations': self.invalidations}
+
+    @staticmethod
+    def _affected(filters, p_type, f_id):
+        if p_type is not None and filters.get('type') not in (None, p_type):
+            return False
+        if f_id is not None and filters.get('farmer') not in (None, f_id):
+            return False
+        return True
+
+    def _sync_version(self, db):
+        version = db.execute("SELECT version FROM cache_versions WHERE name = 'catalog'").fetchone()[0]
+        with self._lock:
+            if self._seen_version is not None and version != self._seen_version:
+                self._clear_locked()
+            self._seen_version = version
+
+    def _publish(self, db):
+        version = db.execute("UPDATE cache_versions SET version = version + 1 WHERE name = 'catalog' "
+                             "RETURNING version").fetchall()[0][0]
+        db.commit()
+        with self._lock:
+            if self._seen_version is not None and version != self._seen_version + 1:
+                # Another worker also wrote since we last looked.
+                self._clear_locked()
+            self._seen_version = version
+
+    def _clear_locked(self):
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._generation += 1
@@ -0,0 +1,94 @@
+PAYMENT_METHOD = 'Online (Razorpay)'
+
+
+class InsufficientStock(Exception):
+    def __init__(self, p_id, p_name, available):
+        super().__init__(f'Only {available} kg of {p_name} available.')
+        self.p_id = p_id
+        self.p_name = p_name
+        self.available = available
+
+
+def checkout_cart(db, c_id, destination, payment_id=None, before_commit=None):
+    """Turn the customer's whole cart into orders and clear it. Returns the new
+    order ids (or the existing ones if payment_id was already processed)."""
+    return _place_orders(db, c_id, None, destination, payment_id, before_commit)
+
+
+def buy_now(db, c_id, p_id, quantity, destination, payment_id=None, before_commit=None):
+    """Place a single order for quantity kg of p_id, outside the cart."""
+    return _place_orders(db, c_id, {p_id: quantity}, destination, payment_id, before_commit)
+
+
+def _place_orders(db, c_id, quantities, destination, payment_id, before_commit):
+    # BEGIN IMMEDIATE takes the write lock up front, so prices, stock and the
+    # idempotency check below all see the same state and no other checkout can
+    # interleave with this one.
+    if db.in_transaction:
+        db.commit()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        if payment_id:
+            # all_payments: the payment may have been archived since.
+            done = db.execute('SELECT o_id FROM all_payments WHERE gateway_payment_id = ? ORDER BY o_id',
+                              (payment_id,)).fetchall()
+            if done:
+                db.rollback()
+                return [row[0] for row in done]
+
+        if quantities is None:
+            quantities = {row['p_id']: row['quantity'] for row in
+                          db.execute('SELECT p_id, quantity FROM cart WHERE c_id = ?', (c_id,))}
+        if not quantities:
+            db.rollback()
+            return []
+
+        # Conditional decrements: a row only changes if it still has enough
+        # stock, so two buyers can never oversell the same batch.
+        cursor = db.executemany('''
+            UPDATE products
+            SET p_quantity = p_quantity - :qty,
+                p_status = CASE WHEN p_quantity - :qty <= 0 THEN 'Sold Out' ELSE p_status END
+            WHERE p_id = :p_id AND p_status = 'Available' AND p_quantity >= :qty
+        ''', [{'p_id': p_id, 'qty': qty} for p_id, qty in quantities.items()])
+        if cursor.rowcount != len(quantities):
+            db.rollback()
+            raise _first_short_item(db, quantities)
+
+        placeholders = ', '.join('?' * len(quantities))
+        prices = dict(db.execute(f'SELECT p_id, p_priceperunit FROM products WHERE p_id IN ({placeholders})',
+                                 list(quantities)).fetchall())
+        last_o_id = db.execute('SELECT COALESCE(MAX(o_id), 0) FROM orders').fetchone()[0]
+        db.executemany('INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount, o_quantity) VALUES (?, ?, ?, ?, ?, ?)',
+                       [(c_id, p_id, 'Confirmed', destination, qty * prices[p_id], qty) for p_id, qty in quantities.items()])
+        # We hold the write lock, so every order above last_o_id is one of ours.
+        db.execute('''
+            INSERT INTO payments (o_id, c_id, p_amount, p_method, p_status, gateway_payment_id)
+            SELECT o_id, c_id, o_amount, ?, 'Completed', ? FROM orders WHERE o_id > ? AND c_id = ?
+        ''', (PAYMENT_METHOD, payment_id, last_o_id, c_id))
+        db.execute(f'DELETE FROM cart WHERE c_id = ? AND p_id IN ({placeholders})', [c_id] + list(quantities))
+        o_ids = [row[0] for row in db.execute('SELECT o_id FROM orders WHERE o_id > ? ORDER BY o_id', (last_o_id,))]
+        # Anything the caller writes here (outbox jobs for the new orders)
+        # commits or rolls back with them.
+        if before_commit is not None:
+            before_commit(o_ids)
+        db.commit()
+        return o_ids
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        raise
+
+
+def _first_short_item(db, quantities):
+    placeholders = ', '.join('?' * len(quantities))
+    rows = db.execute(f'SELECT p_id, p_name, p_quantity, p_status FROM products WHERE p_id IN ({placeholders})',
+                      list(quantities)).fetchall()
+    found = {row['p_id']: row for row in rows}
+    for p_id, qty in quantities.items():
+        row = found.get(p_id)
+        if row is None:
+            return InsufficientStock(p_id, f'product #{p_id}', 0)
+        if row['p_status'] != 'Available' or row['p_quantity'] < qty:
+            return InsufficientStock(p_id, row['p_name'], row['p_quantity'] if row['p_status'] == 'Available' else 0)
+    return InsufficientStock(None, 'an item', 0)
@@ -0,0 +1,128 @@
+"""Password hashing and verification off the request thread.
+
+Every KDF call runs on a small worker pool, so a burst of logins uses at
+most `workers` CPUs instead of one per request thread. Work beyond
+max_pending is refused with Overloaded rather than queued indefinitely.
+Unknown users are checked against a dummy hash so a miss costs the same as
+a wrong password, and hashes made with older KDF parameters are replaced on
+the next successful login.
+"""
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+LATENCY_SAMPLES = 1024
+
+
+class Overloaded(Exception):
+    """Too many hashing requests are already pending; retry later."""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Credential service is busy.')
+        self.retry_after = retry_after
+
+
+class CredentialService:
+    """Bounded pool for password KDF calls. With workers=0 hashing runs
+    inline on the calling thread (the old behaviour), still counted in stats()."""
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=16, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='credentials') if workers else None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._dummy_hash = None
+        self.counts = {'verified': 0, 'rejected': 0, 'unknown_user': 0, 'hashed': 0, 'rehashed': 0,
+                       'shed': 0, 'timed_out': 0}
+        self.max_pending_seen = 0
+
+    def hash(self, password):
+        """A new hash of password with the configured method."""
+        result = self._run(generate_password_hash, password, method=self.method)
+        self._count('hashed')
+        return result
+
+    def verify(self, stored_hash, password):
+        """(ok, new_hash). stored_hash is None for an unknown user, which is
+        checked against a dummy hash so it takes as long as a real one.
+        new_hash is set when the password was right but stored_hash used
+        other KDF parameters; the caller should save it."""
+        ok, new_hash = self._run(self._verify, stored_hash, password)
+        if stored_hash is None:
+            self._count('unknown_user')
+        self._count('verified' if ok else 'rejected')
+        if new_hash:
+            self._count('rehashed')
+        return ok, new_hash
+
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split('$', 1)[0] != self.method
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            pending = self._pending
+            counts = dict(self.counts)
+        percentiles = {f'p{p}': round(latencies[min(len(latencies) - 1, len(latencies) * p // 100)] * 1000, 1)
+                       for p in (50, 95, 99)} if latencies else {}
+        return {'method': self.method, 'workers': self.workers, 'max_pending': self.max_pending,
+                'pending': pending, 'max_pending_seen': self.max_pending_seen,
+                'latency_ms': percentiles, **counts}
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _verify(self, stored_hash, password):
+        if stored_hash is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = generate_password_hash(secrets.token_hex(16), method=self.method)
+            check_password_hash(self._dummy_hash, password)
+            return False, None
+        if not check_password_hash(stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, generate_password_hash(password, method=self.method)
+        return True, None
+
+    def _run(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.counts['shed'] += 1
+                raise Overloaded()
+            self._pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        start = time.perf_counter()
+        if self._executor is None:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._done(start)
+        # A call that times out still holds its slot until the worker is
+        # done with it, so abandoned work counts against max_pending too.
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._done(start))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self._count('timed_out')
+            raise Overloaded()
+
+    def _done(self, start):
+        with self._lock:
+            self._pending -= 1
+            self._latencies.append(time.perf_counter() - start)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
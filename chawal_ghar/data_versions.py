@@ -0,0 +1,42 @@
+"""Per-table version counters for conditional GET.
+
+Triggers (migrations/0014_data_versions.sql) bump a counter in data_versions
+on every write to the tables the dashboards are built from: one for the
+whole table (scope '') and, for orders, products, cart and notifications,
+one for the customer ('c<c_id>') or farmer ('f<f_id>') the row belongs to.
+A page's ETag is a hash of the counters it reads from plus whatever else
+goes into it (user, URL), so a route can answer If-None-Match with 304 after
+one primary key lookup, before running its own queries or rendering.
+
+Read the versions before the page's data: a write landing in between then
+gives the page a newer ETag on the next request instead of a stale 304.
+"""
+import hashlib
+
+
+def customer(c_id):
+    return f'c{c_id}'
+
+
+def farmer(f_id):
+    return f'f{f_id}'
+
+
+def read(db, keys):
+    """The version of each (table, scope) in keys, 0 for ones never written."""
+    if not keys:
+        return []
+    # OR of equalities rather than a row-value IN, which SQLite answers by
+    # scanning the table.
+    rows = db.execute('SELECT name, scope, version FROM data_versions WHERE ' +
+                      ' OR '.join(['(name = ? AND scope = ?)'] * len(keys)),
+                      [value for key in keys for value in key]).fetchall()
+    found = {(name, scope): version for name, scope, version in rows}
+    return [found.get(tuple(key), 0) for key in keys]
+
+
+def etag(db, keys, *parts):
+    """ETag (unquoted) for a response built from the (table, scope) keys and
+    parts, which must include anything else the response varies on."""
+    state = repr((list(keys), read(db, keys), parts)).encode()
+    return hashlib.blake2b(state, digest_size=12).hexdigest()
@@ -1,10 +1,12 @@
 import sqlite3
+import migrate_db
 
 def init_db():
     conn = sqlite3.connect('database.db')
     with open('schema.sql', 'r') as f:
         conn.executescript(f.read())
     conn.commit()
+    migrate_db.migrate(conn)
     conn.close()
     print("Database initialized successfully.")
 
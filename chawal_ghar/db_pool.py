@@ -0,0 +1,160 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Pragmas applied to every pooled connection. journal_mode=WAL lets readers
+# keep going while a checkout holds the write lock, and busy_timeout makes
+# writers wait instead of failing straight away with "database is locked".
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,      # negative = KiB, so ~16 MB page cache
+    'mmap_size': 134217728,    # 128 MB
+    'foreign_keys': 'ON',
+    'temp_store': 'MEMORY',
+}
+
+
+# How often a pooled connection refreshes the planner's statistics (see
+# optimize); pooled connections are rarely closed, so they do it on release.
+OPTIMIZE_EVERY = 3600
+
+
+def optimize(conn):
+    """Let SQLite re-ANALYZE the tables whose statistics no longer fit them
+    (a table that grew or shrank a lot since it was last analyzed), sampling
+    rows so it stays cheap. Meant for when a connection closes."""
+    try:
+        conn.execute('PRAGMA analysis_limit = 1000')
+        conn.execute('PRAGMA optimize')
+    except sqlite3.Error:
+        pass
+
+
+def connect(database, pragmas=None, factory=sqlite3.Connection):
+    conn = sqlite3.connect(database, check_same_thread=False, factory=factory)
+    conn.row_factory = sqlite3.Row
+    for name, value in (DEFAULT_PRAGMAS if pragmas is None else pragmas).items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections shared by the request threads
+    of one worker process.
+
+    A pool created before a fork is never reused by the child: connections are
+    tied to the pid that opened them and are discarded on a mismatch.
+    """
+
+    def __init__(self, database, max_size=8, timeout=10.0, pragmas=None, factory=sqlite3.Connection,
+                 optimize_every=OPTIMIZE_EVERY):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.factory = factory
+        self.optimize_every = optimize_every
+        self._optimized_at = time.monotonic()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _reset_after_fork(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue()
+                self._slots = threading.BoundedSemaphore(self.max_size)
+                self._pid = os.getpid()
+                self.opened = 0
+
+    def _healthy(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('Timed out waiting for a database connection.')
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self._healthy(conn):
+                    return conn
+                self._discard(conn)
+            conn = connect(self.database, self.pragmas, self.factory)
+            with self._lock:
+                self.opened += 1
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if self._pid != os.getpid():
+            # Checked out by the parent before a fork; never hand it back.
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            broken = True
+        if broken:
+            self._discard(conn)
+        else:
+            if time.monotonic() - self._optimized_at > self.optimize_every:
+                self._optimized_at = time.monotonic()
+                optimize(conn)
+            self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        optimize(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self.opened -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class NullPool:
+    """Opens a fresh connection per request; the pre-pool behaviour, kept
+    around for comparison benchmarks and debugging."""
+
+    def __init__(self, database, pragmas=None, factory=sqlite3.Connection):
+        self.database = database
+        self.pragmas = pragmas
+        self.factory = factory
+
+    def acquire(self):
+        return connect(self.database, self.pragmas, self.factory)
+
+    def release(self, conn, broken=False):
+        optimize(conn)
+        conn.close()
+
+    def close_all(self):
+        pass
@@ -0,0 +1,404 @@
+"""Live updates for open pages, sent as Server-Sent Events.
+
+Writers add events with publish() inside the transaction that makes the
+change, as with outbox.enqueue(), so an event is sent if and only if its
+change commits. Each worker process runs one EventHub thread. The hub reads
+new rows from the events table every poll_interval, or at once after
+wake(), which publishers in the same process call after committing. It sends
+each row to the streams subscribed to its channel:
+- 'products' carries stock changes for customers;
+- 'c<c_id>' and 'f<f_id>' carry one customer's or farmer's orders (and a
+  farmer's stock);
+- 'admin' carries every order.
+
+serve.py hands each stream's socket over to the hub after sending the
+response headers. The hub's thread writes to all of them through one
+selector, so an idle stream costs a few KB and no thread. Under other
+servers, stream() keeps a request thread per stream instead.
+
+Rows older than `retain` seconds are deleted. A browser that reconnects
+with Last-Event-ID within that window gets the events it missed.
+"""
+import json
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+
+import data_versions
+
+log = logging.getLogger('events')
+
+PATH = '/events'
+RETRY_MS = 3000
+HEARTBEAT = b': \n\n'
+# Order rows as the customer, farmer and admin dashboards show them.
+ORDER_ROWS = '''
+    SELECT orders.*, products.p_name, products.f_id, customers.c_firstname, customers.c_lastname,
+           customers.c_firstname || ' ' || customers.c_lastname AS customer,
+           farmers.f_firstname || ' ' || farmers.f_lastname AS farmer
+    FROM orders
+    JOIN products ON orders.p_id = products.p_id
+    JOIN customers ON orders.c_id = customers.c_id
+    JOIN farmers ON products.f_id = farmers.f_id
+'''
+
+
+def publish(db, channel, kind, data):
+    """Add an event for the current transaction. Does not commit."""
+    db.execute('INSERT INTO events (channel, kind, data, created) VALUES (?, ?, ?, ?)',
+               (channel, kind, json.dumps(data, separators=(',', ':')), time.time()))
+
+
+def publish_checkout(db, o_ids, render):
+    """Events for orders just placed, before their transaction commits: each
+    order to its customer, its farmer and the admins, with its table row
+    rendered by render(page, order) for page 'customer', 'farmer' or
+    'admin'; then the new stock of the ordered products."""
+    if not o_ids:
+        return
+    placeholders = ', '.join('?' * len(o_ids))
+    for order in db.execute(f'{ORDER_ROWS} WHERE orders.o_id IN ({placeholders})', o_ids).fetchall():
+        fields = {'o_id': order['o_id'], 'o_status': order['o_status']}
+        for page, channel in (('customer', data_versions.customer(order['c_id'])),
+                              ('farmer', data_versions.farmer(order['f_id'])), ('admin', 'admin')):
+            publish(db, channel, 'order', dict(fields, html=render(page, order)))
+    for product in db.execute(f'''
+        SELECT p_id, f_id, p_quantity, p_status FROM products
+        WHERE p_id IN (SELECT p_id FROM orders WHERE o_id IN ({placeholders}))
+    ''', o_ids).fetchall():
+        publish_stock(db, product)
+
+
+def publish_stock(db, product):
+    """A product's new quantity and status (from its p_id, f_id, p_quantity
+    and p_status), to customers and to its farmer."""
+    stock = {'p_id': product['p_id'], 'p_quantity': product['p_quantity'], 'p_status': product['p_status']}
+    publish(db, 'products', 'stock', stock)
+    publish(db, data_versions.farmer(product['f_id']), 'stock', stock)
+
+
+def message(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {data}\n\n'.encode()
+
+
+def _event_id(last_event_id):
+    try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        return None
+
+
+# Queued in place of a Last-Event-ID to end a stream() subscription.
+_REMOVE = object()
+
+
+class _Stream:
+    """A subscriber writing to a non-blocking socket, with whatever the
+    socket would not take yet kept in buffer."""
+
+    __slots__ = ('sock', 'channels', 'buffer')
+
+    def __init__(self, sock, channels):
+        self.sock = sock
+        self.channels = channels
+        self.buffer = b''
+
+    def send(self, data):
+        """Queue data; False once the peer has gone. Called on the hub thread."""
+        if self.buffer:
+            self.buffer += data
+            return True
+        try:
+            sent = self.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            return False
+        self.buffer = data[sent:]
+        return True
+
+    def unsent(self):
+        return len(self.buffer)
+
+
+class _QueueStream:
+    """A subscriber read by a request thread (see EventHub.stream). queued
+    and taken count the bytes put on the queue by the hub thread and taken
+    off it by the request thread; each is only written by its own thread."""
+
+    __slots__ = ('queue', 'channels', 'buffer', 'queued', 'taken')
+
+    def __init__(self, channels):
+        self.queue = queue.SimpleQueue()
+        self.channels = channels
+        self.buffer = b''
+        self.queued = 0
+        self.taken = 0
+
+    def send(self, data):
+        self.queued += len(data)
+        self.queue.put(data)
+        return True
+
+    def unsent(self):
+        return self.queued - self.taken
+
+
+class EventHub:
+    """Fans events out to every open stream in this process from one thread.
+
+    attach() takes over a connected socket whose response headers have been
+    sent; stream() yields the same bytes to a WSGI server that needs a
+    generator. A stream whose unsent data passes max_buffer bytes is closed;
+    the browser reconnects and catches up from the events table.
+    """
+
+    def __init__(self, pool_getter, poll_interval=0.5, heartbeat=15.0, retain=300.0, max_buffer=256 * 1024):
+        self._pool_getter = pool_getter
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.retain = retain
+        self.max_buffer = max_buffer
+        self.opened = 0
+        self.closed = 0
+        self.delivered = 0
+        self._channels = {}
+        self._streams = set()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._position = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Read new events now rather than at the next poll."""
+        try:
+            self._wake_w.send(b'x')
+        except BlockingIOError:
+            pass
+
+    def attach(self, sock, channels, last_event_id=None):
+        """Take over sock, on which the event stream's response headers have
+        been sent, and send it the events of channels from now on (or from
+        after last_event_id)."""
+        sock.setblocking(False)
+        self._add(_Stream(sock, frozenset(channels)), _event_id(last_event_id))
+
+    def stream(self, channels, last_event_id=None):
+        """Generator of the event stream's body for channels, for servers
+        that do not hand sockets over."""
+        subscriber = _QueueStream(frozenset(channels))
+        self._add(subscriber, _event_id(last_event_id))
+        try:
+            while True:
+                data = subscriber.queue.get()
+                if data is None:
+                    return
+                subscriber.taken += len(data)
+                yield data
+        finally:
+            self._add(subscriber, _REMOVE)
+
+    def shutdown(self, wait=True):
+        """Close every stream; browsers reconnect to another worker."""
+        self._stopping.set()
+        self.wake()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {'streams': len(self._streams), 'opened': self.opened, 'closed': self.closed,
+                    'delivered': self.delivered, 'last_event_id': self._position}
+
+    def _add(self, subscriber, after):
+        with self._lock:
+            self._pending.append((subscriber, after))
+        self.wake()
+
+    def _run(self):
+        next_poll = next_prune = time.monotonic()
+        next_heartbeat = next_poll + self.heartbeat
+        while not self._stopping.is_set():
+            timeout = max(0.0, min(next_poll, next_heartbeat) - time.monotonic())
+            woken = False
+            for key, mask in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    woken = True
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ:
+                    self._read(key.data)
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(key.data)
+            now = time.monotonic()
+            try:
+                if woken or now >= next_poll:
+                    next_poll = now + self.poll_interval
+                    self._poll()
+                if now >= next_prune:
+                    next_prune = now + 60
+                    self._prune()
+            except Exception:
+                log.exception('Event hub failed to read events')
+            if now >= next_heartbeat:
+                next_heartbeat = now + self.heartbeat
+                for subscriber in list(self._streams):
+                    self._send(subscriber, HEARTBEAT)
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for subscriber in list(self._streams) + [subscriber for subscriber, _ in pending]:
+            self._close(subscriber)
+        self._selector.close()
+
+    def _poll(self):
+        with self._lock:
+            if not self._pending and not self._streams:
+                # Nobody to send to: skip reading, and start from the newest
+                # event when someone subscribes.
+                self._position = None
+                return
+        pool = self._pool_getter()
+        db = pool.acquire()
+        try:
+            if self._position is None:
+                self._position = db.execute('SELECT COALESCE(MAX(event_id), 0) FROM events').fetchone()[0]
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for subscriber, after in pending:
+                if after is _REMOVE:
+                    self._close(subscriber)
+                    continue
+                try:
+                    self._subscribe(db, subscriber, after)
+                except Exception:
+                    log.exception('Event hub failed to start a stream')
+                    self._close(subscriber)
+            while True:
+                rows = db.execute('SELECT event_id, channel, kind, data FROM events WHERE event_id > ? '
+                                  'ORDER BY event_id LIMIT 500', (self._position,)).fetchall()
+                for event_id, channel, kind, data in rows:
+                    subscribers = self._channels.get(channel)
+                    if subscribers:
+                        data = message(event_id, kind, data)
+                        for subscriber in list(subscribers):
+                            self._send(subscriber, data)
+                        self.delivered += len(subscribers)
+                    self._position = event_id
+                if len(rows) < 500:
+                    break
+        finally:
+            pool.release(db)
+
+    def _subscribe(self, db, subscriber, after):
+        with self._lock:
+            self.opened += 1
+        self._send(subscriber, f'retry: {RETRY_MS}\n\n'.encode())
+        if after is not None and after < self._position:
+            channels = list(subscriber.channels)
+            for event_id, kind, data in db.execute(
+                    f'SELECT event_id, kind, data FROM events WHERE event_id > ? AND event_id <= ? '
+                    f'AND channel IN ({", ".join("?" * len(channels))}) ORDER BY event_id',
+                    [after, self._position] + channels):
+                self._send(subscriber, message(event_id, kind, data))
+        if subscriber.buffer is None:
+            return
+        if isinstance(subscriber, _Stream):
+            self._selector.register(subscriber.sock, self._events(subscriber), subscriber)
+        with self._lock:
+            self._streams.add(subscriber)
+        for channel in subscriber.channels:
+            self._channels.setdefault(channel, set()).add(subscriber)
+
+    def _prune(self):
+        pool = self._pool_getter()
+        db = pool.acquire()
+        try:
+            # Ids follow time, so this reads only the rows it deletes and the
+            # first one it keeps.
+            db.execute('''
+                DELETE FROM events WHERE event_id < COALESCE(
+                    (SELECT event_id FROM events WHERE created >= ? ORDER BY event_id LIMIT 1),
+                    (SELECT MAX(event_id) + 1 FROM events))
+            ''', (time.time() - self.retain,))
+            db.commit()
+        finally:
+            pool.release(db)
+
+    def _send(self, subscriber, data):
+        if subscriber.buffer is None:
+            return
+        if not subscriber.send(data) or subscriber.unsent() > self.max_buffer:
+            self._close(subscriber)
+        elif subscriber.buffer:
+            self._modify(subscriber)
+
+    def _flush(self, subscriber):
+        if subscriber.buffer is None:
+            return
+        data, subscriber.buffer = subscriber.buffer, b''
+        if subscriber.send(data):
+            self._modify(subscriber)
+        else:
+            self._close(subscriber)
+
+    def _read(self, subscriber):
+        # Browsers send nothing after the request, so a readable socket has
+        # been closed or reset.
+        try:
+            if subscriber.sock.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self._close(subscriber)
+
+    @staticmethod
+    def _events(subscriber):
+        return selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber.buffer else 0)
+
+    def _modify(self, subscriber):
+        try:
+            self._selector.modify(subscriber.sock, self._events(subscriber), subscriber)
+        except KeyError:
+            # Not registered yet; _subscribe registers it with these events.
+            pass
+
+    def _close(self, subscriber):
+        if subscriber.buffer is None:
+            return
+        subscriber.buffer = None
+        with self._lock:
+            self._streams.discard(subscriber)
+            self.closed += 1
+        for channel in subscriber.channels:
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[channel]
+        if isinstance(subscriber, _Stream):
+            try:
+                self._selector.unregister(subscriber.sock)
+            except (KeyError, ValueError):
+                pass
+            subscriber.sock.close()
+        else:
+            subscriber.queue.put(None)
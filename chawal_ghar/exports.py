@@ -0,0 +1,181 @@
+"""Streaming CSV / NDJSON exports of orders, payments, customers and farmers.
+
+Rows are read in keyset chunks (WHERE id > last id ORDER BY id LIMIT n), so
+an export holds one chunk in memory at a time however many rows it covers,
+and no single statement keeps a read snapshot open for the whole download
+(which would stop WAL checkpoints while it runs). Orders and payments
+include the archived ones (see archive.py) when the date range reaches back
+to them.
+"""
+import csv
+import io
+import json
+from datetime import date, timedelta
+
+import archive
+import catalog
+
+CHUNK_SIZE = 2000
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Spreadsheets evaluate a CSV cell starting with one of these as a formula
+# (a leading tab or carriage return is dropped and the rest read as one), so
+# text that users typed (names, addresses) is written with a leading '.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Per export: the SELECT (from {table}, which is the hot table or its
+# archive), its keyset column and the columns the date range and status
+# filters apply to (None where the table has no such column). Password
+# hashes are never exported.
+EXPORTS = {
+    'orders': {
+        'select': '''
+            SELECT orders.o_id, orders.o_date, orders.o_status, orders.c_id,
+                   customers.c_firstname || ' ' || customers.c_lastname AS customer,
+                   orders.p_id, products.p_name, products.p_type, products.f_id,
+                   farmers.f_firstname || ' ' || farmers.f_lastname AS farmer,
+                   orders.o_quantity, orders.o_amount, orders.o_destination
+            FROM {table} AS orders
+            JOIN products ON orders.p_id = products.p_id
+            JOIN customers ON orders.c_id = customers.c_id
+            JOIN farmers ON products.f_id = farmers.f_id
+        ''',
+        'table': 'orders', 'key': 'orders.o_id', 'date': 'orders.o_date', 'status': 'orders.o_status',
+    },
+    'payments': {
+        'select': '''
+            SELECT pay_id, p_date, p_status, o_id, c_id, p_amount, p_method, gateway_payment_id
+            FROM {table}
+        ''',
+        'table': 'payments', 'key': 'pay_id', 'date': 'p_date', 'status': 'p_status',
+    },
+    'customers': {
+        'select': '''
+            SELECT c_id, c_firstname, c_lastname, c_loginname, c_gender, c_contact, c_email, c_address
+            FROM {table}
+        ''',
+        'table': 'customers', 'key': 'c_id', 'date': None, 'status': None,
+    },
+    'farmers': {
+        'select': '''
+            SELECT f_id, f_firstname, f_lastname, f_loginname, f_gender, f_contact, f_email, f_address
+            FROM {table}
+        ''',
+        'table': 'farmers', 'key': 'f_id', 'date': None, 'status': None,
+    },
+}
+
+
+def parse_filters(name, args):
+    """Date range (from/to, inclusive YYYY-MM-DD) and status filters from a
+    query string. Raises ValueError for malformed dates or filters the
+    export does not support."""
+    spec = EXPORTS[name]
+    filters = {}
+    for arg in ('from', 'to'):
+        if args.get(arg):
+            if spec['date'] is None:
+                raise ValueError(f'{name} cannot be filtered by date.')
+            filters[arg] = date.fromisoformat(args[arg]).isoformat()
+    if args.get('status'):
+        if spec['status'] is None:
+            raise ValueError(f'{name} cannot be filtered by status.')
+        filters['status'] = args['status']
+    return filters
+
+
+def _where(spec, filters):
+    clauses, params = [], []
+    if 'from' in filters:
+        clauses.append(f"{spec['date']} >= ?")
+        params.append(filters['from'])
+    if 'to' in filters:
+        clauses.append(f"{spec['date']} < ?")
+        params.append((date.fromisoformat(filters['to']) + timedelta(days=1)).isoformat())
+    if 'status' in filters:
+        clauses.append(f"{spec['status']} = ?")
+        params.append(filters['status'])
+    return clauses, params
+
+
+def _query(name, filters, after=None, newest_first=False):
+    """(sql, params) of one chunk, still to be formatted with the table and
+    given the LIMIT."""
+    spec = EXPORTS[name]
+    clauses, params = _where(spec, filters)
+    if after is not None:
+        clauses.append(f"{spec['key']} {'<' if newest_first else '>'} ?")
+        params.append(after)
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    return f"{spec['select']} {where} ORDER BY {spec['key']} {'DESC' if newest_first else 'ASC'} LIMIT ?", params
+
+
+def _tables(db, name, filters):
+    """The tables an export reads, oldest rows first."""
+    table = EXPORTS[name]['table']
+    if table in archive.TABLES and archive.archive_needed(db, table, filters.get('from')):
+        return [archive.TABLES[table][0], table]
+    return [table]
+
+
+def iter_rows(db, name, filters, chunk_size=CHUNK_SIZE):
+    """Every matching row, oldest first, fetched chunk_size at a time."""
+    for table in _tables(db, name, filters):
+        after = None
+        while True:
+            sql, params = _query(name, filters, after)
+            rows = db.execute(sql.format(table=table), params + [chunk_size]).fetchall()
+            yield from rows
+            if len(rows) < chunk_size:
+                break
+            after = rows[-1][0]
+
+
+def page(db, name, filters, cursor=None, limit=catalog.PAGE_SIZE):
+    """One page of rows, newest first, plus the next-page cursor."""
+    after = catalog.decode_cursor(cursor)
+    sql, params = _query(name, filters, after[0] if after and len(after) == 1 else None, newest_first=True)
+    table = EXPORTS[name]['table']
+    if table in archive.TABLES:
+        rows = archive.newest_first(db, table, sql, params, limit + 1, since=filters.get('from'))
+    else:
+        rows = db.execute(sql.format(table=table), params + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = catalog.encode_cursor([rows[-1][0]])
+    return rows, next_cursor
+
+
+def columns(db, name):
+    spec = EXPORTS[name]
+    return [d[0] for d in db.execute(spec['select'].format(table=spec['table']) + ' LIMIT 0').description]
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def generate(db, name, fmt, filters, chunk_size=CHUNK_SIZE):
+    """The export as an iterator of text blocks, one per chunk of rows."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns(db, name))
+
+        def write(row):
+            writer.writerow([_csv_cell(value) for value in row])
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(row), separators=(',', ':')))
+            buffer.write('\n')
+
+    for count, row in enumerate(iter_rows(db, name, filters, chunk_size), 1):
+        write(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
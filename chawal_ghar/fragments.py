@@ -0,0 +1,63 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+def _freeze(value):
+    if isinstance(value, sqlite3.Row):
+        return tuple(zip(value.keys(), value))
+    if isinstance(value, dict):
+        return tuple(value.items())
+    return value
+
+
+class FragmentCache:
+    """Bounded LRU cache of rendered template fragments (product cards, order
+    rows).
+
+    A fragment is keyed on its template and the values it is rendered with;
+    a row stands for all of its columns, so any change to the row is a new
+    version with a new key. Entries are never invalidated; the ones for old
+    versions of a row fall off the end. Fragment templates see only their
+    values and the template globals (url_for, asset_url, ...), not the
+    request or session. max_entries=0 renders without caching.
+    """
+
+    def __init__(self, env, max_entries=4096):
+        self.env = env
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def render(self, name, **values):
+        if not self.max_entries:
+            return Markup(self.env.get_template(name).render(values))
+        key = (name, tuple((k, _freeze(v)) for k, v in sorted(values.items())))
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = Markup(self.env.get_template(name).render(values))
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
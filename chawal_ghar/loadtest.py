@@ -0,0 +1,475 @@
+"""Per-route throughput and latency for every route in app.py.
+
+Runs against a database built by seed.py (a fresh one at --scale unless
+--db is given) with the fake payment gateway. Each route gets --requests
+requests from --threads concurrent clients, one route at a time, and the
+report gives requests/sec and p50/p95/p99 latency per route. A response
+with a status the route does not normally return counts as an error, so a
+route that starts redirecting to the login page shows up.
+
+    python loadtest.py [--scale small] [--threads 8] [--requests 200] [--routes PATTERN ...]
+                       [--json results.json] [--compare baseline.json]
+
+By default requests go through the Flask test client in this process. With
+--url they are sent over HTTP to a running server instead, which must use
+the same database and the fake gateway:
+
+    python seed.py bench.db --scale medium
+    DATABASE=bench.db PAYMENT_GATEWAY=fake PAYMENT_FAKE_LATENCY=0 python app.py
+    python loadtest.py --db bench.db --url http://127.0.0.1:5000
+
+Routes that edit or delete users and products are given rows created for
+the run. Other write routes (orders, carts, registrations) add to the
+data, so compare runs made on freshly seeded databases.
+"""
+import argparse
+import collections
+import fnmatch
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import date, datetime, timedelta
+
+import app as chawal_app
+import db_pool
+import images
+import payment_orders
+import seed
+
+IMPORT_CSV = 'name,type,quantity,price,batch\n' + ''.join(
+    f'Load test {t},{t},100,75.50,LT-{i}\n' for i, t in enumerate(seed.BASE_PRICES))
+
+
+class TestClient:
+    """Requests through the Flask test client, in this process."""
+
+    def __init__(self, flask_app):
+        self._client = flask_app.test_client()
+
+    def request(self, method, path, data=None, payload=None, body=None, content_type=None):
+        """Send a request and return its status."""
+        response = self._client.open(path, method=method, data=body if body is not None else data,
+                                     json=payload, content_type=content_type)
+        # Reading the body runs streamed responses (exports) to the end.
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def fetch_json(self, method, path, payload):
+        """Send a JSON request and return the decoded reply."""
+        return self._client.open(path, method=method, json=payload).get_json()
+
+
+class HTTPClient:
+    """Requests over a keep-alive HTTP connection, with a cookie jar for the
+    session cookie."""
+
+    def __init__(self, base_url):
+        parts = urllib.parse.urlsplit(base_url)
+        connection = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._conn = connection(parts.hostname, parts.port, timeout=60)
+        self._prefix = parts.path.rstrip('/')
+        self._cookies = {}
+
+    def request(self, method, path, data=None, payload=None, body=None, content_type=None):
+        """Send a request and return its status."""
+        return self._send(method, path, data, payload, body, content_type)[0]
+
+    def fetch_json(self, method, path, payload):
+        """Send a JSON request and return the decoded reply."""
+        return json.loads(self._send(method, path, payload=payload)[1])
+
+    def _send(self, method, path, data=None, payload=None, body=None, content_type=None):
+        if payload is not None:
+            body, content_type = json.dumps(payload).encode(), 'application/json'
+        elif data is not None:
+            body, content_type = urllib.parse.urlencode(data).encode(), 'application/x-www-form-urlencoded'
+        headers = {'Content-Type': content_type} if content_type else {}
+        if self._cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self._cookies.items())
+        try:
+            self._conn.request(method, self._prefix + path, body=body, headers=headers)
+            response = self._conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # The server closed an idle keep-alive connection; retry once.
+            self._conn.close()
+            self._conn.request(method, self._prefix + path, body=body, headers=headers)
+            response = self._conn.getresponse()
+        content = response.read()
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = cookie.partition('=')
+            value = rest.split(';', 1)[0]
+            if value and '01 Jan 1970' not in cookie:
+                self._cookies[name] = value
+            else:
+                self._cookies.pop(name, None)
+        return response.status, content
+
+
+class Dataset:
+    """Ids and values the routes pick from, read from the seeded database,
+    plus throwaway rows for the routes that edit or delete."""
+
+    def __init__(self, path):
+        self.path = path
+        conn = db_pool.connect(path)
+        self.counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                       for table in ('farmers', 'customers', 'products', 'cart', 'orders', 'payments')}
+        self.prices = {row['p_id']: row['p_priceperunit'] for row in conn.execute(
+            "SELECT p_id, p_priceperunit FROM products WHERE p_status = 'Available' AND p_quantity >= 50")}
+        self.available = list(self.prices)
+        self.last_names = [row[0] for row in conn.execute('SELECT DISTINCT c_lastname FROM customers LIMIT 50')]
+        conn.close()
+        self.disposable = {}
+        self._token = f'{os.getpid()}_{int(time.time())}'
+        self._serial = itertools.count()
+
+    def make_disposable(self, kind, count):
+        """Create count rows of kind ('products' of farmer1, 'customers' or
+        'farmers' with nothing attached) and queue their ids."""
+        conn = db_pool.connect(self.path)
+        if kind == 'products':
+            rows = [(1, f'Load test disposable {i}', 'Basmati', 0, 'Withdrawn', 50.0, 'LT') for i in range(count)]
+            sql = 'INSERT INTO products (f_id, p_name, p_type, p_quantity, p_status, p_priceperunit, p_batch) VALUES (?, ?, ?, ?, ?, ?, ?)'
+        else:
+            p = kind[0]
+            rows = [('Load', f'Test{i}', f'lt_{kind}_{self._token}_{next(self._serial)}', '-') for i in range(count)]
+            sql = f'INSERT INTO {kind} ({p}_firstname, {p}_lastname, {p}_loginname, {p}_password) VALUES (?, ?, ?, ?)'
+        start = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {kind}').fetchone()[0]
+        conn.executemany(sql, rows)
+        ids = [row[0] for row in conn.execute(f'SELECT rowid FROM {kind} WHERE rowid > ? ORDER BY rowid', (start,))]
+        conn.commit()
+        conn.close()
+        queue = self.disposable.setdefault(kind, collections.deque())
+        queue.extend(ids)
+
+    def take(self, kind):
+        return self.disposable[kind].popleft()
+
+
+def _profile_form(first, last):
+    return {'firstname': first, 'lastname': last, 'email': 'loadtest@example.com', 'contact': '9000000000',
+            'address': 'Load test', 'gender': 'Other'}
+
+
+def _add_to_cart(client, d, w, p_id=None):
+    p_id = p_id or w['rng'].choice(d.available)
+    return client.fetch_json('POST', '/customer/cart/items',
+                             {'operations': [{'op': 'set', 'p_id': p_id, 'quantity': 1}]}), p_id
+
+
+def _prepare_remove(client, d, w):
+    cart, p_id = _add_to_cart(client, d, w)
+    w['cart_id'] = next(item['cart_id'] for item in cart['items'] if item['p_id'] == p_id)
+
+
+def _prepare_payment_status(client, d, w):
+    p_id = w['rng'].choice(d.available)
+    client.request('GET', f'/customer/buy/{p_id}')
+    amount = payment_orders.order_amount([{'p_id': p_id, 'quantity': 1, 'p_priceperunit': d.prices[p_id]}])
+    w['order_key'] = payment_orders.product_order_key(w['user'], p_id, 1, amount)
+
+
+def _prepare_buy(client, d, w):
+    # The payment must be for the gateway order of the quantity bought.
+    w['p_id'] = w['rng'].choice(d.available)
+    w['order_key'] = client.fetch_json('GET', f'/customer/buy/{w["p_id"]}/payment?quantity=1', None)['key']
+
+
+def _prepare_payment_success(client, d, w):
+    # Checking out creates the gateway order for the cart, which the payment
+    # must be for.
+    cart, _ = _add_to_cart(client, d, w)
+    client.request('GET', '/customer/checkout')
+    amount = payment_orders.order_amount(cart['items'])
+    w['order_key'] = payment_orders.cart_order_key(w['user'], cart['items'], amount)
+
+
+# Every route in app.py, some more than once with different arguments. path,
+# data, payload and prepare get the Dataset and the worker's state (its rng,
+# user number and anything prepare stored); prepare runs untimed before each
+# request. disposable names the rows a route uses up, one per request, and
+# share scales --requests down for routes that are slow by design.
+ROUTES = [
+    {'name': 'index', 'role': None, 'path': lambda d, w: '/'},
+    {'name': 'image_variant', 'role': None, 'expect': (200,) if images.enabled() else (404,),
+     'path': lambda d, w: f'/images/320/{"webp" if "webp" in images.formats() else "jpeg"}/rice_varieties/basmati.png'},
+    {'name': 'asset', 'role': None, 'path': lambda d, w: d.asset_path},
+    {'name': 'register (form)', 'role': None, 'path': lambda d, w: '/register'},
+    {'name': 'register', 'role': None, 'method': 'POST', 'expect': (302,), 'share': 0.25, 'path': lambda d, w: '/register',
+     'data': lambda d, w: dict(_profile_form('Load', 'Test'), role='customer', password='bench',
+                               loginname=f'lt_register_{d._token}_{w["id"]}_{next(w["counter"])}')},
+    {'name': 'login (form)', 'role': None, 'path': lambda d, w: '/login'},
+    {'name': 'login', 'role': None, 'method': 'POST', 'expect': (302,), 'share': 0.25, 'path': lambda d, w: '/login',
+     'data': lambda d, w: {'role': 'customer', 'loginname': f'customer{w["user"]}', 'password': seed.PASSWORD}},
+    {'name': 'logout', 'role': None, 'expect': (302,), 'path': lambda d, w: '/logout'},
+
+    {'name': 'farmer dashboard', 'role': 'farmer', 'path': lambda d, w: '/farmer/dashboard'},
+    {'name': 'add_product (form)', 'role': 'farmer', 'path': lambda d, w: '/farmer/add_product?rice_type=Basmati'},
+    {'name': 'add_product', 'role': 'farmer', 'method': 'POST', 'expect': (302,), 'path': lambda d, w: '/farmer/add_product',
+     'data': lambda d, w: {'p_name': 'Load test Kolam', 'p_type': 'Kolam', 'p_quantity': '100',
+                           'p_priceperunit': '55', 'p_batch': 'LT'}},
+    {'name': 'import_products (form)', 'role': 'farmer', 'path': lambda d, w: '/farmer/import_products'},
+    {'name': 'import_products', 'role': 'farmer', 'method': 'POST', 'path': lambda d, w: '/farmer/import_products',
+     'body': IMPORT_CSV.encode(), 'content_type': 'text/csv'},
+    {'name': 'delete_product', 'role': 'farmer', 'expect': (302,), 'disposable': 'products',
+     'path': lambda d, w: f'/farmer/delete_product/{d.take("products")}'},
+
+    {'name': 'customer dashboard', 'role': 'customer', 'path': lambda d, w: '/customer/dashboard'},
+    {'name': 'customer dashboard (filtered)', 'role': 'customer',
+     'path': lambda d, w: '/customer/dashboard?' + urllib.parse.urlencode({'type': w['rng'].choice(list(seed.BASE_PRICES)),
+                                                                           'sort': 'price'})},
+    {'name': 'catalog', 'role': 'customer',
+     'path': lambda d, w: '/customer/catalog?' + urllib.parse.urlencode({'type': w['rng'].choice(list(seed.BASE_PRICES)),
+                                                                         'sort': 'price_desc'})},
+    {'name': 'search', 'role': 'customer',
+     'path': lambda d, w: '/customer/search?' + urllib.parse.urlencode({'q': w['rng'].choice(seed.GRADES + list(seed.BASE_PRICES))})},
+    {'name': 'customer orders', 'role': 'customer', 'path': lambda d, w: '/customer/orders'},
+    {'name': 'buy_product (page)', 'role': 'customer', 'path': lambda d, w: f'/customer/buy/{w["rng"].choice(d.available)}'},
+    {'name': 'buy_product', 'role': 'customer', 'method': 'POST', 'expect': (302,), 'prepare': _prepare_buy,
+     'path': lambda d, w: f'/customer/buy/{w["p_id"]}',
+     'data': lambda d, w: {'quantity': '1', 'destination': 'Load test', 'razorpay_payment_id': '',
+                           'order_key': w['order_key']}},
+    {'name': 'buy_product payment', 'role': 'customer',
+     'path': lambda d, w: f'/customer/buy/{w["rng"].choice(d.available)}/payment?quantity=2.5'},
+    {'name': 'add_to_cart', 'role': 'customer', 'method': 'POST', 'expect': (302,),
+     'path': lambda d, w: f'/customer/add_to_cart/{w["rng"].choice(d.available)}', 'data': lambda d, w: {'quantity': '1'}},
+    {'name': 'cart', 'role': 'customer', 'path': lambda d, w: '/customer/cart'},
+    {'name': 'cart items', 'role': 'customer', 'path': lambda d, w: '/customer/cart/items'},
+    {'name': 'cart items (batch)', 'role': 'customer', 'method': 'POST', 'path': lambda d, w: '/customer/cart/items',
+     'payload': lambda d, w: {'operations': [{'op': 'set', 'p_id': p_id, 'quantity': 1}
+                                          for p_id in w['rng'].sample(d.available, 3)]}},
+    {'name': 'remove_from_cart', 'role': 'customer', 'expect': (302,), 'prepare': _prepare_remove,
+     'path': lambda d, w: f'/customer/cart/remove/{w["cart_id"]}'},
+    {'name': 'checkout', 'role': 'customer', 'prepare': lambda client, d, w: _add_to_cart(client, d, w),
+     'path': lambda d, w: '/customer/checkout'},
+    {'name': 'payment order status', 'role': 'customer', 'prepare': _prepare_payment_status,
+     'path': lambda d, w: f'/customer/payment/order/{w["order_key"]}'},
+    {'name': 'payment success', 'role': 'customer', 'method': 'POST', 'expect': (302,),
+     'prepare': _prepare_payment_success, 'path': lambda d, w: '/customer/payment/success',
+     'data': lambda d, w: {'destination': 'Load test', 'razorpay_payment_id': '', 'order_key': w['order_key']}},
+
+    {'name': 'admin dashboard', 'role': 'admin', 'path': lambda d, w: '/admin/dashboard'},
+    {'name': 'admin dashboard (filtered)', 'role': 'admin',
+     'path': lambda d, w: f'/admin/dashboard?status=Confirmed&from={date.today() - timedelta(days=30)}'},
+    {'name': 'export orders.csv (7 days)', 'role': 'admin',
+     'path': lambda d, w: f'/admin/export/orders.csv?from={date.today() - timedelta(days=7)}'},
+    {'name': 'export farmers.ndjson', 'role': 'admin', 'path': lambda d, w: '/admin/export/farmers.ndjson'},
+    {'name': 'admin cache', 'role': 'admin', 'path': lambda d, w: '/admin/cache'},
+    {'name': 'admin credentials', 'role': 'admin', 'path': lambda d, w: '/admin/credentials'},
+    {'name': 'metrics', 'role': 'admin', 'path': lambda d, w: '/metrics'},
+    {'name': 'admin profile (form)', 'role': 'admin', 'path': lambda d, w: '/admin/profile'},
+    {'name': 'admin profile', 'role': 'admin', 'method': 'POST', 'expect': (302,), 'path': lambda d, w: '/admin/profile',
+     'data': lambda d, w: _profile_form('Bench', 'Admin')},
+    {'name': 'admin customers', 'role': 'admin', 'path': lambda d, w: '/admin/customers'},
+    {'name': 'admin customers (search)', 'role': 'admin',
+     'path': lambda d, w: f'/admin/customers?sort=name&q={w["rng"].choice(d.last_names)}'},
+    {'name': 'admin edit customer (form)', 'role': 'admin',
+     'path': lambda d, w: f'/admin/customer/edit/{w["rng"].randrange(1, d.counts["customers"] + 1)}'},
+    {'name': 'admin edit customer', 'role': 'admin', 'method': 'POST', 'expect': (302,), 'disposable': 'customers',
+     'path': lambda d, w: f'/admin/customer/edit/{d.take("customers")}', 'data': lambda d, w: _profile_form('Load', 'Edited')},
+    {'name': 'admin delete customer', 'role': 'admin', 'expect': (302,), 'disposable': 'customers',
+     'path': lambda d, w: f'/admin/customer/delete/{d.take("customers")}'},
+    {'name': 'admin farmers', 'role': 'admin', 'path': lambda d, w: '/admin/farmers'},
+    {'name': 'admin farmers (search)', 'role': 'admin', 'path': lambda d, w: f'/admin/farmers?sort=login&q=farmer{w["rng"].randrange(1, 10)}'},
+    {'name': 'admin edit farmer (form)', 'role': 'admin',
+     'path': lambda d, w: f'/admin/farmer/edit/{w["rng"].randrange(1, d.counts["farmers"] + 1)}'},
+    {'name': 'admin edit farmer', 'role': 'admin', 'method': 'POST', 'expect': (302,), 'disposable': 'farmers',
+     'path': lambda d, w: f'/admin/farmer/edit/{d.take("farmers")}', 'data': lambda d, w: _profile_form('Load', 'Edited')},
+    {'name': 'admin delete farmer', 'role': 'admin', 'expect': (302,), 'disposable': 'farmers',
+     'path': lambda d, w: f'/admin/farmer/delete/{d.take("farmers")}'},
+]
+
+
+def _login(client, role, user):
+    loginname = 'admin' if role == 'admin' else f'{role}{user}'
+    status = client.request('POST', '/login', data={'role': role, 'loginname': loginname, 'password': seed.PASSWORD})
+    if status != 302:
+        raise RuntimeError(f'Could not log in as {loginname} (HTTP {status}); was the database made by seed.py?')
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * p / 100)) - 1))]
+
+
+def run_route(route, workers, dataset, total):
+    """Send total requests for one route from every worker at once; return
+    its throughput, latency percentiles and unexpected statuses."""
+    total = max(1, int(total * route.get('share', 1)))
+    if route.get('disposable'):
+        dataset.make_disposable(route['disposable'], total)
+    expect = route.get('expect', (200,))
+    counter = itertools.count()
+    latencies, unexpected, failures = [], collections.Counter(), []
+    lock = threading.Lock()
+
+    def work(w):
+        client = w['clients'][route['role']]
+        mine = []
+        while next(counter) < total:
+            try:
+                if route.get('prepare'):
+                    route['prepare'](client, dataset, w)
+                path = route['path'](dataset, w)
+                kwargs = {'data': route['data'](dataset, w) if route.get('data') else None,
+                          'payload': route['payload'](dataset, w) if route.get('payload') else None,
+                          'body': route.get('body'), 'content_type': route.get('content_type')}
+                start = time.perf_counter()
+                status = client.request(route.get('method', 'GET'), path, **kwargs)
+                mine.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    failures.append(repr(e))
+                continue
+            if status not in expect:
+                with lock:
+                    unexpected[status] += 1
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in workers]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {'requests': len(latencies), 'errors': sum(unexpected.values()) + len(failures),
+              'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0}
+    if latencies:
+        result.update({'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+                       **{f'p{p}_ms': round(_percentile(latencies, p) * 1000, 2) for p in (50, 95, 99)}})
+    if unexpected:
+        result['unexpected_status'] = {str(k): v for k, v in unexpected.items()}
+    if failures:
+        result['exceptions'] = failures[:5]
+    return result
+
+
+def run(dataset, routes, threads, total, url=None):
+    """{route name: result} for the given routes, in order."""
+    if url is None:
+        flask_app = chawal_app.app
+        old = flask_app.extensions.pop('db_pool', None)
+        if old is not None:
+            old.close_all()
+        flask_app.config.update(DATABASE=dataset.path, PAYMENT_GATEWAY='fake', PAYMENT_FAKE_LATENCY=0)
+        with flask_app.test_request_context():
+            dataset.asset_path = chawal_app.asset_url('css/style.css')
+
+        def make_client():
+            return TestClient(flask_app)
+    else:
+        os.environ.setdefault('FINGERPRINT_ASSETS', '1')
+        with chawal_app.app.test_request_context():
+            dataset.asset_path = chawal_app.asset_url('css/style.css')
+
+        def make_client():
+            return HTTPClient(url)
+
+    roles = {route['role'] for route in routes}
+    workers = []
+    customers = max(1, dataset.counts['customers'])
+    for i in range(threads):
+        w = {'id': i, 'user': i % customers + 1, 'rng': random.Random(i), 'counter': itertools.count(), 'clients': {}}
+        for role in roles:
+            w['clients'][role] = client = make_client()
+            if role is not None:
+                _login(client, role, w['user'] if role == 'customer' else 1)
+        workers.append(w)
+
+    results = {}
+    for route in routes:
+        results[route['name']] = result = run_route(route, workers, dataset, total)
+        print(f'{route["name"]:32} {result["rps"]:8.1f} req/s  p50 {result.get("p50_ms", 0):7.1f}  '
+              f'p95 {result.get("p95_ms", 0):7.1f}  p99 {result.get("p99_ms", 0):7.1f} ms'
+              + (f'  errors {result["errors"]} {result.get("unexpected_status") or result["exceptions"][0]}'
+                 if result['errors'] else ''),
+              flush=True)
+    if url is None:
+        chawal_app.app.extensions.pop('db_pool').close_all()
+    return results
+
+
+def compare(results, baseline):
+    """Print the change in throughput and p95 latency against an earlier run."""
+    print(f'\nAgainst {baseline["meta"].get("started_at")} ({baseline["meta"].get("revision") or "unknown revision"}):')
+    for name, result in results.items():
+        before = baseline['routes'].get(name)
+        if not before or not before.get('rps') or not before.get('p95_ms') or 'p95_ms' not in result:
+            continue
+        rps = (result['rps'] / before['rps'] - 1) * 100
+        p95 = (result['p95_ms'] / before['p95_ms'] - 1) * 100
+        flag = '  <-- slower' if p95 > 20 and result['p95_ms'] - before['p95_ms'] > 1 else ''
+        print(f'{name:32} req/s {before["rps"]:8.1f} -> {result["rps"]:8.1f} ({rps:+6.1f}%)  '
+              f'p95 {before["p95_ms"]:7.1f} -> {result["p95_ms"]:7.1f} ms ({p95:+6.1f}%){flag}')
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='database made by seed.py (default: seed a fresh one at --scale)')
+    parser.add_argument('--scale', choices=seed.SCALES, default='small')
+    parser.add_argument('--url', help='send requests over HTTP to a server running at this URL')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--routes', nargs='*', metavar='PATTERN', help='only routes whose name matches a glob pattern')
+    parser.add_argument('--json', metavar='FILE', help='save the results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    if args.url and not args.db:
+        parser.error('--url needs --db, the database the server is using')
+    routes = [r for r in ROUTES if not args.routes or any(fnmatch.fnmatch(r['name'], p) for p in args.routes)]
+    if not routes:
+        parser.error('no route matches --routes')
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db
+        if path is None:
+            path = os.path.join(tmp, 'loadtest.db')
+            start = time.perf_counter()
+            seed.seed(path, **seed.SCALES[args.scale])
+            print(f'Seeded a {args.scale} dataset in {time.perf_counter() - start:.1f} s', flush=True)
+        dataset = Dataset(path)
+        meta = {'started_at': datetime.now().isoformat(timespec='seconds'), 'revision': _revision(),
+                'mode': args.url or 'test-client', 'threads': args.threads, 'requests': args.requests,
+                'scale': None if args.db else args.scale, 'rows': dataset.counts,
+                'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version}
+        results = run(dataset, routes, args.threads, args.requests, args.url)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'routes': results}, f, indent=2)
+        print(f'Saved {args.json}')
+    if baseline:
+        compare(results, baseline)
+    if any(result['errors'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Request, SQL and payment-gateway metrics in Prometheus text format.
+
+Requests are timed by hooks in app.py and labelled with the Flask endpoint
+rather than the URL, so ids in paths do not create new series. With
+metrics on, get_db() hands out InstrumentedConnections: the execute and
+fetch time of every statement is added to the current request's
+RequestStats, which is merged at the end of the request into per-endpoint
+query count and SQL time histograms and a bounded table of normalized
+statements. Statements run outside a request (background workers) are not
+timed.
+"""
+import bisect
+import re
+import sqlite3
+import threading
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+MAX_STATEMENTS = 500
+TOP_STATEMENTS = 20
+PREFIX = 'chawal'
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+_normalized = {}
+
+
+def normalize(sql):
+    """sql with whitespace collapsed, literals replaced by ? and IN lists of
+    any length shortened to IN (?, ...), so one query shape is one series."""
+    shape = _normalized.get(sql)
+    if shape is None:
+        shape = _SPACE.sub(' ', sql).strip()
+        shape = _NUMBER.sub('?', _STRING.sub('?', shape))
+        shape = _IN_LIST.sub('IN (?, ...)', shape)
+        if len(_normalized) >= 4096:
+            _normalized.clear()
+        _normalized[sql] = shape
+    return shape
+
+
+class RequestStats:
+    """SQL done by one request: total queries and seconds, and [calls,
+    seconds] per statement text."""
+
+    __slots__ = ('queries', 'seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = {}
+
+    def add(self, sql, seconds, call):
+        entry = self.statements.get(sql)
+        if entry is None:
+            entry = self.statements[sql] = [0, 0.0]
+        if call:
+            entry[0] += 1
+            self.queries += 1
+        entry[1] += seconds
+        self.seconds += seconds
+
+    def slowest(self, n=3):
+        """[(normalized sql, calls, seconds)] of the n statements that took longest."""
+        merged = {}
+        for sql, (calls, seconds) in self.statements.items():
+            entry = merged.setdefault(normalize(sql), [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+        return sorted(((sql, c, s) for sql, (c, s) in merged.items()), key=lambda x: -x[2])[:n]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that adds execute and fetch time to connection.stats when set.
+
+    Rows read by iterating the cursor are not timed: wrapping __next__ costs
+    more per row than SQLite takes to step, tripling the cost of a 20-row
+    loop. Their time shows up in the request duration instead.
+    """
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        stats = self.connection.stats
+        if stats is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            stats.add(sql, time.perf_counter() - start, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        stats = self.connection.stats
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = sql
+            stats.add(sql, time.perf_counter() - start, True)
+
+    def _timed(self, fetch, *args):
+        stats = self.connection.stats
+        if stats is None or self._sql is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            stats.add(self._sql, time.perf_counter() - start, False)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements are timed into `stats` (a
+    RequestStats) while it is set. Pass as factory to db_pool.connect()."""
+
+    stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute() does not go through cursor(), so route
+    # the shortcuts through an instrumented cursor explicitly.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TimedGateway:
+    """Wraps a payment client (razorpay.Client or FakeGateway) so that
+    order.create() calls are timed into metrics."""
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+        self.order = self
+
+    def create(self, data, **kwargs):
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = self._client.order.create(data=data, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            self._metrics.observe_gateway('order.create', outcome, time.perf_counter() - start)
+
+
+def _labels(**labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Thread-safe registry of the app's metrics. slow_request is a threshold
+    in seconds (None for off) above which requests are logged to logger."""
+
+    def __init__(self, slow_request=None, logger=None):
+        self.slow_request = slow_request
+        self.logger = logger
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._durations = {}
+        self._sql_queries = {}
+        self._sql_seconds = {}
+        self._statements = {}
+        self._gateway = {}
+        self.slow_requests = 0
+
+    def observe_request(self, endpoint, method, status, seconds, stats=None, path=None):
+        with self._lock:
+            key = (endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._durations, endpoint).observe(seconds)
+            if stats is not None:
+                self._histogram(self._sql_queries, endpoint, QUERY_BUCKETS).observe(stats.queries)
+                self._histogram(self._sql_seconds, endpoint).observe(stats.seconds)
+                for sql, (calls, total) in stats.statements.items():
+                    shape = normalize(sql)
+                    entry = self._statements.get(shape)
+                    if entry is None:
+                        if len(self._statements) >= MAX_STATEMENTS:
+                            shape = '<other>'
+                        entry = self._statements.setdefault(shape, [0, 0.0, 0.0])
+                    entry[0] += calls
+                    entry[1] += total
+                    entry[2] = max(entry[2], total)
+            slow = self.slow_request is not None and seconds >= self.slow_request
+            if slow:
+                self.slow_requests += 1
+        if slow and self.logger is not None:
+            detail = ''
+            if stats is not None:
+                detail = f', {stats.queries} queries in {stats.seconds * 1000:.1f} ms; slowest: ' + '; '.join(
+                    f'{s * 1000:.1f} ms x{c} {sql[:200]}' for sql, c, s in stats.slowest())
+            self.logger.warning('Slow request: %s %s (%s) %d in %.1f ms%s', method, path or '', endpoint, status,
+                                seconds * 1000, detail)
+
+    def observe_gateway(self, operation, outcome, seconds):
+        with self._lock:
+            self._histogram(self._gateway, (operation, outcome)).observe(seconds)
+
+    def render(self, extra=None):
+        """Everything in Prometheus text exposition format. extra is an
+        optional {name: (type, help, value)} of other values to include."""
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} {kind}')
+
+        def histogram(name, help_text, series, label_names):
+            header(name, 'histogram', help_text)
+            for key, h in sorted(series.items()):
+                labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+                lines.append(f'{PREFIX}_{name}_sum{_labels(**labels)} {_number(h.sum)}')
+                lines.append(f'{PREFIX}_{name}_count{_labels(**labels)} {h.count}')
+
+        with self._lock:
+            header('http_requests_total', 'counter', 'HTTP requests by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'{PREFIX}_http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+            histogram('http_request_duration_seconds', 'Time to produce a response, by endpoint.',
+                      self._durations, ('endpoint',))
+            histogram('sql_queries_per_request', 'SQL statements executed per request, by endpoint.',
+                      self._sql_queries, ('endpoint',))
+            histogram('sql_seconds_per_request', 'Time spent in SQLite per request, by endpoint.',
+                      self._sql_seconds, ('endpoint',))
+
+            top = sorted(self._statements.items(), key=lambda item: -item[1][1])[:TOP_STATEMENTS]
+            header('sql_statement_seconds_total', 'counter',
+                   f'Time spent in the {TOP_STATEMENTS} most expensive normalized statements.')
+            for sql, (calls, total, worst) in top:
+                lines.append(f'{PREFIX}_sql_statement_seconds_total{_labels(statement=sql)} {_number(total)}')
+            header('sql_statement_calls_total', 'counter', 'Executions of those statements.')
+            for sql, (calls, total, worst) in top:
+                lines.append(f'{PREFIX}_sql_statement_calls_total{_labels(statement=sql)} {calls}')
+            header('sql_statement_max_request_seconds', 'gauge', 'Most time one request spent in each statement.')
+            for sql, (calls, total, worst) in top:
+                lines.append(f'{PREFIX}_sql_statement_max_request_seconds{_labels(statement=sql)} {_number(worst)}')
+
+            histogram('payment_gateway_call_duration_seconds', 'Outbound payment gateway calls, by operation and outcome.',
+                      self._gateway, ('operation', 'outcome'))
+            header('slow_requests_total', 'counter', 'Requests slower than the slow request threshold.')
+            lines.append(f'{PREFIX}_slow_requests_total {self.slow_requests}')
+
+        header('process_start_time_seconds', 'gauge', 'Start time of the process since the epoch.')
+        lines.append(f'{PREFIX}_process_start_time_seconds {_number(self.started)}')
+        for name, (kind, help_text, value) in (extra or {}).items():
+            header(name, kind, help_text)
+            lines.append(f'{PREFIX}_{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _histogram(series, key, buckets=BUCKETS):
+        h = series.get(key)
+        if h is None:
+            h = series[key] = Histogram(buckets)
+        return h
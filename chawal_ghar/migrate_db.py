@@ -1,26 +1,144 @@
+import itertools
+import os
+import re
 import sqlite3
+import sys
+
+import db_pool
 
 DATABASE = 'database.db'
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Queries behind the hot routes, checked with EXPLAIN QUERY PLAN by --check.
+# Each must be answered through an index rather than a full table scan. The
+# catalog pages' queries are built by catalog_queries() below.
+HOT_QUERIES = {
+    'dashboard_farmer products': ('SELECT * FROM products WHERE f_id = ?', (1,)),
+    'dashboard_farmer recent orders': ('''
+        SELECT orders.*, products.p_name, customers.c_firstname, customers.c_lastname
+        FROM farmer_orders
+        JOIN orders ON orders.o_id = farmer_orders.o_id
+        JOIN products ON orders.p_id = products.p_id
+        JOIN customers ON orders.c_id = customers.c_id
+        WHERE farmer_orders.f_id = ? AND farmer_orders.o_id < ?
+        ORDER BY farmer_orders.o_id DESC
+        LIMIT 21
+    ''', (1, 1000)),
+    'dashboard_farmer totals': ('SELECT o_status, orders, units, revenue FROM farmer_sales WHERE f_id = ?', (1,)),
+    'dashboard_farmer product totals': ('SELECT p_id, SUM(orders), SUM(units), SUM(revenue) FROM product_sales WHERE f_id = ? GROUP BY p_id', (1,)),
+    'dashboard_farmer daily': ('SELECT * FROM farmer_sales_daily WHERE f_id = ? AND day >= ?', (1, '2025-01-01')),
+    'dashboard_customer my_orders': ('SELECT orders.*, products.p_name FROM orders JOIN products ON orders.p_id = products.p_id WHERE orders.c_id = ?', (1,)),
+    'add_to_cart existing item': ('SELECT * FROM cart WHERE c_id = ? AND p_id = ?', (1, 1)),
+    'view_cart': ('''
+        SELECT cart.*, products.p_name, products.p_priceperunit, products.p_quantity as max_quantity
+        FROM cart
+        JOIN products ON cart.p_id = products.p_id
+        WHERE cart.c_id = ?
+    ''', (1,)),
+    'payments by order': ('SELECT * FROM payments WHERE o_id = ?', (1,)),
+    'payments by gateway id': ('SELECT o_id FROM all_payments WHERE gateway_payment_id = ? ORDER BY o_id', ('pay_1',)),
+    'admin customers by name': ('''
+        SELECT c_id FROM customers
+        WHERE c_lastname COLLATE NOCASE >= ? AND (c_lastname COLLATE NOCASE, c_firstname COLLATE NOCASE, c_id) > (?, ?, ?)
+        ORDER BY c_lastname COLLATE NOCASE, c_firstname COLLATE NOCASE, c_id LIMIT 51
+    ''', ('a', 'a', 'b', 1)),
+    'admin farmers by login': ('SELECT f_id FROM farmers WHERE (f_loginname, f_id) > (?, ?) ORDER BY f_loginname, f_id LIMIT 51', ('a', 1)),
+    'admin customer stats': ('SELECT c_id, COUNT(*), SUM(o_amount) FROM all_orders WHERE c_id IN (?, ?) GROUP BY c_id', (1, 2)),
+    'page versions': ("SELECT name, scope, version FROM data_versions WHERE (name = ? AND scope = ?) OR (name = ? AND scope = ?)",
+                      ('orders', 'c1', 'products', '')),
+    'new events': ('SELECT event_id, channel, kind, data FROM events WHERE event_id > ? ORDER BY event_id LIMIT 500', (1,)),
+    'archived orders by customer': ('SELECT orders.*, products.p_name FROM orders_archive AS orders JOIN products ON orders.p_id = products.p_id WHERE orders.c_id = ? ORDER BY orders.o_id DESC LIMIT 25', (1,)),
+}
+
+
+def pending_migrations(conn):
+    """Migration files not yet recorded in schema_version, as (version, name, path)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    applied = {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+    pending = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r'(\d+)_(\w+)\.sql$', filename)
+        if match and int(match.group(1)) not in applied:
+            pending.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return pending
+
+
+def migrate(conn):
+    """Apply pending migrations in order, each in its own transaction together
+    with its schema_version row. Returns the names of the applied migrations."""
+    applied = []
+    for version, name, path in pending_migrations(conn):
+        with open(path, 'r') as f:
+            script = f.read()
+        try:
+            conn.executescript('BEGIN IMMEDIATE;\n' + script + '\n;'
+                               f"INSERT INTO schema_version (version, name) VALUES ({version}, '{name}');\n"
+                               'COMMIT;')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append(f'{version:04d}_{name}')
+    return applied
+
 
-def add_cart_table():
-    conn = sqlite3.connect(DATABASE)
+def catalog_queries():
+    """The catalog page query (catalog.product_query) for every combination of
+    filters and sort, on the first page and on a later one."""
+    # catalog imports this module (through archive), so not at the top.
+    import catalog
+    queries = {}
+    for sort, (column, _) in catalog.SORTS.items():
+        for rice_type, price, farmer, later in itertools.product((None, 'Basmati'), (None, 50.0), (None, 1), (False, True)):
+            filters = {'type': rice_type, 'min_price': price, 'max_price': price and price * 2,
+                       'farmer': farmer, 'sort': sort}
+            used = [name for name, value in (('type', rice_type), ('price', price), ('farmer', farmer)) if value]
+            label = ' '.join([f'catalog sort={sort}'] + [f'{name}=?' for name in used] + (['page=2'] if later else []))
+            cursor = catalog.encode_cursor([100] if column == 'p_id' else [60.0, 100]) if later else None
+            queries[label] = catalog.product_query(filters, cursor)
+    return queries
+
+
+def check_query_plans(conn):
+    """Map each hot query to the plan lines that scan a whole table, or for a
+    page (a query with LIMIT) that sort the matching rows (empty = indexed)."""
+    problems = {}
+    for label, (sql, params) in {**HOT_QUERIES, **catalog_queries()}.items():
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        # Reading the rows a view produces (all_orders) is not a table scan;
+        # the view's own lines show how its tables are read.
+        views = {line.split()[1] for line in plan if line.startswith('CO-ROUTINE')}
+        problems[label] = [line for line in plan if line.startswith('SCAN') and 'USING' not in line
+                           and line.split()[1] not in views]
+        if 'LIMIT' in sql:
+            problems[label] += [line for line in plan if line == 'USE TEMP B-TREE FOR ORDER BY']
+    return problems
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    conn = sqlite3.connect(args[0] if args else DATABASE)
     try:
-        conn.execute('''
-        CREATE TABLE IF NOT EXISTS cart (
-            cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            c_id INTEGER NOT NULL,
-            p_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL,
-            FOREIGN KEY (c_id) REFERENCES customers (c_id),
-            FOREIGN KEY (p_id) REFERENCES products (p_id)
-        );
-        ''')
-        print("Cart table created successfully.")
-        conn.commit()
-    except Exception as e:
-        print(f"Error creating cart table: {e}")
+        applied = migrate(conn)
+        for migration in applied:
+            print(f'Applied migration {migration}.')
+        if applied:
+            # New indexes have no statistics yet; if their tables have some,
+            # the planner would guess at them (see db_pool.optimize).
+            db_pool.optimize(conn)
+        print('Database schema is up to date.')
+        if '--check' in sys.argv:
+            failed = False
+            for label, scans in check_query_plans(conn).items():
+                status = 'indexed' if not scans else 'FULL SCAN' if scans[0].startswith('SCAN') else 'SORTED'
+                print(f"{status:10} {label} {'; '.join(scans)}")
+                failed = failed or bool(scans)
+            sys.exit(1 if failed else 0)
     finally:
         conn.close()
-
-if __name__ == '__main__':
-    add_cart_table()
@@ -0,0 +1,10 @@
+-- Cart table for databases created before the cart feature
+-- (replaces the old one-off migrate_db.add_cart_table script).
+CREATE TABLE IF NOT EXISTS cart (
+    cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    c_id INTEGER NOT NULL,
+    p_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    FOREIGN KEY (c_id) REFERENCES customers (c_id),
+    FOREIGN KEY (p_id) REFERENCES products (p_id)
+);
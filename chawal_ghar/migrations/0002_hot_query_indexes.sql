@@ -0,0 +1,6 @@
+-- Secondary indexes for the dashboard, cart and checkout queries.
+CREATE INDEX IF NOT EXISTS idx_products_f_id ON products (f_id);
+CREATE INDEX IF NOT EXISTS idx_products_status ON products (p_status);
+CREATE INDEX IF NOT EXISTS idx_orders_c_id ON orders (c_id);
+CREATE INDEX IF NOT EXISTS idx_orders_p_id ON orders (p_id);
+CREATE INDEX IF NOT EXISTS idx_payments_o_id ON payments (o_id);
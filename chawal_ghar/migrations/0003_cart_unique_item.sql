@@ -0,0 +1,12 @@
+-- One cart row per (customer, product). Merge any duplicate rows into the
+-- oldest one before adding the unique index.
+UPDATE cart SET quantity = (
+    SELECT SUM(c2.quantity) FROM cart AS c2
+    WHERE c2.c_id = cart.c_id AND c2.p_id = cart.p_id
+)
+WHERE cart_id IN (SELECT MIN(cart_id) FROM cart GROUP BY c_id, p_id HAVING COUNT(*) > 1);
+
+DELETE FROM cart
+WHERE cart_id NOT IN (SELECT MIN(cart_id) FROM cart GROUP BY c_id, p_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_c_id_p_id ON cart (c_id, p_id);
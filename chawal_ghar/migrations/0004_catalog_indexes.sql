@@ -0,0 +1,9 @@
+-- Composite indexes for the keyset-paginated catalog (see catalog.SORTS).
+-- Each one serves "WHERE p_status = 'Available' [AND p_type = ?] ORDER BY
+-- <sort column>, p_id" straight from the index, so a page costs the same
+-- however deep into the catalog it is.
+CREATE INDEX IF NOT EXISTS idx_products_status_price ON products (p_status, p_priceperunit, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_quantity ON products (p_status, p_quantity, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_type ON products (p_status, p_type, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_type_price ON products (p_status, p_type, p_priceperunit, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_type_quantity ON products (p_status, p_type, p_quantity, p_id);
@@ -0,0 +1,51 @@
+-- Full-text index over Available product listings for /customer/search. The
+-- rowid of product_search is the p_id of the listing; triggers keep it in
+-- step with products (including status changes) and with farmer
+-- renames/deletes.
+CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+    p_name, p_type, p_batch, farmer_name,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- Default ranking: bm25 weighted towards the product name, then the rice type,
+-- farmer name and batch.
+INSERT INTO product_search (product_search, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 2.0)');
+
+-- Term list used to suggest corrections for misspelt search words.
+CREATE VIRTUAL TABLE IF NOT EXISTS product_search_vocab USING fts5vocab(product_search, row);
+
+CREATE TRIGGER IF NOT EXISTS products_search_insert AFTER INSERT ON products
+WHEN new.p_status = 'Available' BEGIN
+    INSERT INTO product_search (rowid, p_name, p_type, p_batch, farmer_name)
+    VALUES (new.p_id, new.p_name, new.p_type, new.p_batch,
+            (SELECT f_firstname || ' ' || f_lastname FROM farmers WHERE f_id = new.f_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_search_update AFTER UPDATE OF p_name, p_type, p_batch, f_id, p_status ON products BEGIN
+    DELETE FROM product_search WHERE rowid = old.p_id;
+    INSERT INTO product_search (rowid, p_name, p_type, p_batch, farmer_name)
+    SELECT new.p_id, new.p_name, new.p_type, new.p_batch,
+           (SELECT f_firstname || ' ' || f_lastname FROM farmers WHERE f_id = new.f_id)
+    WHERE new.p_status = 'Available';
+END;
+
+CREATE TRIGGER IF NOT EXISTS products_search_delete AFTER DELETE ON products BEGIN
+    DELETE FROM product_search WHERE rowid = old.p_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmers_search_rename AFTER UPDATE OF f_firstname, f_lastname ON farmers BEGIN
+    UPDATE product_search SET farmer_name = new.f_firstname || ' ' || new.f_lastname
+    WHERE rowid IN (SELECT p_id FROM products WHERE f_id = new.f_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmers_search_delete AFTER DELETE ON farmers BEGIN
+    DELETE FROM product_search WHERE rowid IN (SELECT p_id FROM products WHERE f_id = old.f_id);
+END;
+
+DELETE FROM product_search;
+INSERT INTO product_search (rowid, p_name, p_type, p_batch, farmer_name)
+SELECT products.p_id, products.p_name, products.p_type, products.p_batch,
+       farmers.f_firstname || ' ' || farmers.f_lastname
+FROM products LEFT JOIN farmers ON products.f_id = farmers.f_id
+WHERE products.p_status = 'Available';
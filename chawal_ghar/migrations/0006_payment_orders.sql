@@ -0,0 +1,17 @@
+-- Gateway orders created by payment_orders.PaymentOrderService, keyed on the
+-- customer's cart contents and amount so a page refresh reuses the same order.
+-- status: queued -> pending (claimed by a worker) -> created | failed, and
+-- paid once the customer has completed payment against it.
+CREATE TABLE IF NOT EXISTS payment_orders (
+    order_key TEXT PRIMARY KEY,
+    c_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    currency TEXT NOT NULL DEFAULT 'INR',
+    receipt TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    gateway_order_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
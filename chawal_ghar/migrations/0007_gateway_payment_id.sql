@@ -0,0 +1,4 @@
+-- Gateway payment id (razorpay_payment_id) on each payment row, so a
+-- repeated success callback for the same payment places its orders once.
+ALTER TABLE payments ADD COLUMN gateway_payment_id TEXT;
+CREATE INDEX IF NOT EXISTS idx_payments_gateway_payment_id ON payments (gateway_payment_id);
@@ -0,0 +1,7 @@
+-- Version counters that let worker processes tell each other their in-process
+-- caches are stale (see catalog_cache.CatalogCache, shared mode).
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO cache_versions (name) VALUES ('catalog');
@@ -0,0 +1,123 @@
+-- Sales totals for the farmer dashboard, kept up to date by triggers on
+-- orders so the dashboard never has to scan a farmer's order history.
+-- sales.rebuild() recomputes them from orders; sales.verify() compares.
+
+-- Orders only recorded the amount; older rows get the quantity back from the
+-- product's current price.
+ALTER TABLE orders ADD COLUMN o_quantity INTEGER;
+UPDATE orders SET o_quantity = (
+    SELECT CAST(ROUND(orders.o_amount / p_priceperunit) AS INTEGER)
+    FROM products WHERE products.p_id = orders.p_id AND p_priceperunit > 0
+);
+
+CREATE TABLE IF NOT EXISTS product_sales (
+    p_id INTEGER NOT NULL,
+    f_id INTEGER NOT NULL,
+    o_status TEXT NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (p_id, o_status)
+);
+CREATE INDEX IF NOT EXISTS idx_product_sales_f_id ON product_sales (f_id);
+
+CREATE TABLE IF NOT EXISTS farmer_sales (
+    f_id INTEGER NOT NULL,
+    o_status TEXT NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (f_id, o_status)
+);
+
+CREATE TABLE IF NOT EXISTS farmer_sales_daily (
+    f_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    o_status TEXT NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (f_id, day, o_status)
+);
+
+CREATE TRIGGER IF NOT EXISTS orders_sales_insert AFTER INSERT ON orders BEGIN
+    INSERT INTO product_sales (p_id, f_id, o_status, orders, units, revenue)
+    SELECT new.p_id, f_id, COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (p_id, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+    INSERT INTO farmer_sales (f_id, o_status, orders, units, revenue)
+    SELECT f_id, COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (f_id, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+    INSERT INTO farmer_sales_daily (f_id, day, o_status, orders, units, revenue)
+    SELECT f_id, date(new.o_date), COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (f_id, day, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+END;
+
+CREATE TRIGGER IF NOT EXISTS orders_sales_delete AFTER DELETE ON orders BEGIN
+    UPDATE product_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE p_id = old.p_id AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales_daily SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND day = date(old.o_date)
+      AND o_status = COALESCE(old.o_status, '');
+    DELETE FROM product_sales WHERE p_id = old.p_id AND orders = 0;
+    DELETE FROM farmer_sales WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+    DELETE FROM farmer_sales_daily WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+END;
+
+-- A status change (or a corrected amount) moves the order from its old
+-- buckets to its new ones.
+CREATE TRIGGER IF NOT EXISTS orders_sales_update AFTER UPDATE OF p_id, o_status, o_amount, o_quantity, o_date ON orders BEGIN
+    UPDATE product_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE p_id = old.p_id AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales_daily SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND day = date(old.o_date)
+      AND o_status = COALESCE(old.o_status, '');
+    DELETE FROM product_sales WHERE p_id = old.p_id AND orders = 0;
+    DELETE FROM farmer_sales WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+    DELETE FROM farmer_sales_daily WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+
+    INSERT INTO product_sales (p_id, f_id, o_status, orders, units, revenue)
+    SELECT new.p_id, f_id, COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (p_id, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+    INSERT INTO farmer_sales (f_id, o_status, orders, units, revenue)
+    SELECT f_id, COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (f_id, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+    INSERT INTO farmer_sales_daily (f_id, day, o_status, orders, units, revenue)
+    SELECT f_id, date(new.o_date), COALESCE(new.o_status, ''), 1, COALESCE(new.o_quantity, 0), new.o_amount
+    FROM products WHERE p_id = new.p_id
+    ON CONFLICT (f_id, day, o_status) DO UPDATE SET
+        orders = orders + 1, units = units + excluded.units, revenue = revenue + excluded.revenue;
+END;
+
+-- Backfill from the existing orders (same queries as sales.rebuild()),
+-- replacing any rows left from a database re-initialised over this one.
+DELETE FROM product_sales;
+DELETE FROM farmer_sales;
+DELETE FROM farmer_sales_daily;
+
+INSERT INTO product_sales (p_id, f_id, o_status, orders, units, revenue)
+SELECT orders.p_id, products.f_id, COALESCE(o_status, ''), COUNT(*), SUM(COALESCE(o_quantity, 0)), SUM(o_amount)
+FROM orders JOIN products ON orders.p_id = products.p_id
+GROUP BY orders.p_id, COALESCE(o_status, '');
+
+INSERT INTO farmer_sales (f_id, o_status, orders, units, revenue)
+SELECT f_id, o_status, SUM(orders), SUM(units), SUM(revenue)
+FROM product_sales GROUP BY f_id, o_status;
+
+INSERT INTO farmer_sales_daily (f_id, day, o_status, orders, units, revenue)
+SELECT products.f_id, date(o_date), COALESCE(o_status, ''), COUNT(*), SUM(COALESCE(o_quantity, 0)), SUM(o_amount)
+FROM orders JOIN products ON orders.p_id = products.p_id
+GROUP BY products.f_id, date(o_date), COALESCE(o_status, '');
@@ -0,0 +1,56 @@
+-- Sorting and search for the admin customer/farmer lists (see users.py).
+-- Name order is case-insensitive; the rowid at the end of each index entry is
+-- the keyset tie-breaker. Login order uses the UNIQUE index on loginname.
+CREATE INDEX IF NOT EXISTS idx_customers_name ON customers (c_lastname COLLATE NOCASE, c_firstname COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_farmers_name ON farmers (f_lastname COLLATE NOCASE, f_firstname COLLATE NOCASE);
+
+-- Full-text indexes over name, login name, email and contact; the rowid is
+-- the c_id / f_id. Contacts and email parts are matched as prefixes.
+CREATE VIRTUAL TABLE IF NOT EXISTS customer_search USING fts5(
+    name, login, email, contact,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS farmer_search USING fts5(
+    name, login, email, contact,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS customers_search_insert AFTER INSERT ON customers BEGIN
+    INSERT INTO customer_search (rowid, name, login, email, contact)
+    VALUES (new.c_id, new.c_firstname || ' ' || new.c_lastname, new.c_loginname, new.c_email, new.c_contact);
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_search_update
+AFTER UPDATE OF c_firstname, c_lastname, c_loginname, c_email, c_contact ON customers BEGIN
+    DELETE FROM customer_search WHERE rowid = old.c_id;
+    INSERT INTO customer_search (rowid, name, login, email, contact)
+    VALUES (new.c_id, new.c_firstname || ' ' || new.c_lastname, new.c_loginname, new.c_email, new.c_contact);
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_search_delete AFTER DELETE ON customers BEGIN
+    DELETE FROM customer_search WHERE rowid = old.c_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmers_search_insert AFTER INSERT ON farmers BEGIN
+    INSERT INTO farmer_search (rowid, name, login, email, contact)
+    VALUES (new.f_id, new.f_firstname || ' ' || new.f_lastname, new.f_loginname, new.f_email, new.f_contact);
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmers_search_update
+AFTER UPDATE OF f_firstname, f_lastname, f_loginname, f_email, f_contact ON farmers BEGIN
+    DELETE FROM farmer_search WHERE rowid = old.f_id;
+    INSERT INTO farmer_search (rowid, name, login, email, contact)
+    VALUES (new.f_id, new.f_firstname || ' ' || new.f_lastname, new.f_loginname, new.f_email, new.f_contact);
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmers_search_delete AFTER DELETE ON farmers BEGIN
+    DELETE FROM farmer_search WHERE rowid = old.f_id;
+END;
+
+INSERT INTO customer_search (rowid, name, login, email, contact)
+SELECT c_id, c_firstname || ' ' || c_lastname, c_loginname, c_email, c_contact FROM customers;
+
+INSERT INTO farmer_search (rowid, name, login, email, contact)
+SELECT f_id, f_firstname || ' ' || f_lastname, f_loginname, f_email, f_contact FROM farmers;
@@ -0,0 +1,17 @@
+-- Jobs to run after a transaction commits, written in that transaction (see
+-- outbox.py). status: queued -> running (claimed until run_after, the lease
+-- expiry) -> deleted when done, or queued again with run_after pushed back
+-- after a failure, or dead after the last attempt.
+CREATE TABLE IF NOT EXISTS outbox (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Due jobs, queued or with an expired lease; dead jobs are left out.
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (run_after) WHERE status != 'dead';
@@ -0,0 +1,12 @@
+-- New-order notices for farmers, written by the notify_farmers outbox job
+-- (see notifications.py) and shown on the farmer dashboard. One per order,
+-- so a retried job does not repeat them.
+CREATE TABLE IF NOT EXISTS farmer_notifications (
+    n_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    f_id INTEGER NOT NULL,
+    o_id INTEGER NOT NULL UNIQUE,
+    message TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_farmer_notifications_farmer ON farmer_notifications (f_id, n_id);
@@ -0,0 +1,65 @@
+-- Cold partitions for orders and payments (see archive.py). Old orders are
+-- moved here in batches so the hot tables, and the dashboard queries that
+-- walk them newest first, stay small. Same columns and foreign keys as the
+-- hot tables, so customers and products with archived orders still cannot
+-- be deleted.
+CREATE TABLE IF NOT EXISTS orders_archive (
+    o_id INTEGER PRIMARY KEY,
+    c_id INTEGER NOT NULL,
+    p_id INTEGER NOT NULL,
+    o_date TEXT,
+    o_status TEXT,
+    o_destination TEXT,
+    o_amount REAL NOT NULL,
+    o_quantity INTEGER,
+    FOREIGN KEY (c_id) REFERENCES customers (c_id),
+    FOREIGN KEY (p_id) REFERENCES products (p_id)
+);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_c_id ON orders_archive (c_id);
+CREATE INDEX IF NOT EXISTS idx_orders_archive_p_id ON orders_archive (p_id);
+
+CREATE TABLE IF NOT EXISTS payments_archive (
+    pay_id INTEGER PRIMARY KEY,
+    o_id INTEGER NOT NULL,
+    c_id INTEGER NOT NULL,
+    p_amount REAL NOT NULL,
+    p_date TEXT,
+    p_method TEXT,
+    p_status TEXT,
+    gateway_payment_id TEXT,
+    FOREIGN KEY (o_id) REFERENCES orders_archive (o_id),
+    FOREIGN KEY (c_id) REFERENCES customers (c_id)
+);
+CREATE INDEX IF NOT EXISTS idx_payments_archive_o_id ON payments_archive (o_id);
+
+-- Newest date in each archive table, so reads of later dates can skip it.
+-- There is deliberately no date index: given one, SQLite reads the whole
+-- date range and sorts it instead of walking o_id newest first.
+CREATE TABLE IF NOT EXISTS archive_bounds (
+    table_name TEXT PRIMARY KEY,
+    newest TEXT NOT NULL
+);
+
+-- Full history, for the queries that need every order (summary rebuilds,
+-- per-customer totals).
+CREATE VIEW IF NOT EXISTS all_orders AS
+    SELECT o_id, c_id, p_id, o_date, o_status, o_destination, o_amount, o_quantity FROM orders
+    UNION ALL
+    SELECT o_id, c_id, p_id, o_date, o_status, o_destination, o_amount, o_quantity FROM orders_archive;
+
+-- Moving an order to the archive is not a sale going away: the summaries
+-- keep counting it. archive.py copies the order before deleting it.
+DROP TRIGGER IF EXISTS orders_sales_delete;
+CREATE TRIGGER orders_sales_delete AFTER DELETE ON orders
+WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE o_id = old.o_id) BEGIN
+    UPDATE product_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE p_id = old.p_id AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND o_status = COALESCE(old.o_status, '');
+    UPDATE farmer_sales_daily SET orders = orders - 1, units = units - COALESCE(old.o_quantity, 0), revenue = revenue - old.o_amount
+    WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND day = date(old.o_date)
+      AND o_status = COALESCE(old.o_status, '');
+    DELETE FROM product_sales WHERE p_id = old.p_id AND orders = 0;
+    DELETE FROM farmer_sales WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+    DELETE FROM farmer_sales_daily WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND orders = 0;
+END;
@@ -0,0 +1,81 @@
+-- Version counters for conditional GET (see data_versions.py). Triggers bump
+-- the counter of every table a page is built from when it is written, once
+-- for the whole table (scope '') and, for what the dashboards read per user,
+-- once for the customer ('c' || c_id) or farmer ('f' || f_id) it belongs to.
+CREATE TABLE IF NOT EXISTS data_versions (
+    name TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (name, scope)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS products_version_insert AFTER INSERT ON products BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('products', ''), ('products', 'f' || new.f_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS products_version_update AFTER UPDATE ON products BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('products', ''), ('products', 'f' || new.f_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS products_version_delete AFTER DELETE ON products BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('products', ''), ('products', 'f' || old.f_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+
+-- An order belongs to its customer and to the farmer of its product.
+CREATE TRIGGER IF NOT EXISTS orders_version_insert AFTER INSERT ON orders BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('orders', ''), ('orders', 'c' || new.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+    INSERT INTO data_versions (name, scope) SELECT 'orders', 'f' || f_id FROM products WHERE p_id = new.p_id
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS orders_version_update AFTER UPDATE ON orders BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('orders', ''), ('orders', 'c' || new.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+    INSERT INTO data_versions (name, scope) SELECT 'orders', 'f' || f_id FROM products WHERE p_id = new.p_id
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS orders_version_delete AFTER DELETE ON orders BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('orders', ''), ('orders', 'c' || old.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+    INSERT INTO data_versions (name, scope) SELECT 'orders', 'f' || f_id FROM products WHERE p_id = old.p_id
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS cart_version_insert AFTER INSERT ON cart BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('cart', 'c' || new.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cart_version_update AFTER UPDATE ON cart BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('cart', 'c' || new.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS cart_version_delete AFTER DELETE ON cart BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('cart', 'c' || old.c_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+
+-- Customer and farmer names appear on other users' pages.
+CREATE TRIGGER IF NOT EXISTS customers_version_insert AFTER INSERT ON customers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('customers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS customers_version_update AFTER UPDATE ON customers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('customers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS customers_version_delete AFTER DELETE ON customers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('customers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS farmers_version_insert AFTER INSERT ON farmers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('farmers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS farmers_version_update AFTER UPDATE ON farmers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('farmers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS farmers_version_delete AFTER DELETE ON farmers BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('farmers', '') ON CONFLICT DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS farmer_notifications_version_insert AFTER INSERT ON farmer_notifications BEGIN
+    INSERT INTO data_versions (name, scope) VALUES ('farmer_notifications', 'f' || new.f_id)
+    ON CONFLICT DO UPDATE SET version = version + 1;
+END;
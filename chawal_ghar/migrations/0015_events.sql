@@ -0,0 +1,11 @@
+-- Live updates for open pages, written in the transaction that makes the
+-- change and sent to subscribed event streams by each worker's hub (see
+-- events.py). Rows are kept for a few minutes, so browsers that reconnect
+-- with Last-Event-ID get what they missed; readers only ever walk event_id.
+CREATE TABLE IF NOT EXISTS events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
@@ -0,0 +1,7 @@
+-- Composite indexes for catalog pages filtered to one farmer, the
+-- counterparts of the ones in 0004_catalog_indexes.sql. A farmer's page is
+-- read from "p_status = 'Available' AND f_id = ?" in sort order; any type or
+-- price filter is checked on those rows (see catalog.product_query).
+CREATE INDEX IF NOT EXISTS idx_products_status_farmer ON products (p_status, f_id, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_farmer_price ON products (p_status, f_id, p_priceperunit, p_id);
+CREATE INDEX IF NOT EXISTS idx_products_status_farmer_quantity ON products (p_status, f_id, p_quantity, p_id);
@@ -0,0 +1,28 @@
+-- The orders of each farmer's products, by o_id, so that the farmer
+-- dashboard's order list (sales.order_page) walks one farmer's orders newest
+-- first instead of reading and sorting all of them. Kept by triggers on
+-- orders like the sales summaries, for archived orders too: a row stays when
+-- archive.py moves its order, and pages of orders_archive join it the same
+-- way.
+CREATE TABLE IF NOT EXISTS farmer_orders (
+    f_id INTEGER NOT NULL,
+    o_id INTEGER NOT NULL,
+    PRIMARY KEY (f_id, o_id)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO farmer_orders (f_id, o_id)
+SELECT products.f_id, orders.o_id FROM all_orders AS orders JOIN products ON orders.p_id = products.p_id;
+
+CREATE TRIGGER IF NOT EXISTS orders_farmer_insert AFTER INSERT ON orders BEGIN
+    INSERT OR IGNORE INTO farmer_orders (f_id, o_id) SELECT f_id, new.o_id FROM products WHERE p_id = new.p_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS orders_farmer_delete AFTER DELETE ON orders
+WHEN NOT EXISTS (SELECT 1 FROM orders_archive WHERE o_id = old.o_id) BEGIN
+    DELETE FROM farmer_orders WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND o_id = old.o_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS orders_farmer_update AFTER UPDATE OF p_id ON orders BEGIN
+    DELETE FROM farmer_orders WHERE f_id = (SELECT f_id FROM products WHERE p_id = old.p_id) AND o_id = old.o_id;
+    INSERT OR IGNORE INTO farmer_orders (f_id, o_id) SELECT f_id, new.o_id FROM products WHERE p_id = new.p_id;
+END;
@@ -0,0 +1,10 @@
+-- Every payment, hot or archived (see 0013_order_archive.sql), so that the
+-- checkout's idempotency check (checkout_engine.py) still finds a gateway
+-- payment id after archive.py has moved its payments; a replayed callback
+-- must not place the orders again.
+CREATE INDEX IF NOT EXISTS idx_payments_archive_gateway_payment_id ON payments_archive (gateway_payment_id);
+
+CREATE VIEW IF NOT EXISTS all_payments AS
+    SELECT pay_id, o_id, c_id, p_amount, p_date, p_method, p_status, gateway_payment_id FROM payments
+    UNION ALL
+    SELECT pay_id, o_id, c_id, p_amount, p_date, p_method, p_status, gateway_payment_id FROM payments_archive;
@@ -0,0 +1,27 @@
+"""New-order notices on the farmer dashboard.
+
+notify_farmers is an outbox job (see outbox.py) queued by checkout with the
+new order ids. It writes one notice per order; farmer_notifications.o_id is
+unique, so running the job again after a crash adds nothing.
+"""
+RECENT = 5
+
+
+def notify_farmers(db, payload):
+    """Outbox handler: a notice for the farmer of each order in payload['o_ids']."""
+    o_ids = payload['o_ids']
+    if not o_ids:
+        return
+    placeholders = ', '.join('?' * len(o_ids))
+    db.execute(f'''
+        INSERT OR IGNORE INTO farmer_notifications (f_id, o_id, message)
+        SELECT products.f_id, orders.o_id,
+               printf('New order #%d: %g kg of %s for ₹%.2f', orders.o_id, orders.o_quantity, products.p_name, orders.o_amount)
+        FROM orders JOIN products ON orders.p_id = products.p_id
+        WHERE orders.o_id IN ({placeholders})
+    ''', o_ids)
+
+
+def recent(db, f_id, limit=RECENT):
+    return db.execute('SELECT o_id, message, created_at FROM farmer_notifications WHERE f_id = ? '
+                      'ORDER BY n_id DESC LIMIT ?', (f_id, limit)).fetchall()
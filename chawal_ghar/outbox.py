@@ -0,0 +1,239 @@
+"""Transactional outbox: follow-up work queued in the same transaction as
+the change that needs it, and run afterwards by background threads.
+
+A request calls enqueue() before it commits, so the job exists if and only
+if the change does; a crash after the commit leaves the job in the outbox
+table for the next worker. OutboxWorker threads claim due jobs in batches
+with one conditional UPDATE, lease them for `lease` seconds and run the
+handler for each job's kind. The handler's writes and the deletion of the
+job commit together, so a job's effects happen once even when it runs more
+than once. A failed job is retried with exponential backoff and after
+max_attempts left in the table as dead for an admin to look at and retry.
+A worker that dies mid-job leaves it running until the lease runs out,
+when any worker picks it up again.
+
+Workers start with the app (OUTBOX_WORKERS); to run them in a separate
+process instead, set OUTBOX_WORKERS=0 for the web server and run
+
+    python outbox.py [database.db] [--workers 2] [--drain]
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+log = logging.getLogger('outbox')
+
+
+def enqueue(db, kind, payload, delay=0):
+    """Queue a job to run after the current transaction commits. Does not
+    commit. Returns the job id."""
+    return db.execute('INSERT INTO outbox (kind, payload, run_after) VALUES (?, ?, ?)',
+                      (kind, json.dumps(payload), time.time() + delay)).lastrowid
+
+
+def retry(db, job_id):
+    """Queue a dead job again with a fresh set of attempts. Returns False if
+    there is no such dead job. Commits."""
+    changed = db.execute("UPDATE outbox SET status = 'queued', attempts = 0, run_after = ?, error = NULL "
+                         "WHERE job_id = ? AND status = 'dead'", (time.time(), job_id)).rowcount
+    db.commit()
+    return bool(changed)
+
+
+def counts(db):
+    """{'queued', 'running', 'dead', 'oldest_due_seconds'} for the whole table."""
+    now = time.time()
+    result = {'queued': 0, 'running': 0, 'dead': 0}
+    result.update(db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+    oldest = db.execute("SELECT MIN(run_after) FROM outbox WHERE status != 'dead' AND run_after <= ?", (now,)).fetchone()[0]
+    result['oldest_due_seconds'] = round(now - oldest, 3) if oldest is not None else 0
+    return result
+
+
+def dead_jobs(db, limit=20):
+    return db.execute("SELECT job_id, kind, payload, attempts, error, created_at FROM outbox "
+                      "WHERE status = 'dead' ORDER BY job_id DESC LIMIT ?", (limit,)).fetchall()
+
+
+class OutboxWorker:
+    """Runs outbox jobs on `workers` threads.
+
+    handlers maps each job kind to fn(db, payload), called with a pooled
+    connection. It must not commit: its writes are committed together with
+    the job's deletion. wake() lets threads waiting for work start at once
+    instead of after poll_interval.
+    """
+
+    def __init__(self, pool_getter, handlers, workers=2, batch=20, poll_interval=1.0, lease=60.0,
+                 max_attempts=5, backoff=2.0, max_backoff=300.0):
+        self._pool_getter = pool_getter
+        self.handlers = handlers
+        self.workers = workers
+        self.batch = batch
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.done = 0
+        self.failed = 0
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def shutdown(self, wait=True):
+        """Stop after the jobs in hand; unclaimed jobs stay queued."""
+        self._stopping.set()
+        self._wake.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def drain(self):
+        """Run due jobs on the calling thread until none are left. Returns
+        how many were run."""
+        total = 0
+        while not self._stopping.is_set():
+            ran = self.run_once()
+            if not ran:
+                return total
+            total += ran
+        return total
+
+    def run_once(self):
+        """Claim up to batch due jobs and run them. Returns how many were
+        claimed."""
+        pool = self._pool_getter()
+        conn = pool.acquire()
+        try:
+            jobs = self._claim(conn)
+            for job in jobs:
+                self._execute(conn, job)
+            return len(jobs)
+        finally:
+            pool.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {'threads': sum(t.is_alive() for t in self._threads), 'done': self.done, 'failed': self.failed}
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                ran = self.run_once()
+            except Exception:
+                log.exception('Outbox worker failed to claim jobs')
+                ran = 0
+            if not ran and self._wake.wait(self.poll_interval):
+                self._wake.clear()
+
+    def _claim(self, conn):
+        now = time.time()
+        if conn.in_transaction:
+            conn.commit()
+        # Queued jobs that are due, and running ones whose lease has expired
+        # because their worker died. The write lock makes the claim atomic
+        # across threads and processes.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            jobs = conn.execute('''
+                UPDATE outbox SET status = 'running', attempts = attempts + 1, run_after = ?
+                WHERE job_id IN (SELECT job_id FROM outbox WHERE status != 'dead' AND run_after <= ?
+                                 ORDER BY run_after LIMIT ?)
+                RETURNING job_id, kind, payload, attempts
+            ''', (now + self.lease, now, self.batch)).fetchall()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return sorted(jobs, key=lambda job: job['job_id'])
+
+    def _execute(self, conn, job):
+        job_id, attempts = job['job_id'], job['attempts']
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise LookupError(f'No handler for job kind {job["kind"]!r}')
+            handler(conn, json.loads(job['payload']))
+            # Matching attempts fences off a worker whose lease ran out: if
+            # the job was claimed again meanwhile, this run's writes are
+            # rolled back and the new claim finishes it.
+            finished = conn.execute("DELETE FROM outbox WHERE job_id = ? AND attempts = ? AND status = 'running'",
+                                    (job_id, attempts)).rowcount
+            if finished:
+                conn.commit()
+            else:
+                conn.rollback()
+        except Exception as e:
+            conn.rollback()
+            error = f'{type(e).__name__}: {e}'
+            if attempts >= self.max_attempts:
+                log.error('Outbox job %d (%s) failed %d times, giving up: %s', job_id, job['kind'], attempts, error)
+                conn.execute("UPDATE outbox SET status = 'dead', error = ? WHERE job_id = ? AND attempts = ?",
+                             (error, job_id, attempts))
+            else:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+                log.warning('Outbox job %d (%s) failed, retrying in %.0f s: %s', job_id, job['kind'], delay, error)
+                conn.execute("UPDATE outbox SET status = 'queued', run_after = ?, error = ? WHERE job_id = ? AND attempts = ?",
+                             (time.time() + delay, error, job_id, attempts))
+            conn.commit()
+            with self._lock:
+                self.failed += 1
+            return
+        with self._lock:
+            self.done += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', nargs='?', default=os.environ.get('DATABASE'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('OUTBOX_WORKERS') or 2))
+    parser.add_argument('--lease', type=float, help='seconds before a claimed job is taken back (OUTBOX_LEASE)')
+    parser.add_argument('--drain', action='store_true', help='run the jobs that are due and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(process)d %(levelname)s %(name)s: %(message)s')
+    # The handlers are the app's, so this process runs jobs exactly as the
+    # web workers would.
+    import app as chawal_app
+    config = {'OUTBOX_WORKERS': 0}
+    if args.database:
+        config['DATABASE'] = args.database
+    if args.lease is not None:
+        config['OUTBOX_LEASE'] = args.lease
+    with chawal_app.create_app(config).app_context():
+        worker = chawal_app.get_outbox()
+    if args.drain:
+        start = time.perf_counter()
+        ran = worker.drain()
+        log.info('Ran %d jobs in %.2f s; %s', ran, time.perf_counter() - start, worker.stats())
+        return
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    worker.workers = args.workers
+    worker.start()
+    log.info('Running outbox jobs on %d threads', args.workers)
+    while not stopped.wait(3600):
+        pass
+    worker.shutdown(wait=True)
+    log.info('Stopped; %s', worker.stats())
+
+
+if __name__ == '__main__':
+    main()
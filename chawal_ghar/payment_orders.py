@@ -0,0 +1,213 @@
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PaymentMismatch(Exception):
+    """The checkout being placed is not the one its gateway order was created
+    for: another cart or quantity, another amount, or an order already paid."""
+
+
+def order_amount(items):
+    """Amount in paise for items with quantity and p_priceperunit."""
+    items = sorted(items, key=lambda item: item['p_id'])
+    return int(round(sum(item['quantity'] * item['p_priceperunit'] for item in items) * 100))
+
+
+def cart_order_key(c_id, cart_items, amount):
+    """Stable key for a customer's cart: same items, quantities, prices and
+    amount -> same gateway order."""
+    items = sorted((item['p_id'], item['quantity'], item['p_priceperunit']) for item in cart_items)
+    payload = json.dumps({'c_id': c_id, 'items': items, 'amount': amount})
+    return 'cart_' + hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def product_order_key(c_id, p_id, quantity, amount):
+    return f'buy_{c_id}_{p_id}_{float(quantity):g}_{amount}'
+
+
+def payment_signature(secret, order_id, payment_id):
+    """The signature Razorpay Checkout returns: HMAC-SHA256 of
+    'order_id|payment_id' keyed with the API secret."""
+    return hmac.new(secret.encode(), f'{order_id}|{payment_id}'.encode(), hashlib.sha256).hexdigest()
+
+
+def verify_payment(db, payload, secret):
+    """Outbox handler run after checkout: check the signature the browser
+    posted for payload's payment against the gateway order this server
+    created for the checkout (payload['order_id'], never the one the browser
+    posted), and that this gateway order and the payments recorded for
+    payload['o_ids'] are both for payload['amount'] paise. If not, mark those
+    payments Unverified for an admin to follow up. Does not commit."""
+    order_id, payment_id = payload.get('order_id') or '', payload.get('payment_id') or ''
+    o_ids = payload['o_ids']
+    placeholders = ', '.join('?' * len(o_ids))
+    if payment_id and hmac.compare_digest(payment_signature(secret, order_id, payment_id), payload.get('signature') or ''):
+        ordered = db.execute('SELECT amount FROM payment_orders WHERE gateway_order_id = ?', (order_id,)).fetchone()
+        recorded = db.execute(f'SELECT SUM(p_amount) FROM payments WHERE o_id IN ({placeholders})', o_ids).fetchone()[0]
+        if ordered is not None and ordered[0] == payload.get('amount') and \
+                recorded is not None and int(round(recorded * 100)) == payload.get('amount'):
+            return
+    db.execute(f"UPDATE payments SET p_status = 'Unverified' WHERE o_id IN ({placeholders})", o_ids)
+
+
+class PaymentOrderService:
+    """Creates gateway orders off the request path.
+
+    Requests call order_for(), which records the wanted order in the
+    payment_orders table and hands creation to a bounded worker pool; the page
+    renders straight away and polls status() until the gateway order id is
+    there. Rows are claimed with a conditional UPDATE, so several worker
+    processes sharing the database never create the same order twice.
+    """
+
+    def __init__(self, pool_getter, client_getter, workers=4, max_pending=64, timeout=10.0,
+                 retries=3, backoff=0.5, reuse_for=1800):
+        self._pool_getter = pool_getter
+        self._client_getter = client_getter
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment-order')
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.reuse_for = reuse_for
+        # A pending claim older than this belongs to a worker that died.
+        self.stale_after = int(timeout * retries + backoff * 2 ** retries) + 5
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def order_for(self, db, c_id, key, amount, receipt, currency='INR'):
+        """The gateway order for key, queueing its creation if there is no
+        usable one yet. Returns the order as a dict (see _as_dict)."""
+        row = self._row(db, key, c_id)
+        if row is not None and (row['status'] == 'paid' or
+                                (row['status'] == 'created' and row['age'] > self.reuse_for)):
+            db.execute("UPDATE payment_orders SET status = 'queued', gateway_order_id = NULL, attempts = 0, "
+                       "error = NULL, updated_at = CURRENT_TIMESTAMP WHERE order_key = ?", (key,))
+            db.commit()
+        elif row is None:
+            db.execute('INSERT OR IGNORE INTO payment_orders (order_key, c_id, amount, currency, receipt) VALUES (?, ?, ?, ?, ?)',
+                       (key, c_id, amount, currency, receipt))
+            db.commit()
+        return self.status(db, c_id, key)
+
+    def status(self, db, c_id, key, retry=False):
+        """Current state of the order for key, dispatching it to a worker if it
+        is queued (or failed and retry is set). None if the key is unknown."""
+        row = self._row(db, key, c_id)
+        if row is None:
+            return None
+        if row['status'] == 'queued' or (retry and row['status'] == 'failed') or \
+                (row['status'] == 'pending' and row['age'] > self.stale_after):
+            self._dispatch(db, row)
+            row = self._row(db, key, c_id)
+        return self._as_dict(row)
+
+    def mark_paid(self, db, c_id, key, amount):
+        """Retire the order once paid so the same cart later gets a fresh one.
+        Returns its gateway order id, the one the payment must be signed for.
+        Raises PaymentMismatch if the customer has no unpaid order for key
+        created for amount paise. Does not commit; runs inside the caller's
+        checkout transaction."""
+        row = db.execute("SELECT gateway_order_id, amount FROM payment_orders WHERE order_key = ? AND c_id = ? "
+                         "AND status != 'paid'", (key, c_id)).fetchone()
+        if row is None or row['amount'] != amount:
+            raise PaymentMismatch(key)
+        db.execute("UPDATE payment_orders SET status = 'paid', updated_at = CURRENT_TIMESTAMP "
+                   "WHERE order_key = ? AND c_id = ?", (key, c_id))
+        return row['gateway_order_id']
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _row(self, db, key, c_id):
+        return db.execute('''
+            SELECT *, (julianday('now') - julianday(updated_at)) * 86400 AS age
+            FROM payment_orders WHERE order_key = ? AND c_id = ?
+        ''', (key, c_id)).fetchone()
+
+    def _as_dict(self, row):
+        return {'key': row['order_key'], 'id': row['gateway_order_id'], 'amount': row['amount'],
+                'currency': row['currency'], 'status': row['status'], 'error': row['error']}
+
+    def _dispatch(self, db, row):
+        key = row['order_key']
+        with self._lock:
+            if key in self._inflight or len(self._inflight) >= self.max_pending:
+                # Already running here, or saturated: leave it queued and let
+                # the next poll try again.
+                return
+            claimed = db.execute(f'''
+                UPDATE payment_orders SET status = 'pending', error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE order_key = ? AND (status IN ('queued', 'failed')
+                    OR (status = 'pending' AND updated_at < datetime('now', '-{self.stale_after} seconds')))
+            ''', (key,)).rowcount
+            db.commit()
+            if not claimed:
+                return
+            self._inflight.add(key)
+        data = {'amount': row['amount'], 'currency': row['currency'], 'receipt': row['receipt']}
+        self._executor.submit(self._create, key, data)
+
+    def _create(self, key, data):
+        error = None
+        attempts = 0
+        order = None
+        try:
+            for attempt in range(self.retries):
+                attempts = attempt + 1
+                try:
+                    order = self._client_getter().order.create(data=data, timeout=self.timeout)
+                    break
+                except Exception as e:
+                    error = f'{type(e).__name__}: {e}'
+                    if attempt + 1 < self.retries:
+                        time.sleep(self.backoff * 2 ** attempt)
+            pool = self._pool_getter()
+            conn = pool.acquire()
+            try:
+                if order is not None:
+                    conn.execute("UPDATE payment_orders SET status = 'created', gateway_order_id = ?, attempts = attempts + ?, "
+                                 "error = NULL, updated_at = CURRENT_TIMESTAMP WHERE order_key = ?", (order['id'], attempts, key))
+                else:
+                    conn.execute("UPDATE payment_orders SET status = 'failed', attempts = attempts + ?, error = ?, "
+                                 "updated_at = CURRENT_TIMESTAMP WHERE order_key = ?", (attempts, error, key))
+                conn.commit()
+            finally:
+                pool.release(conn)
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+
+
+class FakeGateway:
+    """Local stand-in for razorpay.Client with configurable latency and
+    failure rate. Only the order.create() call used by checkout is provided;
+    payments are signed with SECRET."""
+
+    SECRET = 'fake_secret'
+
+    def __init__(self, latency=0.2, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.order = self
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create(self, data, **kwargs):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+            n = next(self._ids)
+        time.sleep(self.latency)
+        if fail:
+            raise ConnectionError('Simulated payment gateway failure')
+        return {'id': f'order_fake{n:010d}', 'entity': 'order', 'amount': data['amount'],
+                'currency': data.get('currency', 'INR'), 'receipt': data.get('receipt'), 'status': 'created'}
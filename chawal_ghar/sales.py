@@ -0,0 +1,157 @@
+"""Sales summaries for the farmer dashboard.
+
+product_sales, farmer_sales and farmer_sales_daily hold per-status order
+counts, units and revenue. Triggers on orders keep them current (see
+migrations/0009_sales_summaries.sql); rebuild() recomputes them from
+scratch, archived orders included, and verify() checks them against a full
+recompute.
+
+    python sales.py [database.db] [--rebuild] [--check]
+"""
+import sqlite3
+import sys
+
+import archive
+import catalog
+import migrate_db
+
+DATABASE = 'database.db'
+DAILY_DAYS = 30
+RECENT_ORDERS = 20
+
+# Full recomputes from orders, selecting each summary table's columns in order.
+RECOMPUTE = {
+    'product_sales': '''
+        SELECT orders.p_id, products.f_id, COALESCE(o_status, '') AS o_status, COUNT(*) AS orders,
+               SUM(COALESCE(o_quantity, 0)) AS units, SUM(o_amount) AS revenue
+        FROM all_orders AS orders JOIN products ON orders.p_id = products.p_id
+        GROUP BY orders.p_id, COALESCE(o_status, '')
+    ''',
+    'farmer_sales': '''
+        SELECT products.f_id, COALESCE(o_status, '') AS o_status, COUNT(*) AS orders,
+               SUM(COALESCE(o_quantity, 0)) AS units, SUM(o_amount) AS revenue
+        FROM all_orders AS orders JOIN products ON orders.p_id = products.p_id
+        GROUP BY products.f_id, COALESCE(o_status, '')
+    ''',
+    'farmer_sales_daily': '''
+        SELECT products.f_id, date(o_date) AS day, COALESCE(o_status, '') AS o_status, COUNT(*) AS orders,
+               SUM(COALESCE(o_quantity, 0)) AS units, SUM(o_amount) AS revenue
+        FROM all_orders AS orders JOIN products ON orders.p_id = products.p_id
+        GROUP BY products.f_id, date(o_date), COALESCE(o_status, '')
+    ''',
+}
+KEYS = {'product_sales': ('p_id', 'o_status'), 'farmer_sales': ('f_id', 'o_status'),
+        'farmer_sales_daily': ('f_id', 'day', 'o_status')}
+
+
+def farmer_totals(db, f_id):
+    """{'orders', 'units', 'revenue', 'by_status': {status: orders}} for a farmer."""
+    rows = db.execute('SELECT o_status, orders, units, revenue FROM farmer_sales WHERE f_id = ? ORDER BY o_status',
+                      (f_id,)).fetchall()
+    return {'orders': sum(r['orders'] for r in rows), 'units': sum(r['units'] for r in rows),
+            'revenue': round(sum(r['revenue'] for r in rows), 2),
+            'by_status': {r['o_status']: r['orders'] for r in rows}}
+
+
+def product_totals(db, f_id):
+    """{p_id: {'orders', 'units', 'revenue'}} over all statuses for a farmer's products."""
+    rows = db.execute('''
+        SELECT p_id, SUM(orders) AS orders, SUM(units) AS units, ROUND(SUM(revenue), 2) AS revenue
+        FROM product_sales WHERE f_id = ? GROUP BY p_id
+    ''', (f_id,)).fetchall()
+    return {r['p_id']: dict(r) for r in rows}
+
+
+def daily_sales(db, f_id, days=DAILY_DAYS):
+    """Orders, units and revenue per day for the last `days` days, oldest
+    first, with zero rows for days without sales."""
+    rows = db.execute('''
+        WITH RECURSIVE days(day) AS (
+            SELECT date('now', ?) UNION ALL SELECT date(day, '+1 day') FROM days WHERE day < date('now')
+        )
+        SELECT days.day, COALESCE(SUM(s.orders), 0) AS orders, COALESCE(SUM(s.units), 0) AS units,
+               ROUND(COALESCE(SUM(s.revenue), 0), 2) AS revenue
+        FROM days LEFT JOIN farmer_sales_daily s ON s.f_id = ? AND s.day = days.day
+        GROUP BY days.day ORDER BY days.day
+    ''', (f'-{days - 1} days', f_id)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def order_page(db, f_id, cursor=None, limit=RECENT_ORDERS):
+    """One page of orders for a farmer's products, newest first, plus the
+    next-page cursor (see catalog.order_page)."""
+    where = 'farmer_orders.f_id = ?'
+    params = [f_id]
+    after = catalog.decode_cursor(cursor)
+    if after and len(after) == 1:
+        where += ' AND farmer_orders.o_id < ?'
+        params.extend(after)
+    # Walks the farmer's entries in farmer_orders (migrations/0017_farmer_orders.sql)
+    # newest first, looking each order up by its key.
+    rows = archive.newest_first(db, 'orders', f'''
+        SELECT orders.*, products.p_name, customers.c_firstname, customers.c_lastname
+        FROM farmer_orders
+        JOIN {{table}} AS orders ON orders.o_id = farmer_orders.o_id
+        JOIN products ON orders.p_id = products.p_id
+        JOIN customers ON orders.c_id = customers.c_id
+        WHERE {where}
+        ORDER BY farmer_orders.o_id DESC
+        LIMIT ?
+    ''', params, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = catalog.encode_cursor([rows[-1]['o_id']])
+    return rows, next_cursor
+
+
+def rebuild(conn):
+    """Recompute every summary table from orders in one transaction."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table, sql in RECOMPUTE.items():
+            conn.execute(f'DELETE FROM {table}')
+            conn.execute(f'INSERT INTO {table} {sql}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def verify(conn):
+    """Differences between each summary table and a full recompute, as
+    {table: [(key, stored, expected)]}; empty lists mean consistent."""
+    problems = {}
+    for table, sql in RECOMPUTE.items():
+        key_columns = KEYS[table]
+
+        def load(query):
+            return {tuple(row[c] for c in key_columns): (row['orders'], row['units'], round(row['revenue'], 2))
+                    for row in conn.execute(query)}
+
+        stored = load(f'SELECT * FROM {table}')
+        expected = load(sql)
+        problems[table] = [(key, stored.get(key), expected.get(key))
+                           for key in sorted(stored.keys() | expected.keys())
+                           if stored.get(key) != expected.get(key)]
+    return problems
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    conn = sqlite3.connect(args[0] if args else DATABASE, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    migrate_db.migrate(conn)
+    if '--rebuild' in sys.argv:
+        rebuild(conn)
+        print('Sales summaries rebuilt from orders.')
+    if '--check' in sys.argv or '--rebuild' not in sys.argv:
+        problems = verify(conn)
+        for table, rows in problems.items():
+            print(f'{table}: {"OK" if not rows else f"{len(rows)} mismatched rows"}')
+            for key, stored, expected in rows[:10]:
+                print(f'    {key}: stored {stored}, expected {expected}')
+        conn.close()
+        sys.exit(1 if any(problems.values()) else 0)
+    conn.close()
@@ -1,3 +1,25 @@
+-- Objects created by migrations/ go first, so a re-initialised database
+-- replays every migration from scratch; triggers and indexes go with
+-- their tables.
+DROP VIEW IF EXISTS all_orders;
+DROP TABLE IF EXISTS product_search;
+DROP TABLE IF EXISTS product_search_vocab;
+DROP TABLE IF EXISTS customer_search;
+DROP TABLE IF EXISTS farmer_search;
+DROP TABLE IF EXISTS payment_orders;
+DROP TABLE IF EXISTS cache_versions;
+DROP TABLE IF EXISTS product_sales;
+DROP TABLE IF EXISTS farmer_sales;
+DROP TABLE IF EXISTS farmer_sales_daily;
+DROP TABLE IF EXISTS outbox;
+DROP TABLE IF EXISTS farmer_notifications;
+DROP TABLE IF EXISTS orders_archive;
+DROP TABLE IF EXISTS payments_archive;
+DROP TABLE IF EXISTS archive_bounds;
+DROP TABLE IF EXISTS data_versions;
+DROP TABLE IF EXISTS events;
+DROP TABLE IF EXISTS farmer_orders;
+
 DROP TABLE IF EXISTS admins;
 DROP TABLE IF EXISTS farmers;
 DROP TABLE IF EXISTS customers;
@@ -5,6 +27,7 @@ DROP TABLE IF EXISTS products;
 DROP TABLE IF EXISTS orders;
 DROP TABLE IF EXISTS payments;
 DROP TABLE IF EXISTS cart;
+DROP TABLE IF EXISTS schema_version;
 
 CREATE TABLE cart (
     cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -0,0 +1,190 @@
+"""Synthetic datasets for load testing (see loadtest.py).
+
+Builds a fresh database at a given scale: farmers, customers, an admin,
+products spread over the eight rice varieties, open carts, and a year (or
+--days) of orders with their payments. Rows come from a seeded random
+generator, so the same arguments always give the same data. They are loaded
+in chunks through TEMP staging tables (see product_import.py for why), with
+every migration and trigger in place, so the sales summaries and search
+indexes match what the app would have built itself.
+
+    python seed.py bench.db [--scale small|medium|large] [--orders N] ... [--days 365] [--force]
+
+Every account's password is 'bench'; login names are admin, farmer1..N and
+customer1..N.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import catalog
+import checkout_engine
+import db_pool
+import migrate_db
+
+CHUNK_SIZE = 5000
+PASSWORD = 'bench'
+
+SCALES = {
+    'small': {'farmers': 20, 'customers': 500, 'products': 400, 'carts': 100, 'orders': 5000},
+    'medium': {'farmers': 200, 'customers': 10000, 'products': 4000, 'carts': 1000, 'orders': 100000},
+    'large': {'farmers': 2000, 'customers': 100000, 'products': 40000, 'carts': 10000, 'orders': 1000000},
+}
+
+FIRST_NAMES = ['Aarav', 'Ananya', 'Arjun', 'Divya', 'Farhan', 'Gita', 'Harish', 'Isha', 'Karthik', 'Lakshmi',
+               'Manoj', 'Meera', 'Naveen', 'Pooja', 'Rahul', 'Rekha', 'Sanjay', 'Sunita', 'Vikram', 'Zoya']
+LAST_NAMES = ['Patel', 'Sharma', 'Reddy', 'Iyer', 'Nair', 'Singh', 'Das', 'Gupta', 'Rao', 'Khan',
+              'Menon', 'Pillai', 'Joshi', 'Bose', 'Kulkarni', 'Yadav', 'Chopra', 'Mehta', 'Naidu', 'Verma']
+CITIES = ['Pune', 'Nashik', 'Chennai', 'Hyderabad', 'Kolkata', 'Lucknow', 'Mysuru', 'Guntur', 'Patna', 'Thanjavur']
+GRADES = ['Premium', 'Organic', 'Aged', 'Classic', 'Select', 'Farm Fresh', 'Hand Pounded', 'Export Quality']
+# Typical price per kg for each variety; listings vary around it.
+BASE_PRICES = {'Basmati': 110, 'Kolam': 55, 'Sona Masoori': 60, 'Jasmine': 95,
+               'Brown': 80, 'Red': 90, 'Black': 160, 'Ponni': 58}
+ORDER_STATUSES = (['Confirmed'] * 6) + (['Delivered'] * 3) + ['Cancelled']
+
+
+def _load(conn, table, columns, rows, chunk_size=CHUNK_SIZE):
+    """Insert rows into table in chunked transactions through a TEMP
+    staging table, so its triggers run once per chunk-sized statement."""
+    names = ', '.join(columns)
+    conn.execute(f'DROP TABLE IF EXISTS temp.seed_{table}')
+    conn.execute(f'CREATE TEMP TABLE seed_{table} ({names})')
+    count, chunk = 0, []
+
+    def flush():
+        conn.executemany(f'INSERT INTO temp.seed_{table} VALUES ({", ".join("?" * len(columns))})', chunk)
+        conn.execute(f'INSERT INTO {table} ({names}) SELECT {names} FROM temp.seed_{table}')
+        conn.execute(f'DELETE FROM temp.seed_{table}')
+        conn.commit()
+        chunk.clear()
+
+    for row in rows:
+        chunk.append(row)
+        count += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    conn.execute(f'DROP TABLE temp.seed_{table}')
+    return count
+
+
+def _people(rng, prefix, count, password):
+    for i in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield (first, last, f'{prefix}{i}', password, rng.choice(['Male', 'Female']),
+               f'9{rng.randrange(10 ** 9):09d}', f'{prefix}{i}@example.com',
+               f'{rng.randrange(1, 400)} Main Road, {rng.choice(CITIES)}')
+
+
+def _products(rng, count, farmers):
+    for i in range(count):
+        p_type = catalog.RICE_TYPES[i % len(catalog.RICE_TYPES)]
+        sold_out = rng.random() < 0.05
+        yield (rng.randrange(1, farmers + 1), f'{rng.choice(GRADES)} {p_type}', p_type,
+               0 if sold_out else rng.randrange(50, 5000), 'Sold Out' if sold_out else 'Available',
+               round(BASE_PRICES[p_type] * rng.uniform(0.8, 1.3), 2), f'B-{rng.randrange(2023, 2026)}-{i % 97 + 1:02d}')
+
+
+def _orders(rng, count, customers, prices, days=365):
+    """count orders spread evenly over the last `days` days, oldest first, so
+    o_id order matches date order as it does in the live app. Popular
+    products get most of the orders."""
+    start = datetime.now() - timedelta(days=days)
+    step = days * 86400 / max(count, 1)
+    p_ids = list(prices)
+    for i in range(count):
+        p_id = p_ids[min(int(rng.paretovariate(1.2)) - 1, len(p_ids) - 1) if rng.random() < 0.5
+                     else rng.randrange(len(p_ids))]
+        quantity = rng.randrange(1, 26)
+        o_date = start + timedelta(seconds=i * step + rng.uniform(0, step))
+        yield (rng.randrange(1, customers + 1), p_id, o_date.strftime('%Y-%m-%d %H:%M:%S'), rng.choice(ORDER_STATUSES),
+               f'{rng.randrange(1, 400)} Market Street, {rng.choice(CITIES)}', round(quantity * prices[p_id], 2), quantity)
+
+
+def _carts(rng, count, customers, available):
+    for c_id in rng.sample(range(1, customers + 1), min(count, customers)):
+        for p_id in rng.sample(available, min(rng.randrange(1, 7), len(available))):
+            yield (c_id, p_id, rng.randrange(1, 11))
+
+
+def seed(path, farmers, customers, products, carts, orders, seed=1, days=365, chunk_size=CHUNK_SIZE):
+    """Create a database at path (which must not exist) and fill it. Returns
+    {table: rows inserted}."""
+    rng = random.Random(seed)
+    password = generate_password_hash(PASSWORD)
+    conn = db_pool.connect(path)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as f:
+        conn.executescript(f.read())
+    migrate_db.migrate(conn)
+
+    counts = {}
+    conn.execute("INSERT INTO admins (a_firstname, a_lastname, a_loginname, a_password) VALUES ('Bench', 'Admin', 'admin', ?)",
+                 (password,))
+    conn.commit()
+    counts['admins'] = 1
+    person = ['firstname', 'lastname', 'loginname', 'password', 'gender', 'contact', 'email', 'address']
+    counts['farmers'] = _load(conn, 'farmers', [f'f_{c}' for c in person], _people(rng, 'farmer', farmers, password), chunk_size)
+    counts['customers'] = _load(conn, 'customers', [f'c_{c}' for c in person],
+                                _people(rng, 'customer', customers, password), chunk_size)
+    counts['products'] = _load(conn, 'products', ['f_id', 'p_name', 'p_type', 'p_quantity', 'p_status', 'p_priceperunit', 'p_batch'],
+                               _products(rng, products, farmers), chunk_size)
+
+    listings = conn.execute('SELECT p_id, p_priceperunit, p_status FROM products ORDER BY p_id').fetchall()
+    prices = {row['p_id']: row['p_priceperunit'] for row in listings}
+    available = [row['p_id'] for row in listings if row['p_status'] == 'Available']
+    counts['cart'] = _load(conn, 'cart', ['c_id', 'p_id', 'quantity'], _carts(rng, carts, customers, available), chunk_size)
+    counts['orders'] = _load(conn, 'orders', ['c_id', 'p_id', 'o_date', 'o_status', 'o_destination', 'o_amount', 'o_quantity'],
+                             _orders(rng, orders, customers, prices, days), chunk_size)
+
+    # One payment per order, as checkout_engine records them.
+    conn.execute('''
+        INSERT INTO payments (o_id, c_id, p_amount, p_date, p_method, p_status, gateway_payment_id)
+        SELECT o_id, c_id, o_amount, o_date, ?, CASE o_status WHEN 'Cancelled' THEN 'Refunded' ELSE 'Completed' END,
+               'pay_seed' || o_id
+        FROM orders
+    ''', (checkout_engine.PAYMENT_METHOD,))
+    conn.commit()
+    counts['payments'] = counts['orders']
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    for table in SCALES['small']:
+        parser.add_argument(f'--{table}', type=int, help=f'overrides the scale (default {SCALES["medium"][table]} for medium)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--days', type=int, default=365, help='days of order history')
+    parser.add_argument('--force', action='store_true', help='replace an existing database file')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        if not args.force:
+            sys.exit(f'{args.database} already exists; pass --force to replace it.')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+    sizes = {table: getattr(args, table) if getattr(args, table) is not None else default
+             for table, default in SCALES[args.scale].items()}
+    start = time.perf_counter()
+    try:
+        counts = seed(args.database, seed=args.seed, days=args.days, **sizes)
+    except sqlite3.Error as e:
+        sys.exit(f'Seeding failed: {e}')
+    print(', '.join(f'{n} {table}' for table, n in counts.items()))
+    print(f'{args.database}: {os.path.getsize(args.database) / 2 ** 20:.1f} MB in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
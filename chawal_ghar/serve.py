@@ -0,0 +1,226 @@
+"""Production server: preforked worker processes, each with a bounded pool
+of request threads.
+
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N] [--threads 8]
+
+The parent process imports the app, runs warm_up() (migrations, templates,
+URL map, static file hashes) and opens the listening socket once, then forks
+the workers, which share the socket and inherit the warmed-up state. A
+worker that dies is replaced. SIGTERM or SIGINT stops accepting connections,
+lets requests in flight finish for up to --graceful-timeout seconds, shuts
+down the event hub and the payment, credential and outbox worker pools and
+exits.
+
+Requests for the live event stream (events.PATH) are answered here rather
+than by werkzeug: after the response headers the connection is handed to
+the worker's event hub, which writes to all open streams from one thread,
+so a browser keeping a dashboard open does not hold a request thread.
+
+Settings come from the environment as for app.py (DATABASE, SECRET_KEY, ...),
+except that with more than one worker CATALOG_CACHE_SHARED is always on, so
+a change made through one worker invalidates the catalog pages cached by the
+others. Where fork() is not available a single worker runs in this process.
+
+Each worker keeps its own metrics, and /metrics answers with those of the
+worker that accepted the connection, so consecutive scrapes can come from
+different processes; the chawal_process_id gauge says which. Run a single
+worker where one complete set of counters is needed.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import app as chawal_app
+import events
+
+log = logging.getLogger('serve')
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Idle keep-alive connections are closed after this many seconds, so they
+    # do not hold on to request threads.
+    timeout = 5
+    access_log = False
+
+    def log_request(self, code='-', size='-'):
+        if self.access_log:
+            super().log_request(code, size)
+
+    def run_wsgi(self):
+        if self.path.partition('?')[0] != events.PATH:
+            return super().run_wsgi()
+        # The app returns the stream's headers and an empty body, and passes
+        # the function that takes over the socket to chawal.attach_stream.
+        attach = []
+        self.environ = environ = self.make_environ()
+        environ['chawal.attach_stream'] = attach.append
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, headers]
+        body = self.server.app(environ, start_response)
+        try:
+            data = b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        status, headers = response
+        code, _, message = status.partition(' ')
+        streaming = attach and code == '200'
+        self.send_response(int(code), message)
+        for key, value in headers:
+            if not (streaming and key.lower() == 'content-length'):
+                self.send_header(key, value)
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        if not streaming:
+            self.wfile.write(data)
+            return
+        self.wfile.flush()
+        attach[0](socket.socket(fileno=self.connection.detach()))
+
+
+class WorkerServer(BaseWSGIServer):
+    """Werkzeug's WSGI server with connections handled on a fixed pool of
+    threads instead of a new thread per connection."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd, multiprocess):
+        self.multiprocess = multiprocess
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Wait for requests in flight, after serve_forever() has returned."""
+        self._executor.shutdown(wait=True)
+
+
+def _stop_services(flask_app):
+    for name in ('event_hub', 'payment_orders', 'credentials', 'outbox'):
+        service = flask_app.extensions.get(name)
+        if service is not None:
+            service.shutdown(wait=True)
+    pool = flask_app.extensions.get('db_pool')
+    if pool is not None:
+        pool.close_all()
+
+
+def run_worker(flask_app, sock, threads, graceful_timeout, multiprocess):
+    server = WorkerServer(*sock.getsockname()[:2], flask_app, threads, sock.fileno(), multiprocess)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it cannot be
+        # called from the signal handler running on the serving thread.
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    server.serve_forever()
+    # Whatever is still running after the grace period is cut off.
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    signal.alarm(max(1, int(graceful_timeout)))
+    server.drain()
+    _stop_services(flask_app)
+    signal.alarm(0)
+
+
+def _spawn(flask_app, sock, threads, graceful_timeout):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(flask_app, sock, threads, graceful_timeout, multiprocess=True)
+        except BaseException:
+            log.exception('Worker %d failed', os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(host, port, workers, threads, graceful_timeout=30, flask_app=None):
+    forking = workers > 1 and hasattr(os, 'fork')
+    flask_app = flask_app or chawal_app.create_app()
+    if forking:
+        flask_app.config['CATALOG_CACHE_SHARED'] = True
+    start = time.perf_counter()
+    chawal_app.warm_up(flask_app)
+    log.info('Warmed up in %.0f ms', (time.perf_counter() - start) * 1000)
+
+    sock = socket.create_server((host, port), backlog=1024)
+    # Every worker is woken for each new connection. Non-blocking, the ones
+    # that lose the race for accept() get EAGAIN and go back to waiting
+    # instead of blocking in accept(), where they would not notice SIGTERM.
+    sock.setblocking(False)
+    if not forking:
+        log.info('Serving on http://%s:%d with %d threads', host, port, threads)
+        run_worker(flask_app, sock, threads, graceful_timeout, multiprocess=False)
+        return
+
+    children = {_spawn(flask_app, sock, threads, graceful_timeout) for _ in range(workers)}
+    log.info('Serving on http://%s:%d with %d workers x %d threads', host, port, workers, threads)
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            log.info('Stopping %d workers', len(children))
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            log.warning('Worker %d exited with status %d; starting a new one', pid, os.waitstatus_to_exitcode(status))
+            children.add(_spawn(flask_app, sock, threads, graceful_timeout))
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default=os.environ.get('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('WEB_THREADS', 8)),
+                        help='request threads per worker; match DATABASE_POOL_SIZE')
+    parser.add_argument('--graceful-timeout', type=float, default=30)
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(process)d %(levelname)s %(name)s: %(message)s')
+    RequestHandler.access_log = args.access_log
+    serve(args.host, args.port, args.workers, args.threads, args.graceful_timeout)
+
+
+if __name__ == '__main__':
+    main()
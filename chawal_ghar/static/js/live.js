@@ -0,0 +1,52 @@
+// Live updates for the dashboards and product pages, from the event stream
+// whose URL is in this script tag's data-events (see events.py).
+//
+// stock: elements marked data-stock / data-status / data-stock-max with the
+//        product id get its new quantity, status or input maximum, and a
+//        data-listing card is removed once the product is no longer Available.
+// order: the order's row is replaced, or added to the top of the
+//        data-orders table (only on the first, unfiltered page).
+(function () {
+    var script = document.currentScript;
+    if (!script || !window.EventSource) {
+        return;
+    }
+    var source = new EventSource(script.dataset.events);
+
+    function each(selector, fn) {
+        Array.prototype.forEach.call(document.querySelectorAll(selector), fn);
+    }
+
+    source.addEventListener('stock', function (e) {
+        var stock = JSON.parse(e.data);
+        var id = '"' + stock.p_id + '"';
+        each('[data-stock=' + id + ']', function (el) { el.textContent = stock.p_quantity; });
+        each('[data-status=' + id + ']', function (el) { el.textContent = stock.p_status; });
+        each('input[data-stock-max=' + id + ']', function (el) {
+            el.max = stock.p_quantity;
+            if (parseFloat(el.value) > stock.p_quantity) {
+                el.value = stock.p_quantity;
+                el.dispatchEvent(new Event('input'));
+            }
+        });
+        if (stock.p_status !== 'Available') {
+            each('[data-listing=' + id + ']', function (el) { el.remove(); });
+        }
+    });
+
+    source.addEventListener('order', function (e) {
+        var order = JSON.parse(e.data);
+        var template = document.createElement('template');
+        template.innerHTML = '<table><tbody>' + order.html + '</tbody></table>';
+        var row = template.content.querySelector('tr');
+        var current = document.querySelector('tr[data-o-id="' + order.o_id + '"]');
+        if (current) {
+            current.replaceWith(row);
+            return;
+        }
+        var table = document.querySelector('[data-orders]');
+        if (table) {
+            table.insertBefore(row, table.firstChild);
+        }
+    });
+})();
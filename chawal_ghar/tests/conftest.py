@@ -0,0 +1,84 @@
+"""Fixtures shared by the tests: a fresh database per test, built from
+schema.sql and every migration, and an application on it.
+
+    cd chawal_ghar && python -m pytest tests
+"""
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HERE)
+
+import app as chawal_app  # noqa: E402
+import catalog  # noqa: E402
+import db_pool  # noqa: E402
+import migrate_db  # noqa: E402
+
+# The test app's settings: the fake payment gateway without its latency, and
+# no outbox or event hub threads; tests that need them run them explicitly.
+TEST_CONFIG = {'PAYMENT_GATEWAY': 'fake', 'PAYMENT_FAKE_LATENCY': 0, 'OUTBOX_WORKERS': 0, 'EVENTS': False,
+               'TEMPLATE_CACHE': False}
+
+
+def make_database(path, products=20, stock=1000, price=80.0):
+    """A database with the current schema, farmer 1, customer 1 and
+    products 1..products of farmer 1, each with stock kg at price per kg."""
+    conn = sqlite3.connect(path)
+    with open(os.path.join(HERE, 'schema.sql')) as f:
+        conn.executescript(f.read())
+    migrate_db.migrate(conn)
+    conn.execute("INSERT INTO farmers (f_firstname, f_lastname, f_loginname, f_password) VALUES ('Test', 'Farmer', 'farmer', 'x')")
+    conn.execute("INSERT INTO customers (c_firstname, c_lastname, c_loginname, c_password) VALUES ('Test', 'Customer', 'customer', 'x')")
+    conn.executemany("INSERT INTO products (f_id, p_name, p_type, p_quantity, p_status, p_priceperunit, p_batch) "
+                     "VALUES (1, ?, ?, ?, 'Available', ?, 'T1')",
+                     [(f'Rice {i}', catalog.RICE_TYPES[i % len(catalog.RICE_TYPES)], stock, price) for i in range(products)])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'test.db')
+    make_database(path)
+    return path
+
+
+@pytest.fixture
+def shipped_database(tmp_path):
+    """A copy of the database.db that ships with the app."""
+    path = str(tmp_path / 'shipped.db')
+    shutil.copyfile(os.path.join(HERE, 'database.db'), path)
+    return path
+
+
+@pytest.fixture
+def db(database):
+    conn = db_pool.connect(database)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def app(database):
+    flask_app = chawal_app.create_app(dict(TEST_CONFIG, DATABASE=database))
+    yield flask_app
+    for name in ('outbox', 'payment_orders', 'event_hub', 'credentials'):
+        service = flask_app.extensions.pop(name, None)
+        if service is not None:
+            service.shutdown()
+    pool = flask_app.extensions.pop('db_pool', None)
+    if pool is not None:
+        pool.close_all()
+
+
+@pytest.fixture
+def customer(app):
+    """A test client logged in as customer 1."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, role='customer', fullname='Test Customer')
+    return client
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+import archive
+import checkout_engine
+import db_pool
+
+
+def stock(db, p_id):
+    return db.execute('SELECT p_quantity, p_status FROM products WHERE p_id = ?', (p_id,)).fetchone()
+
+
+def test_parallel_buyers_never_oversell(database, db):
+    buyers, stock_kg, threads = 60, 25, 8
+    db.execute("UPDATE products SET p_quantity = ? WHERE p_id = 1", (stock_kg,))
+    db.executemany("INSERT INTO customers (c_firstname, c_lastname, c_loginname, c_password) VALUES ('Buyer', ?, ?, 'x')",
+                   [(str(i), f'buyer{i}') for i in range(buyers)])
+    db.commit()
+    first_c_id = db.execute("SELECT MIN(c_id) FROM customers WHERE c_firstname = 'Buyer'").fetchone()[0]
+
+    pool = db_pool.ConnectionPool(database, max_size=threads)
+    results, replays, lock = [], [], threading.Lock()
+    next_buyer = iter(range(buyers))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_buyer, None)
+            if i is None:
+                return
+            conn = pool.acquire()
+            try:
+                o_ids = checkout_engine.buy_now(conn, first_c_id + i, 1, 1, 'Stress', payment_id=f'pay_{i}')
+                # The same callback again must not place a second order.
+                if i % 5 == 0:
+                    replays.append(checkout_engine.buy_now(conn, first_c_id + i, 1, 1, 'Stress', payment_id=f'pay_{i}') == o_ids)
+                result = 'placed'
+            except checkout_engine.InsufficientStock:
+                result = 'rejected'
+            finally:
+                pool.release(conn)
+            with lock:
+                results.append(result)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    pool.close_all()
+
+    assert results.count('placed') == stock_kg
+    assert results.count('rejected') == buyers - stock_kg
+    assert all(replays)
+    assert db.execute('SELECT COUNT(*) FROM orders WHERE p_id = 1').fetchone()[0] == stock_kg
+    assert db.execute("SELECT COUNT(*) FROM payments WHERE gateway_payment_id LIKE 'pay_%'").fetchone()[0] == stock_kg
+    assert tuple(stock(db, 1)) == (0, 'Sold Out')
+
+
+def test_cart_checkout_is_all_or_nothing(db):
+    db.execute('UPDATE products SET p_quantity = 3 WHERE p_id = 2')
+    db.executemany('INSERT INTO cart (c_id, p_id, quantity) VALUES (1, ?, ?)', [(1, 2), (2, 5)])
+    db.commit()
+
+    with pytest.raises(checkout_engine.InsufficientStock) as raised:
+        checkout_engine.checkout_cart(db, 1, 'Home', payment_id='pay_cart')
+    assert raised.value.p_id == 2 and raised.value.available == 3
+    assert stock(db, 1)['p_quantity'] == 1000
+    assert db.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 0
+    assert db.execute('SELECT COUNT(*) FROM cart WHERE c_id = 1').fetchone()[0] == 2
+
+    db.execute('UPDATE cart SET quantity = 3 WHERE p_id = 2')
+    db.commit()
+    o_ids = checkout_engine.checkout_cart(db, 1, 'Home', payment_id='pay_cart')
+    assert len(o_ids) == 2
+    assert tuple(stock(db, 2)) == (0, 'Sold Out')
+    assert db.execute('SELECT COUNT(*) FROM cart WHERE c_id = 1').fetchone()[0] == 0
+    assert db.execute('SELECT SUM(p_amount) FROM payments').fetchone()[0] == 5 * 80.0
+
+
+def test_replayed_callback_for_an_archived_payment_places_nothing(db):
+    o_ids = checkout_engine.buy_now(db, 1, 1, 2, 'Home', payment_id='pay_old')
+    db.execute("UPDATE orders SET o_date = datetime('now', '-400 days')")
+    db.execute("UPDATE payments SET p_date = datetime('now', '-400 days')")
+    db.commit()
+    assert archive.archive_orders(db, days=365) == 1
+    assert db.execute('SELECT COUNT(*) FROM payments').fetchone()[0] == 0
+
+    assert checkout_engine.buy_now(db, 1, 1, 2, 'Home', payment_id='pay_old') == o_ids
+    assert stock(db, 1)['p_quantity'] == 998
+    assert db.execute('SELECT COUNT(*) FROM orders').fetchone()[0] == 0
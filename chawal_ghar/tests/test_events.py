@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+import db_pool
+import events
+
+
+@pytest.fixture
+def start_hub(database):
+    pool = db_pool.ConnectionPool(database)
+    hubs = []
+
+    def start(**options):
+        hub = events.EventHub(lambda: pool, poll_interval=0.05, **options)
+        hub.start()
+        hubs.append(hub)
+        return hub
+    yield start
+    for hub in hubs:
+        hub.shutdown()
+    pool.close_all()
+
+
+def publish_stock(db, hub, quantities):
+    for quantity in quantities:
+        events.publish(db, 'products', 'stock', {'p_id': 1, 'p_quantity': quantity, 'p_status': 'Available'})
+    db.commit()
+    hub.wake()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_slow_stream_is_closed_and_others_keep_going(start_hub, db):
+    hub = start_hub(max_buffer=4096)
+    slow, fast = hub.stream(['products']), hub.stream(['products'])
+    assert next(slow).startswith(b'retry:') and next(fast).startswith(b'retry:')
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(fast), daemon=True)
+    reader.start()
+
+    # Small bursts the fast reader keeps up with; nothing reads slow.
+    for start in range(0, 200, 5):
+        publish_stock(db, hub, range(start, start + 5))
+        wait_for(lambda: b''.join(received).count(b'event: stock') == start + 5)
+
+    # Closing ends slow's iteration after what was queued before.
+    backlog = b''.join(slow)
+    assert 0 < backlog.count(b'event: stock') < 200
+    assert hub.stats()['streams'] == 1 and hub.stats()['closed'] == 1
+
+    hub.shutdown()
+    reader.join(5)
+    assert not reader.is_alive()
+
+
+def test_stream_sends_only_its_channels(start_hub, db):
+    hub = start_hub()
+    mine = hub.stream(['c1'])
+    assert next(mine).startswith(b'retry:')
+    events.publish(db, 'c2', 'order', {'o_id': 1})
+    events.publish(db, 'c1', 'order', {'o_id': 2})
+    db.commit()
+    hub.wake()
+    assert b'"o_id":2' in next(mine)
+
+
+def test_reconnect_catches_up_from_last_event_id(start_hub, db):
+    publish_stock(db, start_hub(), range(3))
+    first = db.execute('SELECT MIN(event_id) FROM events').fetchone()[0]
+    hub = start_hub()
+    stream = hub.stream(['products'], last_event_id=str(first))
+    data = b''
+    while data.count(b'event: stock') < 2:
+        data += next(stream)
+    assert f'id: {first + 1}\n'.encode() in data and f'id: {first + 2}\n'.encode() in data
+    assert f'id: {first}\n'.encode() not in data
@@ -0,0 +1,30 @@
+import csv
+import io
+import json
+
+import pytest
+
+import exports
+
+
+def export(db, name, fmt):
+    return ''.join(exports.generate(db, name, fmt, {}))
+
+
+@pytest.mark.parametrize('prefix', exports.FORMULA_PREFIXES)
+def test_csv_cells_cannot_start_a_formula(db, prefix):
+    address = f'{prefix}HYPERLINK("http://example.com","x")'
+    db.execute('UPDATE customers SET c_address = ? WHERE c_id = 1', (address,))
+    db.commit()
+
+    rows = list(csv.DictReader(io.StringIO(export(db, 'customers', 'csv'), newline='')))
+    assert rows[0]['c_address'] == "'" + address
+
+
+def test_plain_values_and_ndjson_are_left_alone(db):
+    db.execute("UPDATE customers SET c_address = '=SUM(A1)', c_lastname = 'Rao' WHERE c_id = 1")
+    db.commit()
+
+    row = next(csv.DictReader(io.StringIO(export(db, 'customers', 'csv'), newline='')))
+    assert row['c_lastname'] == 'Rao'
+    assert json.loads(export(db, 'customers', 'ndjson').splitlines()[0])['c_address'] == '=SUM(A1)'
@@ -0,0 +1,60 @@
+import sqlite3
+
+import db_pool
+import migrate_db
+import seed
+
+FARMER_INDEXES = ('idx_products_status_farmer', 'idx_products_status_farmer_price', 'idx_products_status_farmer_quantity')
+
+
+def slow_queries(conn):
+    return {label: scans for label, scans in migrate_db.check_query_plans(conn).items() if scans}
+
+
+def test_migrations_apply_once(database):
+    conn = sqlite3.connect(database)
+    assert migrate_db.pending_migrations(conn) == []
+    assert migrate_db.migrate(conn) == []
+    conn.close()
+
+
+def test_hot_queries_use_indexes_on_a_fresh_database(database):
+    conn = sqlite3.connect(database)
+    assert slow_queries(conn) == {}
+    conn.close()
+
+
+def test_hot_queries_use_indexes_on_the_shipped_database(shipped_database):
+    conn = sqlite3.connect(shipped_database)
+    migrate_db.migrate(conn)
+    assert slow_queries(conn) == {}
+    conn.close()
+
+
+def test_hot_queries_use_indexes_on_a_seeded_database(tmp_path):
+    path = str(tmp_path / 'seeded.db')
+    seed.seed(path, **seed.SCALES['small'])
+    conn = sqlite3.connect(path)
+    assert slow_queries(conn) == {}
+    conn.close()
+
+
+def test_optimize_gives_new_indexes_statistics(tmp_path):
+    # A database analyzed before the farmer indexes existed: the planner
+    # guesses at them and sorts whole catalog pages until they have
+    # statistics too.
+    path = str(tmp_path / 'stale.db')
+    seed.seed(path, **seed.SCALES['small'])
+    conn = sqlite3.connect(path)
+    conn.execute(f"DELETE FROM sqlite_stat1 WHERE idx IN ({', '.join('?' * len(FARMER_INDEXES))})", FARMER_INDEXES)
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    assert slow_queries(conn)
+    db_pool.optimize(conn)
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    assert slow_queries(conn) == {}
+    conn.close()
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import time
+
+import db_pool
+import notifications
+import outbox
+from conftest import HERE
+
+
+def queue_notifications(db, count):
+    """count orders, each with a notify_farmers job. Returns their o_ids."""
+    db.executemany("INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount, o_quantity) "
+                   "VALUES (1, ?, 'Confirmed', 'Test', 160, 2)", [(i % 20 + 1,) for i in range(count)])
+    o_ids = [row[0] for row in db.execute('SELECT o_id FROM orders ORDER BY o_id')]
+    for o_id in o_ids:
+        outbox.enqueue(db, 'notify_farmers', {'o_ids': [o_id]})
+    db.commit()
+    return o_ids
+
+
+def notified(db):
+    return [row[0] for row in db.execute('SELECT o_id FROM farmer_notifications ORDER BY o_id')]
+
+
+def test_jobs_of_a_dead_worker_run_once_after_its_lease(database, db):
+    o_ids = queue_notifications(db, 30)
+    runs = []
+
+    def notify(conn, payload):
+        runs.extend(payload['o_ids'])
+        notifications.notify_farmers(conn, payload)
+
+    pool = db_pool.ConnectionPool(database)
+    dead = outbox.OutboxWorker(lambda: pool, {'notify_farmers': notify}, batch=10, lease=0.2)
+    conn = pool.acquire()
+    # Claims a batch, then stops before running it.
+    claimed = dead._claim(conn)
+    assert len(claimed) == 10
+
+    time.sleep(0.3)
+    worker = outbox.OutboxWorker(lambda: pool, {'notify_farmers': notify}, batch=10, lease=60)
+    assert worker.drain() == 30
+    assert notified(db) == o_ids
+    assert sorted(runs) == o_ids
+
+    # The dead worker waking up late must not finish jobs claimed again since.
+    dead._execute(conn, claimed[0])
+    pool.release(conn)
+    pool.close_all()
+    assert notified(db) == o_ids
+    assert db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] == 0
+
+
+def test_killed_worker_process_leaves_nothing_undone(database, db):
+    o_ids = queue_notifications(db, 400)
+    env = dict(os.environ, PAYMENT_GATEWAY='fake')
+    command = [sys.executable, 'outbox.py', database, '--lease', '0.5']
+    process = subprocess.Popen(command + ['--workers', '2'], env=env, cwd=HERE,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while len(notified(db)) < 100 and time.monotonic() < deadline:
+            assert process.poll() is None
+            time.sleep(0.005)
+    finally:
+        process.kill()
+        process.wait()
+
+    time.sleep(0.5)
+    subprocess.run(command + ['--drain'], env=env, cwd=HERE, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert db.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] == 0
+    assert notified(db) == o_ids
+
+
+def test_failing_job_is_retried_then_left_dead(database, db):
+    queue_notifications(db, 1)
+    pool = db_pool.ConnectionPool(database)
+
+    def fail(conn, payload):
+        conn.execute("INSERT INTO farmer_notifications (f_id, o_id, message) VALUES (1, 1, 'half done')")
+        raise RuntimeError('gateway down')
+
+    worker = outbox.OutboxWorker(lambda: pool, {'notify_farmers': fail}, max_attempts=2, backoff=0)
+    assert worker.drain() == 2
+    pool.close_all()
+    assert outbox.counts(db)['dead'] == 1
+    assert outbox.dead_jobs(db)[0]['error'] == 'RuntimeError: gateway down'
+    assert notified(db) == []
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+
+import app as chawal_app
+import payment_orders
+
+
+def ready(customer, key):
+    """The gateway order for key once the background worker has created it."""
+    for _ in range(100):
+        order = customer.get(f'/customer/payment/order/{key}').get_json()
+        if order.get('id'):
+            return order
+        time.sleep(0.02)
+    raise AssertionError(f'no gateway order for {key}')
+
+
+def cart_order(customer):
+    """Open the checkout page and return the gateway order it created."""
+    assert customer.get('/customer/checkout').status_code == 200
+    items = customer.get('/customer/cart/items').get_json()['items']
+    return ready(customer, payment_orders.cart_order_key(1, items, payment_orders.order_amount(items)))
+
+
+def signed(order, payment_id):
+    return {'razorpay_payment_id': payment_id, 'razorpay_order_id': order['id'],
+            'razorpay_signature': payment_orders.payment_signature(payment_orders.FakeGateway.SECRET, order['id'], payment_id)}
+
+
+def run_jobs(app):
+    with app.app_context():
+        chawal_app.get_outbox().drain()
+
+
+def orders(db):
+    return db.execute('SELECT o_id, p_id, o_quantity, o_amount FROM orders ORDER BY o_id').fetchall()
+
+
+def payment_statuses(db):
+    return [row[0] for row in db.execute('SELECT p_status FROM payments ORDER BY o_id')]
+
+
+def test_signed_cart_payment_places_the_cart(app, customer, db):
+    customer.post('/customer/add_to_cart/1', data={'quantity': '2'})
+    customer.post('/customer/add_to_cart/2', data={'quantity': '3'})
+    order = cart_order(customer)
+    assert order['amount'] == 5 * 8000
+
+    response = customer.post('/customer/payment/success',
+                             data=dict(signed(order, 'pay_1'), destination='Home', order_key=order['key']))
+    assert response.headers['Location'] == '/customer/dashboard'
+    assert [tuple(row[1:]) for row in orders(db)] == [(1, 2, 160.0), (2, 3, 240.0)]
+    run_jobs(app)
+    assert payment_statuses(db) == ['Completed', 'Completed']
+
+
+def test_payment_for_a_smaller_cart_is_rejected(app, customer, db):
+    customer.post('/customer/add_to_cart/1', data={'quantity': '1'})
+    order = cart_order(customer)
+    # The cart grows after the gateway order for 1 kg was paid.
+    db.execute('UPDATE cart SET quantity = 500 WHERE c_id = 1')
+    db.commit()
+
+    response = customer.post('/customer/payment/success',
+                             data=dict(signed(order, 'pay_1'), destination='Home', order_key=order['key']))
+    assert response.headers['Location'] == '/customer/cart'
+    assert orders(db) == []
+    assert db.execute('SELECT p_quantity FROM products WHERE p_id = 1').fetchone()[0] == 1000
+    assert db.execute('SELECT quantity FROM cart WHERE c_id = 1').fetchone()[0] == 500
+
+
+def test_gateway_order_is_used_once(app, customer, db):
+    customer.post('/customer/add_to_cart/1', data={'quantity': '1'})
+    order = cart_order(customer)
+    customer.post('/customer/payment/success', data=dict(signed(order, 'pay_1'), destination='Home', order_key=order['key']))
+    customer.post('/customer/add_to_cart/1', data={'quantity': '1'})
+
+    response = customer.post('/customer/payment/success',
+                             data=dict(signed(order, 'pay_2'), destination='Home', order_key=order['key']))
+    assert response.headers['Location'] == '/customer/cart'
+    assert len(orders(db)) == 1
+
+
+def test_buy_now_pays_for_the_quantity_chosen(app, customer, db):
+    order = ready(customer, customer.get('/customer/buy/1/payment?quantity=2.5').get_json()['key'])
+    assert order['amount'] == 20000
+
+    response = customer.post('/customer/buy/1', data=dict(signed(order, 'pay_1'), quantity='2.5',
+                                                           destination='Home', order_key=order['key']))
+    assert response.headers['Location'] == '/customer/dashboard'
+    assert [tuple(row[1:]) for row in orders(db)] == [(1, 2.5, 200.0)]
+    run_jobs(app)
+    assert payment_statuses(db) == ['Completed']
+
+
+def test_buy_now_rejects_a_payment_for_another_quantity(app, customer, db):
+    page = customer.get('/customer/buy/1')
+    assert page.status_code == 200
+    order = ready(customer, customer.get('/customer/buy/1/payment?quantity=1').get_json()['key'])
+
+    response = customer.post('/customer/buy/1', data=dict(signed(order, 'pay_1'), quantity='500',
+                                                           destination='Home', order_key=order['key']))
+    assert response.headers['Location'] == '/customer/buy/1?quantity=500'
+    assert orders(db) == []
+
+
+@pytest.mark.parametrize('quantity', ['abc', '', '0', '-1', 'nan', 'inf'])
+def test_buy_now_rejects_bad_quantities(customer, db, quantity):
+    response = customer.post('/customer/buy/1', data={'quantity': quantity, 'destination': 'Home', 'order_key': ''})
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/customer/buy/1'
+    assert customer.get(f'/customer/buy/1/payment?quantity={quantity}').status_code == 400
+    assert orders(db) == []
+
+
+def test_payment_is_unverified_unless_signed_for_the_amount(app, db):
+    db.execute("INSERT INTO orders (c_id, p_id, o_status, o_destination, o_amount, o_quantity) VALUES (1, 1, 'Confirmed', 'Home', 80, 1)")
+    db.execute("INSERT INTO payments (o_id, c_id, p_amount, p_status) VALUES (1, 1, 80, 'Completed')")
+    db.execute("INSERT INTO payment_orders (order_key, c_id, amount, currency, receipt, gateway_order_id, status) "
+               "VALUES ('k', 1, 8000, 'INR', 'r', 'order_1', 'paid')")
+    db.commit()
+    secret = payment_orders.FakeGateway.SECRET
+    payload = {'o_ids': [1], 'payment_id': 'pay_1', 'order_id': 'order_1', 'amount': 8000,
+               'signature': payment_orders.payment_signature(secret, 'order_1', 'pay_1')}
+
+    payment_orders.verify_payment(db, payload, secret)
+    assert payment_statuses(db) == ['Completed']
+    for changed in ({'amount': 800}, {'signature': 'forged'}, {'order_id': 'order_2'}):
+        payment_orders.verify_payment(db, dict(payload, **changed), secret)
+        assert payment_statuses(db) == ['Unverified']
+        db.execute("UPDATE payments SET p_status = 'Completed'")
@@ -0,0 +1,89 @@
+import random
+import threading
+
+import archive
+import checkout_engine
+import db_pool
+import sales
+
+
+def place_random_orders(database, threads=4, per_thread=50):
+    """Checkouts from several threads, each changing the status of some of
+    the orders it places."""
+    pool = db_pool.ConnectionPool(database, max_size=threads)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = pool.acquire()
+        try:
+            for _ in range(per_thread):
+                o_ids = checkout_engine.buy_now(conn, 1, rng.randint(1, 20), rng.randint(1, 20), 'Sales')
+                if rng.random() < 0.2:
+                    conn.execute('UPDATE orders SET o_status = ? WHERE o_id = ?',
+                                 (rng.choice(['Shipped', 'Delivered', 'Cancelled']), o_ids[0]))
+                    conn.commit()
+        finally:
+            pool.release(conn)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    pool.close_all()
+
+
+def spread_over_farmers(db, farmers=5):
+    db.executemany("INSERT INTO farmers (f_firstname, f_lastname, f_loginname, f_password) VALUES ('Farmer', ?, ?, 'x')",
+                   [(str(i), f'farmer{i}') for i in range(2, farmers + 1)])
+    db.execute('UPDATE products SET f_id = 1 + p_id % ?', (farmers,))
+    db.commit()
+
+
+def test_summaries_match_a_full_recompute(database, db):
+    spread_over_farmers(db)
+    place_random_orders(database)
+    # Back-dated, moved and removed orders change buckets or leave them.
+    db.execute("UPDATE orders SET o_date = datetime(o_date, '-' || (o_id % 30) || ' days') WHERE o_id % 3 = 0")
+    db.execute('UPDATE orders SET p_id = 1 + p_id % 20 WHERE o_id % 11 = 0')
+    db.execute('DELETE FROM payments WHERE o_id % 17 = 0')
+    db.execute('DELETE FROM orders WHERE o_id % 17 = 0')
+    db.commit()
+
+    assert sales.verify(db) == {table: [] for table in sales.RECOMPUTE}
+    assert sum(sales.farmer_totals(db, f_id)['orders'] for f_id in range(1, 6)) == \
+        db.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+
+def test_archiving_keeps_summaries_and_order_pages(database, db):
+    spread_over_farmers(db)
+    place_random_orders(database, threads=2, per_thread=40)
+    db.execute("UPDATE orders SET o_date = datetime('now', '-400 days') WHERE o_id <= 30")
+    db.commit()
+    assert archive.archive_orders(db, days=365) == 30
+
+    assert sales.verify(db) == {table: [] for table in sales.RECOMPUTE}
+    for f_id in range(1, 6):
+        expected = [row[0] for row in db.execute('''
+            SELECT orders.o_id FROM all_orders AS orders JOIN products ON orders.p_id = products.p_id
+            WHERE products.f_id = ? ORDER BY orders.o_id DESC
+        ''', (f_id,))]
+        paged, cursor = [], None
+        while True:
+            rows, cursor = sales.order_page(db, f_id, cursor, limit=7)
+            paged.extend(row['o_id'] for row in rows)
+            if cursor is None:
+                break
+        assert paged == expected
+
+
+def test_rebuild_restores_damaged_summaries(db):
+    checkout_engine.buy_now(db, 1, 1, 3, 'Sales')
+    db.execute('UPDATE farmer_sales SET revenue = 0')
+    db.execute('DELETE FROM product_sales')
+    db.commit()
+    assert any(sales.verify(db).values())
+
+    sales.rebuild(db)
+    assert sales.verify(db) == {table: [] for table in sales.RECOMPUTE}
+    assert sales.farmer_totals(db, 1)['revenue'] == 240.0
@@ -0,0 +1,112 @@
+"""Paginated, searchable customer and farmer lists for the admin pages.
+
+Pages are read with keyset cursors over the indexes in
+migrations/0010_user_directory.sql, only the listed columns are selected
+(never password hashes), and per-user counts for a page come from one
+grouped query over that page's ids.
+"""
+import catalog
+
+PAGE_SIZE = 50
+
+# Per role: table, id column, column prefix and full-text table.
+ROLES = {
+    'customers': {'table': 'customers', 'id': 'c_id', 'prefix': 'c', 'search': 'customer_search'},
+    'farmers': {'table': 'farmers', 'id': 'f_id', 'prefix': 'f', 'search': 'farmer_search'},
+}
+
+# sort name -> (columns, direction), columns given without the role prefix.
+# Every sort ends on the id so the last row's values are a stable cursor.
+SORTS = {
+    'newest': ((), 'DESC'),
+    'oldest': ((), 'ASC'),
+    'name': (('lastname', 'firstname'), 'ASC'),
+    'login': (('loginname',), 'ASC'),
+}
+COLLATE = {'lastname': ' COLLATE NOCASE', 'firstname': ' COLLATE NOCASE', 'loginname': ''}
+
+
+def parse_filters(args):
+    sort = args.get('sort', 'newest')
+    return {'q': (args.get('q') or '').strip(), 'sort': sort if sort in SORTS else 'newest'}
+
+
+def page(db, role, filters, cursor=None, limit=PAGE_SIZE):
+    """One page of users plus the next-page cursor (None on the last page)."""
+    spec = ROLES[role]
+    p, id_column = spec['prefix'], spec['id']
+    names, direction = SORTS[filters['sort']]
+    columns = [f'{p}_{name}{COLLATE[name]}' for name in names] + [id_column]
+    op = '<' if direction == 'DESC' else '>'
+    after = catalog.decode_cursor(cursor, (int, float, str))
+    if not after or len(after) != len(columns):
+        after = None
+    where, params = [], []
+
+    terms = catalog.search_terms(filters.get('q'))
+    if terms and not names:
+        # Id order: let the full-text index walk its rowids in that order and
+        # stop after one page, rather than collecting every match first.
+        where.append(f"""{id_column} IN (SELECT rowid FROM {spec['search']} WHERE {spec['search']} MATCH ?
+                         {f'AND rowid {op} ?' if after else ''} ORDER BY rowid {direction} LIMIT ?)""")
+        params += [' '.join(f'"{t}"*' for t in terms)] + (after or []) + [limit + 1]
+    elif terms:
+        where.append(f"{id_column} IN (SELECT rowid FROM {spec['search']} WHERE {spec['search']} MATCH ?)")
+        params.append(' '.join(f'"{t}"*' for t in terms))
+
+    if after and names:
+        # The leading-column bound gives SQLite a range to seek to; the row
+        # value comparison then skips the rows of the cursor's own name.
+        where.append(f"{columns[0]} {op}= ? AND ({', '.join(columns)}) {op} ({', '.join('?' * len(columns))})")
+        params += [after[0]] + after
+    elif after:
+        where.append(f'{id_column} {op} ?')
+        params.extend(after)
+
+    rows = db.execute(f'''
+        SELECT {id_column}, {p}_firstname, {p}_lastname, {p}_loginname, {p}_email, {p}_contact, {p}_address
+        FROM {spec['table']}
+        {('WHERE ' + ' AND '.join(where)) if where else ''}
+        ORDER BY {', '.join(f'{c} {direction}' for c in columns)}
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = catalog.encode_cursor([last[f'{p}_{name}'] for name in names] + [last[id_column]])
+    return rows, next_cursor
+
+
+def customer_stats(db, c_ids):
+    """{c_id: {'orders', 'spent'}} for the given customers over their whole
+    history, archived orders included, in one grouped query."""
+    if not c_ids:
+        return {}
+    rows = db.execute(f'''
+        SELECT c_id, COUNT(*) AS orders, ROUND(SUM(o_amount), 2) AS spent
+        FROM all_orders WHERE c_id IN ({', '.join('?' * len(c_ids))})
+        GROUP BY c_id
+    ''', list(c_ids)).fetchall()
+    return {r['c_id']: dict(r) for r in rows}
+
+
+def farmer_stats(db, f_ids):
+    """{f_id: {'products', 'orders', 'revenue'}} for the given farmers, in one
+    grouped query over products and the farmer_sales summary."""
+    if not f_ids:
+        return {}
+    placeholders = ', '.join('?' * len(f_ids))
+    rows = db.execute(f'''
+        SELECT f_id, SUM(products) AS products, SUM(orders) AS orders, ROUND(SUM(revenue), 2) AS revenue
+        FROM (
+            SELECT f_id, COUNT(*) AS products, 0 AS orders, 0 AS revenue
+            FROM products WHERE f_id IN ({placeholders}) GROUP BY f_id
+            UNION ALL
+            SELECT f_id, 0, SUM(orders), SUM(revenue)
+            FROM farmer_sales WHERE f_id IN ({placeholders}) GROUP BY f_id
+        )
+        GROUP BY f_id
+    ''', list(f_ids) * 2).fetchall()
+    return {r['f_id']: dict(r) for r in rows}